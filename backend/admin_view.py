@@ -1,23 +1,126 @@
-from flask import Flask, render_template
-from pymongo import MongoClient
-from bson import json_util
+from flask import Flask, render_template, request, Response, abort, stream_with_context
+from models.db import get_db
+from config import ADMIN_PAGE_SIZE, ADMIN_MAX_PAGE_SIZE, ADMIN_EXPORT_BATCH_SIZE
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+from datetime import datetime
 import json
 
 app = Flask(__name__)
-client = MongoClient('mongodb://localhost:27017/')
-db = client.bot_detector
+db = get_db()
+
+# Fields that can be megabytes per document; left out of pages unless
+# ?full=1 is passed
+LARGE_FIELDS = ('user_data', 'report')
+
+
+def _collection_or_404(name):
+    if name not in db.list_collection_names():
+        abort(404)
+    return db[name]
+
+
+def _build_query(args):
+    """
+    Server-side filters shared by the page and export views:
+    username, from/to (ISO dates on timestamp) and after (an _id cursor)
+    """
+    query = {}
+    if args.get('username'):
+        query['username'] = args['username']
+
+    timestamp = {}
+    try:
+        if args.get('from'):
+            timestamp['$gte'] = datetime.fromisoformat(args['from'])
+        if args.get('to'):
+            timestamp['$lt'] = datetime.fromisoformat(args['to'])
+        if args.get('after'):
+            query['_id'] = {'$lt': ObjectId(args['after'])}
+    except (ValueError, InvalidId):
+        abort(400)
+    if timestamp:
+        query['timestamp'] = timestamp
+    return query
+
+
+def _projection(args):
+    if args.get('full') == '1':
+        return None
+    return {field: 0 for field in LARGE_FIELDS}
 
 
 @app.route('/')
 def admin_view():
-    # Get all collections and their data
-    collections_data = {}
-    for collection_name in db.list_collection_names():
-        documents = list(db[collection_name].find({}))
-        collections_data[collection_name] = json.loads(
-            json_util.dumps(documents))
-
-    return render_template('admin.html', collections_data=collections_data)
+    # Only names and estimated counts: no documents are loaded here
+    collections = [
+        {'name': name, 'count': db[name].estimated_document_count()}
+        for name in sorted(db.list_collection_names())
+    ]
+    return render_template('admin.html', collections=collections,
+                           collection_name=None, documents=[], columns=[],
+                           next_after=None, filters={})
+
+
+@app.route('/collection/<name>')
+def collection_page(name):
+    collection = _collection_or_404(name)
+    try:
+        limit = min(int(request.args.get('limit', ADMIN_PAGE_SIZE)), ADMIN_MAX_PAGE_SIZE)
+    except ValueError:
+        abort(400)
+
+    # Newest first by _id so "after" is a stable cursor regardless of
+    # how deep the page is (no skip())
+    cursor = collection.find(_build_query(request.args), projection=_projection(request.args)) \
+        .sort('_id', -1).limit(limit)
+    documents = json.loads(json_util.dumps(list(cursor)))
+
+    columns = []
+    for doc in documents:
+        for key in doc:
+            if key not in columns:
+                columns.append(key)
+
+    next_after = documents[-1]['_id']['$oid'] if len(documents) == limit else None
+    filters = {key: request.args.get(key, '') for key in ('username', 'from', 'to', 'full')}
+    collections = [{'name': n, 'count': None} for n in sorted(db.list_collection_names())]
+    return render_template('admin.html', collections=collections, collection_name=name,
+                           documents=documents, columns=columns,
+                           next_after=next_after, filters=filters)
+
+
+@app.route('/collection/<name>/export')
+def collection_export(name):
+    """
+    Stream a collection as NDJSON (default) or a JSON array. Documents are
+    read from the cursor in batches and written out one at a time, so
+    memory use does not grow with collection size
+    """
+    collection = _collection_or_404(name)
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'json'):
+        abort(400)
+    cursor = collection.find(_build_query(request.args), projection=_projection(request.args),
+                             batch_size=ADMIN_EXPORT_BATCH_SIZE).sort('_id', -1)
+
+    def generate_ndjson():
+        for doc in cursor:
+            yield json_util.dumps(doc) + '\n'
+
+    def generate_json():
+        yield '['
+        for i, doc in enumerate(cursor):
+            yield (',\n' if i else '\n') + json_util.dumps(doc)
+        yield '\n]\n'
+
+    if export_format == 'json':
+        body, mimetype = generate_json(), 'application/json'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={name}.{export_format}'
+    })
 
 
 if __name__ == '__main__':
@@ -1,15 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
-import os
 from dotenv import load_dotenv
 import logging
-from utils.reddit_api import get_reddit_user_details
-from utils.preprocessing import preprocess_data
-from utils.gemini import generate_report
-import joblib
+from utils.reddit_api import get_reddit_user_details, get_cache_stats
+from utils.preprocessing import preprocess_batch
+from utils.gemini import get_report_cache_stats, get_report_generation_stats, create_fallback_analysis
+from utils.pipeline import (normalize_usernames, iter_batch_predictions, build_features,
+                            cached_prediction, get_predict_cache_stats)
+from utils.features import features_as_dict, feature_timer
+from utils.jobs import report_jobs, JobQueueFull
+from utils.llm import llm_client
+from utils.singleflight import get_singleflight_stats
+from utils.sweep import sweeps, TooManySweeps
+from utils.minhash import similarity_index
+from utils.graph import account_graph, run_ring_job
+from models import repository
+from models.db import is_available
+from models.indexes import ensure_indexes
+from models.registry import model_registry, ModelUnavailable, CANDIDATE
+from config import (BATCH_MAX_USERNAMES, HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT,
+                    MONGODB_ENSURE_INDEXES, EXTENDED_FEATURES_ENABLED, ADMIN_TOKEN,
+                    SWEEP_BATCH_SIZE, SWEEP_MAX_WINDOW_HOURS, SIMILARITY_ENABLED,
+                    SIMILARITY_THRESHOLD, GRAPH_ENABLED)
+import hmac
+import threading
+import json
+import time
 from datetime import datetime
-import pymongo
 
 # Load environment variables
 load_dotenv()
@@ -29,29 +46,19 @@ CORS(app, resources={
     }
 })
 
-# MongoDB connection
-mongodb_available = False
-try:
-    client = MongoClient(os.getenv(
-        'MONGODB_URI', 'mongodb://localhost:27017/'), serverSelectionTimeoutMS=5000)
-    client.admin.command('ping')  # Test connection
-    db = client.bot_detector
-    mongodb_available = True
-    logger.info("MongoDB connection successful")
-except pymongo.errors.ServerSelectionTimeoutError:
-    logger.warning("MongoDB connection failed - running in offline mode")
-    client = None
-    db = None
-
-# Load pre-trained model
-try:
-    model_path = os.path.join(os.path.dirname(
-        __file__), "models/reddit_bot_detection_model.pkl")
-    model = joblib.load(model_path)
-    logger.info("Model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading model: {str(e)}")
-    model = None
+# Create MongoDB indexes (idempotent)
+if MONGODB_ENSURE_INDEXES and is_available():
+    try:
+        ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create MongoDB indexes: {str(e)}")
+
+# Load pre-trained model once at import; under gunicorn with preload_app the
+# forked workers share this instance. Versions set through the admin API
+# before a restart are then applied over the configured ones
+model_registry.load()
+model_registry.load(CANDIDATE)
+model_registry.sync_state()
 
 
 @app.route("/api/predict", methods=["POST"])
@@ -63,40 +70,162 @@ def predict():
         if not username:
             return jsonify({"error": "Missing username"}), 400
 
-        # Fetch Reddit user details
-        user_data = get_reddit_user_details(username)
-        if not user_data:
+        response_data, cache_status = cached_prediction(
+            model_registry, username, lambda: _compute_prediction(username))
+        if not response_data:
             return jsonify({"error": "User not found"}), 404
 
-        # Predict bot status
-        features = preprocess_data(user_data)
-        prediction = model.predict([features])[0]
+        # Every scan is recorded, whether the result was cached or not
+        _save_scan(username, response_data)
 
-        # Store prediction in MongoDB if available
-        if mongodb_available:
-            try:
-                prediction_data = {
-                    "username": username,
-                    "prediction": bool(prediction),
-                    "timestamp": datetime.utcnow(),
-                    "user_data": user_data
-                }
-                db.predictions.insert_one(prediction_data)
-            except Exception as e:
-                logger.warning(
-                    f"Could not store prediction in MongoDB: {str(e)}")
-
-        response_data = {
-            **user_data,
-            "is_bot": bool(prediction)
-        }
-        return jsonify(response_data)
+        response = jsonify(response_data)
+        response.headers["X-Cache"] = cache_status
+        return response
 
+    except ModelUnavailable:
+        return jsonify({"error": "Model not loaded"}), 503
     except Exception as e:
         logger.error(f"Prediction error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
+def _compute_prediction(username):
+    """
+    Fetch and score one user; the /api/predict response body, or None if
+    the user does not exist. Also run by the prediction cache to refresh
+    stale entries, outside of any request, so it stores nothing itself
+    """
+    # Fetch Reddit user details
+    user_data = get_reddit_user_details(username)
+    if not user_data:
+        return None
+
+    # Predict bot status
+    labels, probabilities, versions = model_registry.score(
+        preprocess_batch([user_data]), [username])
+    prediction = labels[0]
+    bot_probability = float(probabilities[0]) if probabilities is not None else None
+
+    # Extended activity features (recorded for analysis and retraining)
+    extended_features = None
+    if EXTENDED_FEATURES_ENABLED:
+        vector, timings = build_features({**user_data, "bot_probability": bot_probability})
+        extended_features = features_as_dict(vector)
+        logger.info(f"Feature timings for {username} (ms): {timings}")
+
+    return {
+        **user_data,
+        "is_bot": bool(prediction),
+        "bot_probability": bot_probability,
+        "model_version": versions[0],
+        "features": extended_features
+    }
+
+
+def _save_scan(username, result):
+    """Store one /api/predict result in MongoDB if available"""
+    repository.save_prediction({
+        "username": username,
+        "prediction": result["is_bot"],
+        "bot_probability": result["bot_probability"],
+        "model_version": result["model_version"],
+        "features": result["features"],
+        "timestamp": datetime.utcnow(),
+        "user_data": {k: v for k, v in result.items()
+                      if k not in ("is_bot", "bot_probability", "model_version", "features")}
+    })
+
+
+@app.route("/api/predict/batch", methods=["POST"])
+def predict_batch():
+    data = request.get_json(silent=True) or {}
+    usernames = data.get("screen_names")
+
+    if not isinstance(usernames, list) or not usernames:
+        return jsonify({"error": "Missing screen_names list"}), 400
+
+    usernames = normalize_usernames(usernames)
+    if not usernames:
+        return jsonify({"error": "Missing screen_names list"}), 400
+    if len(usernames) > BATCH_MAX_USERNAMES:
+        return jsonify({"error": f"Too many usernames (max {BATCH_MAX_USERNAMES})"}), 400
+    try:
+        model_registry.get()
+    except ModelUnavailable:
+        return jsonify({"error": "Model not loaded"}), 503
+
+    def generate():
+        predictions = []
+        for result in iter_batch_predictions(model_registry, usernames):
+            if "error" not in result:
+                predictions.append({
+                    "username": result["screen_name"],
+                    "prediction": result["is_bot"],
+                    "bot_probability": result.get("bot_probability"),
+                    "model_version": result["model_version"],
+                    "timestamp": datetime.utcnow(),
+                    "user_data": {k: v for k, v in result.items()
+                                  if k not in ("is_bot", "bot_probability", "model_version")}
+                })
+            yield json.dumps(result) + "\n"
+
+        # Store all predictions of the batch in one round-trip
+        repository.save_predictions(predictions)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route("/api/history/<username>", methods=["GET"])
+def history(username):
+    kind = request.args.get('type', repository.PREDICTIONS)
+    if kind not in repository.HISTORY_PROJECTIONS:
+        return jsonify({'error': f"Unknown history type: {kind}"}), 400
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT)
+        before = request.args.get('before')
+        before = datetime.fromisoformat(before) if before else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or before parameter'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit or before parameter'}), 400
+    if not is_available():
+        return jsonify({'error': 'History unavailable (MongoDB unavailable)'}), 503
+
+    items = repository.find_history(kind, username, limit=limit, before=before)
+    for item in items:
+        item['_id'] = str(item['_id'])
+        item['timestamp'] = item['timestamp'].isoformat()
+    return jsonify({
+        'username': username,
+        'type': kind,
+        'items': items,
+        'next_before': items[-1]['timestamp'] if len(items) == limit else None
+    }), 200
+
+
+@app.route("/api/similar/<username>", methods=["GET"])
+def similar_accounts(username):
+    """Accounts whose text is near-duplicate of username's (MinHash estimate)"""
+    if not SIMILARITY_ENABLED:
+        return jsonify({'error': 'Similarity index disabled'}), 503
+    try:
+        threshold = float(request.args.get('threshold', SIMILARITY_THRESHOLD))
+        limit = min(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid threshold or limit parameter'}), 400
+    if not 0 <= threshold <= 1 or limit < 1:
+        return jsonify({'error': 'Invalid threshold or limit parameter'}), 400
+
+    similar = similarity_index.similar(username, threshold, limit)
+    if similar is None:
+        return jsonify({'error': f"{username} has not been scanned yet"}), 404
+    return jsonify({
+        'username': username,
+        'threshold': threshold,
+        'similar': [{'username': name, 'similarity': score} for name, score in similar]
+    }), 200
+
+
 @app.route("/api/feedback", methods=["POST"])
 def submit_feedback():
     try:
@@ -109,18 +238,12 @@ def submit_feedback():
             'timestamp': datetime.utcnow()
         }
 
-        if mongodb_available:
-            try:
-                db.feedback.insert_one(feedback_data)
-                return jsonify({'message': 'Feedback submitted successfully'}), 200
-            except Exception as e:
-                logger.warning(
-                    f"Could not store feedback in MongoDB: {str(e)}")
-                return jsonify({'message': 'Feedback received but not stored (MongoDB unavailable)'}), 200
-        else:
-            logger.info(
-                "Feedback received but not stored (MongoDB unavailable)")
-            return jsonify({'message': 'Feedback received but not stored (MongoDB unavailable)'}), 200
+        repository.save_feedback(feedback_data)
+        if is_available():
+            return jsonify({'message': 'Feedback submitted successfully'}), 200
+        logger.info(
+            "Feedback received, stored once MongoDB is available")
+        return jsonify({'message': 'Feedback received, stored once MongoDB is available'}), 200
 
     except Exception as e:
         logger.error(f"Feedback error: {str(e)}")
@@ -136,40 +259,211 @@ def generate_report_endpoint():
         if not user_data:
             return jsonify({'error': 'No user data provided'}), 400
 
-        report_text = generate_report(user_data)
-
-        # Store report in MongoDB if available
-        if mongodb_available:
-            try:
-                report_data = {
-                    'username': user_data.get('screen_name'),
-                    'report': report_text,
-                    'timestamp': datetime.utcnow()
-                }
-                db.reports.insert_one(report_data)
-            except Exception as e:
-                logger.warning(f"Could not store report in MongoDB: {str(e)}")
+        # Fresh LLM reports are stored by generate_report, tagged with their
+        # cache key; cached and fallback reports are not stored again
+        job = report_jobs.submit(user_data)
+        if job['status'] == 'done':
+            return jsonify({
+                'message': 'Report generated successfully',
+                'report': job['report'],
+                'job_id': job['job_id']
+            }), 200
 
+        # The local analysis is usable right away; the LLM report replaces
+        # it once the job is done
         return jsonify({
-            'message': 'Report generated successfully',
-            'report': report_text
+            'message': 'Report generation started',
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'analysis': job['analysis']
+        }), 202
+    except JobQueueFull as e:
+        # The LLM is only enrichment: answer with the local analysis
+        logger.warning(f"Report queue full: {str(e)}")
+        return jsonify({
+            'message': 'Report queue full, returning local analysis',
+            'report': create_fallback_analysis(user_data)
         }), 200
     except Exception as e:
         logger.error(f"Report generation error: {str(e)}")
         return jsonify({'error': str(e)}), 400
 
 
+@app.route("/api/reports/<job_id>", methods=["GET"])
+def get_report_job(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Report job not found'}), 404
+    return jsonify(job), 200
+
+
+def _admin_denied():
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin API disabled (ADMIN_TOKEN not set)'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+
+@app.route('/api/admin/models', methods=['GET'])
+def admin_models():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(model_registry.stats()), 200
+
+
+@app.route('/api/admin/models/reload', methods=['POST'])
+def admin_models_reload():
+    """
+    Reload the primary model, optionally from a new path. The new version
+    is swapped in atomically; the old one is kept for rollback. The worker
+    serving this request reloads at once, the others within
+    MODEL_RELOAD_INTERVAL through the registry state file
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    loaded = model_registry.load(path=data.get('path'))
+    if loaded is None:
+        return jsonify({'error': f"Could not load model: {model_registry.error}"}), 400
+    model_registry.save_state()
+    return jsonify(model_registry.stats()), 200
+
+
+@app.route('/api/admin/models/candidate', methods=['POST', 'DELETE'])
+def admin_models_candidate():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'DELETE':
+        model_registry.clear_candidate()
+        return jsonify(model_registry.stats()), 200
+    data = request.get_json(silent=True) or {}
+    try:
+        model_registry.set_candidate(data.get('path'), data.get('mode'), data.get('traffic'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(model_registry.stats()), 200
+
+
+@app.route('/api/admin/models/promote', methods=['POST'])
+def admin_models_promote():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        model_registry.promote()
+    except ModelUnavailable as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(model_registry.stats()), 200
+
+
+@app.route('/api/admin/models/rollback', methods=['POST'])
+def admin_models_rollback():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        model_registry.rollback()
+    except ModelUnavailable as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(model_registry.stats()), 200
+
+
+@app.route('/api/admin/sweeps', methods=['GET', 'POST'])
+def admin_sweeps():
+    """
+    Start a sweep of every author active in a subreddit: {"subreddit",
+    "hours"} for the last hours, or {"subreddit", "start", "end"} in epoch
+    seconds. Starting the same subreddit and window again resumes it from
+    its checkpoint
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'GET':
+        return jsonify({'sweeps': sweeps.list()}), 200
+
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('start') is not None:
+            start, end = float(data['start']), float(data.get('end') or time.time())
+        else:
+            end = time.time()
+            start = end - float(data.get('hours', 24)) * 3600
+        if end - start > SWEEP_MAX_WINDOW_HOURS * 3600:
+            raise ValueError(f"Window longer than {SWEEP_MAX_WINDOW_HOURS} hours")
+        model_registry.get()
+        sweep = sweeps.start(model_registry, data.get('subreddit'), start, end,
+                             batch_size=int(data.get('batch_size', SWEEP_BATCH_SIZE)),
+                             features=bool(data.get('features', False)))
+    except ModelUnavailable:
+        return jsonify({'error': 'Model not loaded'}), 503
+    except TooManySweeps as e:
+        return jsonify({'error': str(e)}), 429
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(sweep.stats()), 202
+
+
+@app.route('/api/admin/sweeps/<sweep_id>', methods=['GET', 'DELETE'])
+def admin_sweep(sweep_id):
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'DELETE':
+        stats = sweeps.cancel(sweep_id)
+    else:
+        stats = sweeps.get(sweep_id)
+    if stats is None:
+        return jsonify({'error': 'Sweep not found'}), 404
+    return jsonify(stats), 200
+
+
+@app.route('/api/admin/graph/rings', methods=['GET', 'POST'])
+def admin_bot_rings():
+    """
+    Bot rings found by the last ring job (GET), or start a new run of the
+    job in the background (POST)
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if not GRAPH_ENABLED:
+        return jsonify({'error': 'Account graph disabled'}), 503
+    if request.method == 'POST':
+        if account_graph.stats()['job_running']:
+            return jsonify({'error': 'A bot ring job is already running'}), 409
+        threading.Thread(target=run_ring_job, daemon=True, name='bot-rings').start()
+        return jsonify(account_graph.stats()), 202
+    return jsonify({'graph': account_graph.stats(), 'rings': account_graph.list_rings()}), 200
+
+
 @app.route('/health')
 def health_check():
     health_status = {
         'status': 'healthy',
-        'mongodb': 'connected' if mongodb_available else 'disconnected',
-        'model': 'loaded' if model is not None else 'not loaded',
+        'mongodb': 'connected' if is_available() else 'disconnected',
+        'model': 'loaded' if model_registry.model is not None else 'not loaded',
+        'model_info': model_registry.stats(),
+        'reddit_cache': get_cache_stats(),
+        'predict_cache': get_predict_cache_stats(),
+        'report_cache': get_report_cache_stats(),
+        'llm': llm_client.stats(),
+        'report_generation': get_report_generation_stats(),
+        'report_jobs': report_jobs.stats(),
+        'singleflight': get_singleflight_stats(),
+        'bulk_writer': repository.get_writer_stats(),
+        'feature_timings': feature_timer.stats(),
+        'similarity_index': similarity_index.stats() if SIMILARITY_ENABLED else None,
+        'account_graph': account_graph.stats() if GRAPH_ENABLED else None,
         'timestamp': datetime.utcnow().isoformat()
     }
 
     # Status is only unhealthy if model is not loaded
-    status_code = 200 if model is not None else 500
+    status_code = 200 if model_registry.model is not None else 500
 
     return jsonify(health_status), status_code
 
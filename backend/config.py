@@ -9,8 +9,228 @@ REDDIT_CLIENT_ID = os.getenv('REDDIT_CLIENT_ID')
 REDDIT_CLIENT_SECRET = os.getenv('REDDIT_CLIENT_SECRET')
 REDDIT_USER_AGENT = os.getenv('REDDIT_USER_AGENT')
 
+# Reddit profile cache Configuration (TTLs in seconds)
+REDDIT_CACHE_SIZE = int(os.getenv('REDDIT_CACHE_SIZE', 10000))
+REDDIT_CACHE_TTL = int(os.getenv('REDDIT_CACHE_TTL', 300))
+REDDIT_CACHE_NEGATIVE_TTL = int(os.getenv('REDDIT_CACHE_NEGATIVE_TTL', 60))
+
+# Async Reddit fetcher Configuration (used for bulk lookups)
+REDDIT_ASYNC_ENABLED = os.getenv('REDDIT_ASYNC_ENABLED', 'true').lower() == 'true'
+REDDIT_AUTH_URL = os.getenv('REDDIT_AUTH_URL', 'https://www.reddit.com/api/v1/access_token')
+REDDIT_API_BASE = os.getenv('REDDIT_API_BASE', 'https://oauth.reddit.com')
+REDDIT_ASYNC_CONCURRENCY = int(os.getenv('REDDIT_ASYNC_CONCURRENCY', 16))
+REDDIT_REQUESTS_PER_MINUTE = int(os.getenv('REDDIT_REQUESTS_PER_MINUTE', 100))
+REDDIT_REQUEST_TIMEOUT = float(os.getenv('REDDIT_REQUEST_TIMEOUT', 10))
+
+# Model Configuration
+MODEL_PATH = os.getenv('MODEL_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'models', 'reddit_bot_detection_model.pkl'))
+# Load the model through an uncompressed joblib copy with its plain numpy
+# arrays memory-mapped. Tree ensembles keep most of their data in objects
+# joblib cannot map, so for them this saves little; sharing between
+# workers comes from gunicorn's preload_app and gc.freeze
+MODEL_MMAP = os.getenv('MODEL_MMAP', 'true').lower() == 'true'
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'models', '.cache'))
+# Admin changes to the registry (reload from a path, candidate, promote,
+# rollback) are written here and applied by every worker at its next check
+MODEL_STATE_PATH = os.getenv('MODEL_STATE_PATH', os.path.join(MODEL_CACHE_DIR, 'registry.json'))
+# How often (seconds) each worker checks the model files for changes and
+# hot-reloads them; 0 disables watching (admin reloads still work)
+MODEL_RELOAD_INTERVAL = float(os.getenv('MODEL_RELOAD_INTERVAL', 30))
+# Optional candidate model: 'shadow' scores every batch with it in the
+# background and logs its outputs, 'split' serves MODEL_CANDIDATE_TRAFFIC
+# of users (by username hash) from it
+MODEL_CANDIDATE_PATH = os.getenv('MODEL_CANDIDATE_PATH', '')
+MODEL_CANDIDATE_MODE = os.getenv('MODEL_CANDIDATE_MODE', 'shadow')
+MODEL_CANDIDATE_TRAFFIC = float(os.getenv('MODEL_CANDIDATE_TRAFFIC', 0.1))
+MODEL_SHADOW_MAX_PENDING = int(os.getenv('MODEL_SHADOW_MAX_PENDING', 100))
+# Held-out rows (.npz with X and y) every loaded model is scored on once
+# at load; defaults to the <model>.eval.npz written by scripts/train_model.py
+MODEL_EVAL_DATA = os.getenv('MODEL_EVAL_DATA', '')
+# Required in the X-Admin-Token header by /api/admin/* (disabled when unset)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Feature extraction Configuration
+EXTENDED_FEATURES_ENABLED = os.getenv('EXTENDED_FEATURES_ENABLED', 'true').lower() == 'true'
+FEATURE_ACTIVITY_LIMIT = int(os.getenv('FEATURE_ACTIVITY_LIMIT', 100))
+# Keep running per-user aggregates so rescans only fetch new activity
+FEATURE_STORE_ENABLED = os.getenv('FEATURE_STORE_ENABLED', 'true').lower() == 'true'
+# Upper bound on new items read per listing during a rescan
+FEATURE_STORE_MAX_NEW_ITEMS = int(os.getenv('FEATURE_STORE_MAX_NEW_ITEMS', 1000))
+FEATURE_STORE_LOCAL_SIZE = int(os.getenv('FEATURE_STORE_LOCAL_SIZE', 10000))
+
+# Near-duplicate text index Configuration: MinHash signatures of each
+# scanned account's n-grams (NUM_PERM values, split into BANDS LSH bands;
+# about 4 * NUM_PERM + 16 * BANDS bytes per account). Every worker merges
+# its accounts into SIMILARITY_INDEX_PATH, and the others' into its own
+# copy, every SIMILARITY_SAVE_INTERVAL seconds and on exit
+SIMILARITY_ENABLED = os.getenv('SIMILARITY_ENABLED', 'true').lower() == 'true'
+SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'models', 'similarity_index.npz'))
+SIMILARITY_NUM_PERM = int(os.getenv('SIMILARITY_NUM_PERM', 64))
+SIMILARITY_BANDS = int(os.getenv('SIMILARITY_BANDS', 16))
+# Estimated Jaccard similarity at which two accounts count as similar
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.5))
+SIMILARITY_SAVE_INTERVAL = int(os.getenv('SIMILARITY_SAVE_INTERVAL', 300))
+# Candidates read per band bucket (bounds lookups in huge buckets)
+SIMILARITY_MAX_BUCKET = int(os.getenv('SIMILARITY_MAX_BUCKET', 1000))
+
+# Account graph Configuration (bot ring detection). Memory budget with the
+# defaults, about 300 MB: ~120 bytes per account (name, score, ring), 8 per
+# stored edge (two kinds of GRAPH_MAX_EDGES each), 12 per logged comment
+# and 8 per account-subreddit pair (~20 per account); the ring job needs
+# up to as much again while it runs
+GRAPH_ENABLED = os.getenv('GRAPH_ENABLED', 'true').lower() == 'true'
+GRAPH_PATH = os.getenv('GRAPH_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'models', 'account_graph.npz'))
+GRAPH_MAX_ACCOUNTS = int(os.getenv('GRAPH_MAX_ACCOUNTS', 500000))
+GRAPH_MAX_EDGES = int(os.getenv('GRAPH_MAX_EDGES', 5000000))
+GRAPH_MAX_COMMENTS = int(os.getenv('GRAPH_MAX_COMMENTS', 5000000))
+# Comments in one thread this many seconds apart count as co-commenting
+GRAPH_CO_COMMENT_WINDOW = int(os.getenv('GRAPH_CO_COMMENT_WINDOW', 120))
+GRAPH_MAX_THREAD_PARTNERS = int(os.getenv('GRAPH_MAX_THREAD_PARTNERS', 50))
+# An edge kind counts for a pair from these minimums on; subreddits with
+# more known members than GRAPH_MAX_SUBREDDIT_ACCOUNTS are ignored
+GRAPH_MIN_SHARED_SUBREDDITS = int(os.getenv('GRAPH_MIN_SHARED_SUBREDDITS', 3))
+GRAPH_MAX_SUBREDDIT_ACCOUNTS = int(os.getenv('GRAPH_MAX_SUBREDDIT_ACCOUNTS', 200))
+GRAPH_MIN_CO_COMMENTS = int(os.getenv('GRAPH_MIN_CO_COMMENTS', 2))
+# Two accounts are linked when the weights of their qualifying edge kinds
+# add up to GRAPH_EDGE_THRESHOLD (by default shared subreddits alone do not)
+GRAPH_WEIGHT_SUBREDDIT = float(os.getenv('GRAPH_WEIGHT_SUBREDDIT', 0.5))
+GRAPH_WEIGHT_CO_COMMENT = float(os.getenv('GRAPH_WEIGHT_CO_COMMENT', 1.0))
+GRAPH_WEIGHT_CONTENT = float(os.getenv('GRAPH_WEIGHT_CONTENT', 1.0))
+GRAPH_EDGE_THRESHOLD = float(os.getenv('GRAPH_EDGE_THRESHOLD', 1.0))
+# Linked clusters larger than GRAPH_MAX_RING_SIZE are split into communities
+GRAPH_MIN_RING_SIZE = int(os.getenv('GRAPH_MIN_RING_SIZE', 3))
+GRAPH_MAX_RING_SIZE = int(os.getenv('GRAPH_MAX_RING_SIZE', 200))
+GRAPH_RING_BOT_FRACTION = float(os.getenv('GRAPH_RING_BOT_FRACTION', 0.5))
+GRAPH_LPA_ITERATIONS = int(os.getenv('GRAPH_LPA_ITERATIONS', 20))
+# Each worker saves its copy of the graph this often, merging it with the
+# other workers' copies in GRAPH_PATH
+GRAPH_SAVE_INTERVAL = int(os.getenv('GRAPH_SAVE_INTERVAL', 300))
+# Seconds between background ring jobs (0: only through the API or script),
+# run by one worker at a time
+GRAPH_RING_INTERVAL = int(os.getenv('GRAPH_RING_INTERVAL', 0))
+
 # MongoDB Configuration
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+MONGODB_DB = os.getenv('MONGODB_DB', 'bot_detector')
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', 50))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', 0))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 2000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 2000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 10000))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 2000))
+# Seconds to trust the last connectivity check before pinging again
+MONGODB_HEALTH_CHECK_INTERVAL = int(os.getenv('MONGODB_HEALTH_CHECK_INTERVAL', 30))
+# Create indexes when the app starts (also available as manage_db.py indexes)
+MONGODB_ENSURE_INDEXES = os.getenv('MONGODB_ENSURE_INDEXES', 'true').lower() == 'true'
+# Raw Reddit user_data snapshots expire after this many days (TTL index)
+USER_DATA_TTL_DAYS = int(os.getenv('USER_DATA_TTL_DAYS', 30))
+
+# Buffered bulk writer Configuration (interval and timeout in seconds)
+BULK_WRITE_BATCH_SIZE = int(os.getenv('BULK_WRITE_BATCH_SIZE', 500))
+BULK_WRITE_FLUSH_INTERVAL = float(os.getenv('BULK_WRITE_FLUSH_INTERVAL', 1.0))
+BULK_WRITE_MAX_QUEUE = int(os.getenv('BULK_WRITE_MAX_QUEUE', 10000))
+BULK_WRITE_ENQUEUE_TIMEOUT = float(os.getenv('BULK_WRITE_ENQUEUE_TIMEOUT', 0.05))
+BULK_WRITE_SPILL_DIR = os.getenv('BULK_WRITE_SPILL_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'spill'))
 
 # Gemini API Configuration
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY') 
\ No newline at end of file
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY') 
+
+# LLM client Configuration: 'gemini' or 'stub' (offline, see utils/llm.py)
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'gemini')
+# Deadline (seconds) per call, including time waiting for a free slot
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 15))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+# Consecutive failures that open the circuit, and seconds before a retry
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', 30))
+# Send a duplicate call when the first is slower than this; 0 disables
+LLM_HEDGE_AFTER_MS = float(os.getenv('LLM_HEDGE_AFTER_MS', 0))
+LLM_STUB_LATENCY_MS = float(os.getenv('LLM_STUB_LATENCY_MS', 500))
+LLM_STUB_FAILURE_RATE = float(os.getenv('LLM_STUB_FAILURE_RATE', 0.0))
+# Output cap for a report; the schema'd JSON is typically 300-500 tokens
+REPORT_MAX_OUTPUT_TOKENS = int(os.getenv('REPORT_MAX_OUTPUT_TOKENS', 768))
+# The LLM only enriches reports; without it (or a Gemini key) the locally
+# built analysis is returned
+GEMINI_ENABLED = os.getenv('GEMINI_ENABLED', 'true').lower() == 'true' and \
+    (LLM_PROVIDER != 'gemini' or bool(GEMINI_API_KEY))
+
+# Gemini report cache Configuration (TTL in seconds)
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 2000))
+REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 6 * 3600))
+
+# Prediction result cache Configuration (TTLs in seconds): results are
+# served as is for the fresh TTL, then until the stale TTL while a
+# background refresh recomputes them
+PREDICT_CACHE_ENABLED = os.getenv('PREDICT_CACHE_ENABLED', 'true').lower() == 'true'
+PREDICT_CACHE_SIZE = int(os.getenv('PREDICT_CACHE_SIZE', 5000))
+PREDICT_CACHE_MAX_BYTES = int(os.getenv('PREDICT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PREDICT_CACHE_FRESH_TTL = int(os.getenv('PREDICT_CACHE_FRESH_TTL', 300))
+PREDICT_CACHE_STALE_TTL = int(os.getenv('PREDICT_CACHE_STALE_TTL', 3600))
+PREDICT_CACHE_REFRESH_WORKERS = int(os.getenv('PREDICT_CACHE_REFRESH_WORKERS', 2))
+
+# Request coalescing Configuration: concurrent identical Reddit fetches,
+# predictions and reports run once per process. With distributed on,
+# Reddit fetches and reports are also shared across workers through a
+# lock collection in MongoDB (lease and shared result TTL in seconds)
+SINGLEFLIGHT_DISTRIBUTED = os.getenv('SINGLEFLIGHT_DISTRIBUTED', 'false').lower() == 'true'
+SINGLEFLIGHT_LEASE = float(os.getenv('SINGLEFLIGHT_LEASE', 30))
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv('SINGLEFLIGHT_RESULT_TTL', 5))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('SINGLEFLIGHT_POLL_INTERVAL', 0.05))
+
+# Background report job Configuration (TTL in seconds)
+REPORT_JOB_WORKERS = int(os.getenv('REPORT_JOB_WORKERS', 4))
+REPORT_JOB_MAX_PENDING = int(os.getenv('REPORT_JOB_MAX_PENDING', 200))
+REPORT_JOB_TTL = int(os.getenv('REPORT_JOB_TTL', 3600))
+
+# Batch prediction Configuration
+BATCH_MAX_USERNAMES = int(os.getenv('BATCH_MAX_USERNAMES', 500))
+BATCH_FETCH_WORKERS = int(os.getenv('BATCH_FETCH_WORKERS', 16))
+# Found users are scored (and streamed) once BATCH_SCORE_CHUNK_SIZE are
+# waiting or the first of them has waited BATCH_SCORE_MAX_WAIT seconds
+BATCH_SCORE_CHUNK_SIZE = int(os.getenv('BATCH_SCORE_CHUNK_SIZE', 25))
+BATCH_SCORE_MAX_WAIT = float(os.getenv('BATCH_SCORE_MAX_WAIT', 1.0))
+
+# Subreddit sweep Configuration: authors are scored SWEEP_BATCH_SIZE at a
+# time with at most SWEEP_QUEUE_SIZE waiting; API sweeps keep their
+# checkpoints in SWEEP_CHECKPOINT_DIR. With MongoDB, running sweeps hold
+# leases (renewed every third of SWEEP_LEASE seconds) that enforce
+# SWEEP_MAX_RUNNING across workers, and their status is kept for
+# SWEEP_STATUS_TTL seconds after the last update. Each worker also keeps
+# its finished sweeps in memory for that long, at most SWEEP_MAX_FINISHED
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', 100))
+SWEEP_QUEUE_SIZE = int(os.getenv('SWEEP_QUEUE_SIZE', 1000))
+SWEEP_MAX_RUNNING = int(os.getenv('SWEEP_MAX_RUNNING', 1))
+SWEEP_MAX_WINDOW_HOURS = float(os.getenv('SWEEP_MAX_WINDOW_HOURS', 168))
+SWEEP_LEASE = float(os.getenv('SWEEP_LEASE', 60))
+SWEEP_STATUS_TTL = int(os.getenv('SWEEP_STATUS_TTL', 7 * 24 * 3600))
+SWEEP_MAX_FINISHED = int(os.getenv('SWEEP_MAX_FINISHED', 50))
+SWEEP_CHECKPOINT_DIR = os.getenv('SWEEP_CHECKPOINT_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'sweeps'))
+
+# Comment stream watcher Configuration. Each tracked author keeps their
+# last WATCH_WINDOW_SIZE comments (8 bytes each); an author is scored after
+# WATCH_RATE_THRESHOLD comments, or WATCH_REPEAT_THRESHOLD identical ones,
+# within WATCH_RATE_WINDOW seconds (times in seconds)
+WATCH_MAX_AUTHORS = int(os.getenv('WATCH_MAX_AUTHORS', 50000))
+WATCH_WINDOW_SIZE = int(os.getenv('WATCH_WINDOW_SIZE', 32))
+WATCH_RATE_WINDOW = int(os.getenv('WATCH_RATE_WINDOW', 600))
+WATCH_RATE_THRESHOLD = int(os.getenv('WATCH_RATE_THRESHOLD', 10))
+WATCH_REPEAT_THRESHOLD = int(os.getenv('WATCH_REPEAT_THRESHOLD', 3))
+WATCH_IDLE_TTL = int(os.getenv('WATCH_IDLE_TTL', 3600))
+WATCH_SCORE_COOLDOWN = int(os.getenv('WATCH_SCORE_COOLDOWN', 6 * 3600))
+WATCH_SCORE_BATCH_SIZE = int(os.getenv('WATCH_SCORE_BATCH_SIZE', 50))
+WATCH_SCORE_INTERVAL = float(os.getenv('WATCH_SCORE_INTERVAL', 30))
+
+# Scan history Configuration
+HISTORY_DEFAULT_LIMIT = int(os.getenv('HISTORY_DEFAULT_LIMIT', 20))
+HISTORY_MAX_LIMIT = int(os.getenv('HISTORY_MAX_LIMIT', 100))
+
+# Admin view Configuration
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', 50))
+ADMIN_MAX_PAGE_SIZE = int(os.getenv('ADMIN_MAX_PAGE_SIZE', 500))
+ADMIN_EXPORT_BATCH_SIZE = int(os.getenv('ADMIN_EXPORT_BATCH_SIZE', 1000))
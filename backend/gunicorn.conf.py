@@ -0,0 +1,15 @@
+import gc
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+
+# Import the app (and load the model) once in the master; workers are
+# forked from it and share the model's pages copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything allocated so far out of the GC's generations, so
+    # collections in the workers don't touch (and copy) the shared pages
+    gc.freeze()
@@ -0,0 +1,306 @@
+from bson import ObjectId, json_util
+from pymongo.errors import AutoReconnect, BulkWriteError, ServerSelectionTimeoutError
+from config import (BULK_WRITE_BATCH_SIZE, BULK_WRITE_FLUSH_INTERVAL, BULK_WRITE_MAX_QUEUE,
+                    BULK_WRITE_ENQUEUE_TIMEOUT, BULK_WRITE_SPILL_DIR)
+from models.db import get_db, is_available, mark_unavailable
+import atexit
+import glob
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Duplicate key errors are expected when a spill file is replayed twice
+DUPLICATE_KEY = 11000
+# pending_writes.<pid>.ndjson, or .replaying.<pid> once a process claimed it
+_SPILL_FILE = re.compile(r'pending_writes\.(\d+)\.ndjson(?:\.replaying\.(\d+))?$')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BulkWriter:
+    """
+    Write-behind buffer for MongoDB inserts. Request handlers enqueue
+    documents and return; a background thread groups them per collection
+    and writes them with insert_many(ordered=False) whenever max_batch
+    documents are waiting or flush_interval seconds have passed.
+
+    When the queue is full (backpressure) or MongoDB is unreachable the
+    documents are appended to an NDJSON spill file instead of being
+    dropped, and replayed on the next successful flush.
+    """
+
+    def __init__(self, max_batch=BULK_WRITE_BATCH_SIZE, flush_interval=BULK_WRITE_FLUSH_INTERVAL,
+                 max_queue=BULK_WRITE_MAX_QUEUE, enqueue_timeout=BULK_WRITE_ENQUEUE_TIMEOUT,
+                 spill_dir=BULK_WRITE_SPILL_DIR):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_dir = spill_dir
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def _ensure_started(self):
+        # Start lazily and again after a fork: threads don't survive fork,
+        # so a preforked gunicorn worker gets its own queue and flusher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='bulk-writer',
+                                            daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def put(self, collection, document):
+        """
+        Queue a document for insertion. Returns True when it was queued,
+        False when backpressure forced it straight to the spill file
+        """
+        self._ensure_started()
+        try:
+            self._queue.put((collection, document), timeout=self.enqueue_timeout)
+            self.enqueued += 1
+            return True
+        except queue.Full:
+            logger.warning(f"Bulk write queue full, spilling {collection} document")
+            self._spill([(collection, document)])
+            return False
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = []
+            deadline = None
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                self._replay_spill()
+                continue
+
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Drain whatever is already waiting without blocking
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _flush(self, batch):
+        if not is_available():
+            self._spill(batch)
+            return
+
+        start = time.perf_counter()
+        self._write(batch)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+        self._replay_spill()
+
+    def _write(self, batch):
+        by_collection = {}
+        for collection, document in batch:
+            by_collection.setdefault(collection, []).append(document)
+
+        db = get_db()
+        for collection, documents in by_collection.items():
+            try:
+                db[collection].insert_many(documents, ordered=False)
+                self.written += len(documents)
+            except BulkWriteError as e:
+                self.written += e.details.get('nInserted', 0)
+                failed = [err for err in e.details.get('writeErrors', [])
+                          if err.get('code') != DUPLICATE_KEY]
+                if failed:
+                    logger.warning(
+                        f"{len(failed)} {collection} documents rejected by MongoDB")
+                    self.dropped += len(failed)
+            except (AutoReconnect, ServerSelectionTimeoutError) as e:
+                logger.warning(f"MongoDB unreachable, spilling {collection}: {str(e)}")
+                mark_unavailable()
+                self._spill([(collection, document) for document in documents])
+            except Exception as e:
+                logger.error(f"Bulk write to {collection} failed: {str(e)}")
+                self._spill([(collection, document) for document in documents])
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"pending_writes.{os.getpid()}.ndjson")
+
+    def _spill(self, items):
+        try:
+            with self._spill_lock:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(), 'a', encoding='utf-8') as f:
+                    for collection, document in items:
+                        # A fixed _id makes replaying the same document twice
+                        # a duplicate key error rather than a second copy
+                        document.setdefault('_id', ObjectId())
+                        f.write(json_util.dumps(
+                            {'collection': collection, 'document': document}) + '\n')
+            self.spilled += len(items)
+        except Exception as e:
+            logger.error(f"Could not spill {len(items)} documents: {str(e)}")
+            self.dropped += len(items)
+
+    def _replayable_spills(self):
+        """
+        (path, spilling pid) of the spill files this process may replay: its
+        own, and those of dead processes (a restarted worker, or one that
+        died while replaying). Live workers still append to theirs
+        """
+        pid = os.getpid()
+        paths = []
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'pending_writes.*'))):
+            match = _SPILL_FILE.search(os.path.basename(path))
+            if not match:
+                continue
+            owner = int(match.group(2) or match.group(1))
+            if owner == pid and match.group(2):
+                continue
+            if owner == pid or not _pid_alive(owner):
+                paths.append((path, match.group(1)))
+        return paths
+
+    def _replay_spill(self):
+        """
+        Re-insert spilled documents once MongoDB is reachable again. A file
+        is deleted only after all of its documents were written or spilled
+        again; a batch that cannot be written goes back to this process's
+        spill file
+        """
+        if not os.path.isdir(self.spill_dir):
+            return
+        pending = self._replayable_spills()
+        if not pending or not is_available():
+            return
+
+        for path, spilled_by in pending:
+            # Claim the file with an atomic rename so concurrent workers
+            # never replay the same spill twice
+            claimed = os.path.join(
+                self.spill_dir, f"pending_writes.{spilled_by}.ndjson.replaying.{os.getpid()}")
+            try:
+                with self._spill_lock:
+                    os.rename(path, claimed)
+            except OSError:
+                continue
+
+            batch = []
+            with open(claimed, encoding='utf-8') as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        item = json_util.loads(line)
+                        batch.append((item['collection'], item['document']))
+                    except Exception as e:
+                        # A line cut short by a crash mid-write
+                        logger.warning(f"Skipping unreadable line {number} of {path}: {str(e)}")
+                        self.dropped += 1
+
+            logger.info(f"Replaying {len(batch)} spilled documents from {path}")
+            for i in range(0, len(batch), self.max_batch):
+                if not is_available():
+                    self._spill(batch[i:])
+                    break
+                written = self.written
+                try:
+                    self._write(batch[i:i + self.max_batch])
+                except Exception as e:
+                    logger.error(f"Replaying {path} failed: {str(e)}")
+                    self._spill(batch[i:])
+                    break
+                self.replayed += self.written - written
+            os.remove(claimed)
+
+    def flush(self, timeout=None):
+        """Block until every queued document has been written or spilled"""
+        if self._pid != os.getpid():
+            return
+        if timeout is None:
+            self._queue.join()
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout=10):
+        """Flush on shutdown; anything still queued after timeout is spilled"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftovers:
+            self._spill(leftovers)
+        self._pid = None
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue': self.max_queue,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2)
+        }
+
+
+writer = BulkWriter()
+atexit.register(writer.close)
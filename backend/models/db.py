@@ -0,0 +1,73 @@
+from pymongo import MongoClient
+from config import (MONGODB_URI, MONGODB_DB, MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE,
+                    MONGODB_SERVER_SELECTION_TIMEOUT_MS, MONGODB_CONNECT_TIMEOUT_MS,
+                    MONGODB_SOCKET_TIMEOUT_MS, MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                    MONGODB_HEALTH_CHECK_INTERVAL)
+import logging
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# One pooled client per process. It is created on first use rather than at
+# import time, so importing a module never blocks on server selection and
+# preforked gunicorn workers each build their own pool after the fork.
+_client = None
+_client_lock = threading.Lock()
+_available = None
+_checked_at = 0.0
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGODB_URI,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+                    waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS
+                )
+    return _client
+
+
+def get_db():
+    return get_client()[MONGODB_DB]
+
+
+def is_available():
+    """
+    Whether MongoDB answered a ping recently. The result is reused for
+    MONGODB_HEALTH_CHECK_INTERVAL seconds so an outage costs one
+    server-selection timeout per interval rather than one per request
+    """
+    global _available, _checked_at
+    now = time.monotonic()
+    if _available is not None and now - _checked_at < MONGODB_HEALTH_CHECK_INTERVAL:
+        return _available
+
+    try:
+        get_client().admin.command('ping')
+        if _available is not True:
+            logger.info("MongoDB connection successful")
+        _available = True
+    except Exception as e:
+        if _available is not False:
+            logger.warning(
+                f"MongoDB connection failed - running in offline mode: {str(e)}")
+        _available = False
+    _checked_at = now
+    return _available
+
+
+def mark_unavailable():
+    """Force offline mode until the next health check interval"""
+    global _available, _checked_at
+    _available = False
+    _checked_at = time.monotonic()
@@ -0,0 +1,97 @@
+from bson import Binary
+from datetime import datetime
+from config import FEATURE_STORE_LOCAL_SIZE
+from models.db import get_db, is_available
+from utils.cache import TTLCache
+from utils.features import empty_stats
+import logging
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FEATURE_STORE = 'feature_store'
+
+# How many of the newest item ids to remember, to skip items sharing the
+# cursor timestamp that were already counted
+RECENT_IDS = 50
+
+_BITMAPS = ('text_bitmap', 'ngram_bitmap', 'subreddit_bitmap')
+
+# Used while MongoDB is unavailable so rescans in this process still
+# benefit; entries never expire on their own, only by LRU
+_local = TTLCache(maxsize=FEATURE_STORE_LOCAL_SIZE, ttl=float('inf'))
+
+
+def _to_document(stats):
+    doc = dict(stats)
+    doc['hour_hist'] = [int(v) for v in stats['hour_hist']]
+    for key in _BITMAPS:
+        doc[key] = Binary(np.asarray(stats[key], dtype=np.uint8).tobytes())
+    return doc
+
+
+def _from_document(doc):
+    stats = empty_stats()
+    stats.update({k: v for k, v in doc.items() if k in stats})
+    stats['hour_hist'] = np.asarray(doc['hour_hist'], dtype=np.int64)
+    for key in _BITMAPS:
+        stats[key] = np.frombuffer(bytes(doc[key]), dtype=np.uint8).copy()
+    return stats
+
+
+def load(username):
+    """
+    Returns the stored entry for username as
+    {'stats', 'cursor', 'recent_ids', 'version'}, or None on first scan
+    """
+    key = username.lower()
+    if not is_available():
+        return _local.get(key)
+    try:
+        doc = get_db()[FEATURE_STORE].find_one({'_id': key})
+    except Exception as e:
+        logger.warning(f"Could not read feature store for {username}: {str(e)}")
+        return _local.get(key)
+    if not doc:
+        return None
+    return {
+        'stats': _from_document(doc['stats']),
+        'cursor': doc.get('cursor'),
+        'recent_ids': doc.get('recent_ids', []),
+        'version': doc.get('version', 0)
+    }
+
+
+def save(username, stats, cursor, recent_ids, version):
+    """
+    Store the merged aggregates. Uses the version as an optimistic lock: if
+    another scan saved first, this update is dropped and the next rescan
+    continues from the other scan's cursor instead
+    """
+    key = username.lower()
+    entry = {'stats': stats, 'cursor': cursor,
+             'recent_ids': list(recent_ids)[:RECENT_IDS], 'version': version + 1}
+    _local.set(key, entry)
+    if not is_available():
+        return True
+
+    doc = {
+        'stats': _to_document(stats),
+        'cursor': cursor,
+        'recent_ids': entry['recent_ids'],
+        'version': version + 1,
+        'updated_at': datetime.utcnow()
+    }
+    try:
+        if version == 0:
+            result = get_db()[FEATURE_STORE].update_one(
+                {'_id': key}, {'$setOnInsert': doc}, upsert=True)
+            return result.upserted_id is not None
+        result = get_db()[FEATURE_STORE].update_one(
+            {'_id': key, 'version': version}, {'$set': doc})
+        return result.modified_count == 1
+    except Exception as e:
+        logger.warning(f"Could not update feature store for {username}: {str(e)}")
+        return False
@@ -1,10 +1,5 @@
 from datetime import datetime
-from pymongo import MongoClient
-from config import MONGODB_URI
-
-client = MongoClient(MONGODB_URI)
-db = client.reddit_predictions
-collection = db.feedback
+from models import repository
 
 class Feedback:
     def __init__(self, user_id, prediction_id, rating, comment, timestamp=None):
@@ -24,4 +19,4 @@ class Feedback:
         }
 
     def save(self):
-        return collection.insert_one(self.to_dict()) 
\ No newline at end of file
+        return repository.save_feedback(self.to_dict()) 
\ No newline at end of file
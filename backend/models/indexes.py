@@ -0,0 +1,77 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from config import REPORT_CACHE_TTL, SWEEP_STATUS_TTL
+from models.db import get_db
+from models.repository import (PREDICTIONS, FEEDBACK, REPORTS, USER_SNAPSHOTS, SHADOW_PREDICTIONS,
+                               SINGLEFLIGHT_LOCKS, REPORT_JOBS, SWEEPS, SWEEP_LEASES)
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _username_timestamp():
+    # Serves /api/history/<username>: equality on username, newest first
+    return IndexModel([('username', ASCENDING), ('timestamp', DESCENDING)],
+                      name='username_timestamp')
+
+
+INDEXES = {
+    PREDICTIONS: [_username_timestamp()],
+    FEEDBACK: [_username_timestamp()],
+    REPORTS: [
+        _username_timestamp(),
+        IndexModel([('cache_key', ASCENDING), ('timestamp', DESCENDING)],
+                   name='cache_key_timestamp', sparse=True),
+        # Cached Gemini reports expire with the report cache; plain report
+        # history (no cache_key) is kept
+        IndexModel([('timestamp', ASCENDING)], name='cached_report_ttl',
+                   expireAfterSeconds=REPORT_CACHE_TTL,
+                   partialFilterExpression={'cache_key': {'$exists': True}})
+    ],
+    USER_SNAPSHOTS: [
+        _username_timestamp(),
+        # Raw user_data blobs are deleted once expires_at has passed
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl',
+                   expireAfterSeconds=0)
+    ],
+    SHADOW_PREDICTIONS: [
+        _username_timestamp(),
+        # Comparing one candidate against the primary over time
+        IndexModel([('candidate_version', ASCENDING), ('timestamp', DESCENDING)],
+                   name='candidate_version_timestamp')
+    ],
+    REPORT_JOBS: [
+        # Jobs are dropped once REPORT_JOB_TTL has passed
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl',
+                   expireAfterSeconds=0)
+    ],
+    SWEEPS: [
+        # Status of finished (or abandoned) sweeps is kept for a while
+        IndexModel([('updated_at', ASCENDING)], name='updated_at_ttl',
+                   expireAfterSeconds=SWEEP_STATUS_TTL)
+    ],
+    SWEEP_LEASES: [
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl',
+                   expireAfterSeconds=0)
+    ],
+    SINGLEFLIGHT_LOCKS: [
+        # Safety net for leases nobody released; expiry is also checked
+        # on every read since the TTL monitor runs only once a minute
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl',
+                   expireAfterSeconds=0)
+    ]
+}
+
+
+def ensure_indexes(db=None):
+    """
+    Create every index in INDEXES. create_indexes is idempotent, so this is
+    safe to run on every startup. Returns {collection: [index names]}
+    """
+    db = db if db is not None else get_db()
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = db[collection].create_indexes(indexes)
+        logger.info(f"Indexes ensured on {collection}: {', '.join(created[collection])}")
+    return created
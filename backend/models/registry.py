@@ -0,0 +1,569 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import (MODEL_PATH, MODEL_MMAP, MODEL_CACHE_DIR, MODEL_RELOAD_INTERVAL,
+                    MODEL_STATE_PATH, MODEL_CANDIDATE_PATH, MODEL_CANDIDATE_MODE, MODEL_CANDIDATE_TRAFFIC,
+                    MODEL_SHADOW_MAX_PENDING, MODEL_EVAL_DATA)
+from utils.evaluation import evaluate, eval_data_path, load_eval_data
+import hashlib
+import joblib
+import json
+import logging
+import numpy as np
+import os
+import resource
+import threading
+import time
+import zlib
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'primary'
+CANDIDATE = 'candidate'
+CANDIDATE_MODES = ('shadow', 'split')
+# Key of the shared state file in ModelRegistry._watched
+_STATE = 'state'
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+def _rss_bytes():
+    """Current resident set size (falls back to the peak off Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _collect_arrays(obj, seen, arrays):
+    if id(obj) in seen:
+        return
+    # Keep a reference so ids of temporary state dicts are not reused
+    seen[id(obj)] = obj
+    if isinstance(obj, np.ndarray):
+        arrays.append(obj)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _collect_arrays(item, seen, arrays)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            _collect_arrays(item, seen, arrays)
+    elif type(obj).__name__ == 'Tree' and hasattr(obj, '__getstate__'):
+        # sklearn trees keep their node arrays in C memory
+        _collect_arrays(obj.__getstate__(), seen, arrays)
+    elif hasattr(obj, '__dict__'):
+        _collect_arrays(vars(obj), seen, arrays)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def model_version(path):
+    """Version tag of a model file: its name plus a content hash"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{digest.hexdigest()[:12]}"
+
+
+def _mmap_artifact(path, version):
+    """
+    joblib can only memory-map arrays from an uncompressed joblib file, so
+    keep such a copy of every model version in MODEL_CACHE_DIR. Files are
+    named by version and never rewritten, so a reload never changes pages
+    another worker has mapped
+    """
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    target = os.path.join(MODEL_CACHE_DIR, f"{version}.mmap.joblib")
+    if not os.path.exists(target):
+        logger.info(f"Converting {path} to a memory-mappable artifact")
+        tmp = f"{target}.{os.getpid()}.tmp"
+        joblib.dump(joblib.load(path), tmp)
+        os.replace(tmp, target)
+    return target
+
+
+def _held_out_metrics(model, path):
+    """
+    Metrics of model on held-out rows, computed once at load: from
+    MODEL_EVAL_DATA or the model's .eval.npz, else as recorded in its
+    .metrics.json by the training run. None when neither exists
+    """
+    source = MODEL_EVAL_DATA or eval_data_path(path)
+    data = load_eval_data(source)
+    if data is not None:
+        start = time.perf_counter()
+        metrics = evaluate(model, *data)
+        metrics['eval_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        metrics['source'] = source
+        return metrics
+    try:
+        with open(f"{path}.metrics.json") as f:
+            metrics = json.load(f)['metrics']['model']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    metrics['source'] = f"{path}.metrics.json"
+    return metrics
+
+
+class LoadedModel:
+    """
+    One loaded, warmed-up model version. With mmap, joblib maps the plain
+    numpy arrays of the model read-only; the trees of a forest are
+    unpickled into private memory (for the shipped model about 1.6 KB of
+    its 33 KB of arrays end up mapped, see info['mmapped_bytes']).
+    Workers share the model because it is loaded in the gunicorn master
+    (preload_app) and frozen out of the GC (gc.freeze), not because of mmap
+    """
+
+    def __init__(self, path, mmap=MODEL_MMAP):
+        rss_before = _rss_bytes()
+        self.path = path
+        self.signature = _file_signature(path)
+        self.version = model_version(path)
+
+        start = time.perf_counter()
+        if mmap:
+            self.model = joblib.load(_mmap_artifact(path, self.version), mmap_mode='r')
+        else:
+            self.model = joblib.load(path)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        # Warm-up predict so the first real request doesn't pay for lazy
+        # imports and first-call allocations
+        start = time.perf_counter()
+        n_features = getattr(self.model, 'n_features_in_', 3)
+        self.model.predict(np.zeros((1, n_features)))
+        warmup_ms = (time.perf_counter() - start) * 1000
+
+        try:
+            self.metrics = _held_out_metrics(self.model, path)
+        except Exception as e:
+            logger.warning(f"Could not compute held-out metrics for {self.version}: {str(e)}")
+            self.metrics = None
+
+        arrays = []
+        _collect_arrays(self.model, {}, arrays)
+        self.info = {
+            'version': self.version,
+            'path': path,
+            'load_ms': round(load_ms, 2),
+            'warmup_ms': round(warmup_ms, 2),
+            'array_bytes': int(sum(a.nbytes for a in arrays)),
+            'mmapped_bytes': int(sum(a.nbytes for a in arrays if isinstance(a, np.memmap))),
+            'rss_delta_bytes': _rss_bytes() - rss_before,
+            'n_features': int(n_features),
+            'metrics': self.metrics,
+            'loaded_at': time.time(),
+            'pid': os.getpid()
+        }
+
+    def score(self, features):
+        """(labels, bot probabilities or None) for a feature matrix"""
+        # np.asarray: with mmap_mode labels come back as views of classes_
+        labels = np.asarray(self.model.predict(features))
+        probabilities = None
+        if hasattr(self.model, 'predict_proba'):
+            probabilities = np.asarray(self.model.predict_proba(features)[:, 1])
+        return labels, probabilities
+
+
+class ModelRegistry:
+    """
+    Holds the model versions of this process: the primary, an optional
+    candidate and the previous primary (for rollback). Load it at import
+    time of the app so that, with gunicorn's preload_app, the master loads
+    the models once and forked workers share them copy-on-write.
+
+    A swap replaces a single reference, so a request always scores with one
+    consistent version and never waits for a load. File changes are picked
+    up by a background reload in every worker. Admin calls apply at once in
+    the worker that received them and are written to state_path, which the
+    other workers check along with the model files and apply (loading any
+    version they don't hold yet) within reload_interval seconds. The state
+    file also survives restarts, as long as the configured MODEL_PATH is
+    the one it was written under.
+    """
+
+    def __init__(self, path=MODEL_PATH, candidate_path=MODEL_CANDIDATE_PATH,
+                 candidate_mode=MODEL_CANDIDATE_MODE, candidate_traffic=MODEL_CANDIDATE_TRAFFIC,
+                 mmap=MODEL_MMAP, reload_interval=MODEL_RELOAD_INTERVAL,
+                 state_path=MODEL_STATE_PATH):
+        self.configured_path = path
+        self.state_path = state_path
+        self.paths = {PRIMARY: path, CANDIDATE: candidate_path or None}
+        self.candidate_mode = candidate_mode
+        self.candidate_traffic = candidate_traffic
+        self.mmap = mmap
+        self.reload_interval = reload_interval
+        self.primary = None
+        self.candidate = None
+        self.previous = None
+        self.error = None
+        # _load_lock serializes loads; _lock only guards quick swaps and
+        # counters, so requests never wait behind a load
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        # File signature per role when last (re)loaded or swapped; the
+        # watcher only reloads when the file changes after that, so a
+        # rollback or promotion is not undone by the next check
+        self._watched = {}
+        self._reloading = False
+        self._shadow = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-shadow')
+        self._shadow_pending = 0
+        self.counters = {'reloads': 0, 'reload_errors': 0, 'shadow_batches': 0,
+                         'shadow_rows': 0, 'shadow_agreements': 0,
+                         'shadow_dropped': 0, 'shadow_errors': 0}
+
+    @property
+    def model(self):
+        primary = self.primary
+        return primary.model if primary else None
+
+    def load(self, role=PRIMARY, path=None):
+        """
+        Load role from path (default: its configured path) and swap it in.
+        On failure the current version stays in place. Returns the new
+        LoadedModel or None
+        """
+        path = path or self.paths[role]
+        if not path:
+            return None
+        with self._load_lock:
+            try:
+                loaded = LoadedModel(path, self.mmap)
+            except Exception as e:
+                logger.error(f"Error loading {role} model from {path}: {str(e)}")
+                with self._lock:
+                    self.counters['reload_errors'] += 1
+                    if role == PRIMARY:
+                        self.error = str(e)
+                return None
+
+            with self._lock:
+                self.paths[role] = path
+                self._watched[role] = loaded.signature
+                if role == PRIMARY:
+                    if self.primary and self.primary.version != loaded.version:
+                        self.previous = self.primary
+                    self.primary = loaded
+                    self.error = None
+                else:
+                    self.candidate = loaded
+                self.counters['reloads'] += 1
+            logger.info(f"Loaded {role} model {loaded.version} in {loaded.info['load_ms']:.1f} ms")
+            return loaded
+
+    def metrics_for(self, version=None):
+        """Held-out metrics of a loaded version (default: the primary)"""
+        for loaded in (self.primary, self.candidate, self.previous):
+            if loaded is not None and (version is None or loaded.version == version):
+                return loaded.metrics
+        return None
+
+    def set_candidate(self, path=None, mode=None, traffic=None):
+        """Load a candidate and/or change how it is used. Raises ValueError on bad settings"""
+        if mode is not None and mode not in CANDIDATE_MODES:
+            raise ValueError(f"Unknown candidate mode: {mode}")
+        if traffic is not None and not 0.0 <= float(traffic) <= 1.0:
+            raise ValueError("Candidate traffic must be between 0 and 1")
+        if path and self.load(CANDIDATE, path) is None:
+            raise ValueError(f"Could not load candidate model from {path}")
+        if mode is not None:
+            self.candidate_mode = mode
+        if traffic is not None:
+            self.candidate_traffic = float(traffic)
+        self.save_state()
+        return self.candidate
+
+    def clear_candidate(self):
+        with self._lock:
+            self.candidate = None
+            self.paths[CANDIDATE] = None
+            self._watched.pop(CANDIDATE, None)
+        self.save_state()
+
+    def promote(self):
+        """Make the candidate the primary; the old primary is kept for rollback"""
+        with self._lock:
+            if self.candidate is None:
+                raise ModelUnavailable("No candidate model loaded")
+            self.previous, self.primary = self.primary, self.candidate
+            self.paths[PRIMARY] = self.primary.path
+            self._watched[PRIMARY] = _file_signature(self.primary.path)
+            self.candidate = None
+            self.paths[CANDIDATE] = None
+            self._watched.pop(CANDIDATE, None)
+            primary = self.primary
+        self.save_state()
+        return primary
+
+    def rollback(self):
+        """Swap the previous primary back in"""
+        with self._lock:
+            if self.previous is None:
+                raise ModelUnavailable("No previous model version to roll back to")
+            self.previous, self.primary = self.primary, self.previous
+            self.paths[PRIMARY] = self.primary.path
+            self._watched[PRIMARY] = _file_signature(self.primary.path)
+            primary = self.primary
+        self.save_state()
+        return primary
+
+    def save_state(self):
+        """Write the admin-controlled settings to state_path for the other workers"""
+        if not self.state_path:
+            return
+        with self._lock:
+            state = {
+                'configured_path': self.configured_path,
+                'primary': self.paths[PRIMARY],
+                'candidate': self.paths[CANDIDATE],
+                'previous': self.previous.path if self.previous else None,
+                'candidate_mode': self.candidate_mode,
+                'candidate_traffic': self.candidate_traffic,
+                'pid': os.getpid(),
+                'saved_at': time.time()
+            }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+            tmp = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+            self._watched[_STATE] = _file_signature(self.state_path)
+        except OSError as e:
+            logger.error(f"Could not save model registry state: {str(e)}")
+
+    def sync_state(self):
+        """
+        Apply the state file written by save_state (in this or another
+        worker): load the versions it names that are not held yet and swap
+        them in. Returns False when there is nothing to apply or a version
+        could not be loaded (the current ones then stay in place)
+        """
+        if not self.state_path:
+            return False
+        signature = _file_signature(self.state_path)
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            if signature is not None:
+                logger.warning(f"Could not read model registry state: {str(e)}")
+            return False
+        self._watched[_STATE] = signature
+        if state.get('configured_path') != self.configured_path:
+            logger.info("Ignoring model registry state written for another MODEL_PATH")
+            return False
+
+        with self._load_lock:
+            held = {loaded.path: loaded for loaded in (self.previous, self.candidate, self.primary)
+                    if loaded is not None}
+            try:
+                for path in (state['primary'], state.get('candidate')):
+                    if path and path not in held:
+                        held[path] = LoadedModel(path, self.mmap)
+            except Exception as e:
+                logger.error(f"Could not apply model registry state: {str(e)}")
+                with self._lock:
+                    self.counters['reload_errors'] += 1
+                return False
+            previous = state.get('previous')
+            if previous and previous not in held:
+                # Only needed for a rollback; don't hold up the rest for it
+                try:
+                    held[previous] = LoadedModel(previous, self.mmap)
+                except Exception as e:
+                    logger.warning(f"Could not load previous model {previous}: {str(e)}")
+
+            with self._lock:
+                self.primary = held[state['primary']]
+                self.candidate = held.get(state.get('candidate'))
+                self.previous = held.get(state.get('previous'))
+                self.error = None
+                for role in (PRIMARY, CANDIDATE):
+                    loaded = self.primary if role == PRIMARY else self.candidate
+                    self.paths[role] = loaded.path if loaded else None
+                    if loaded:
+                        self._watched[role] = loaded.signature
+                    else:
+                        self._watched.pop(role, None)
+                self.candidate_mode = state.get('candidate_mode', self.candidate_mode)
+                self.candidate_traffic = state.get('candidate_traffic', self.candidate_traffic)
+        logger.info(f"Applied model registry state: primary {self.primary.version}, "
+                    f"candidate {self.candidate.version if self.candidate else None}")
+        return True
+
+    def _check_files(self):
+        """
+        Start a background sync if the state file changed, else a reload if
+        a watched model file changed
+        """
+        if not self.reload_interval or self._reloading:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+
+        if self.state_path:
+            signature = _file_signature(self.state_path)
+            if signature is not None and signature != self._watched.get(_STATE):
+                self._watched[_STATE] = signature
+                self._start_reload(self.sync_state)
+                return
+
+        changed = []
+        for role in (PRIMARY, CANDIDATE):
+            path = self.paths[role]
+            signature = _file_signature(path) if path else None
+            if signature is not None and signature != self._watched.get(role):
+                # Recorded up front so a file that fails to load is not
+                # retried until it changes again
+                self._watched[role] = signature
+                changed.append(role)
+        if not changed:
+            return
+        self._start_reload(lambda: [self.load(role) for role in changed])
+
+    def _start_reload(self, fn):
+        def reload():
+            try:
+                fn()
+            finally:
+                self._reloading = False
+
+        self._reloading = True
+        threading.Thread(target=reload, name='model-reload', daemon=True).start()
+
+    def get(self):
+        """Return the primary LoadedModel, retrying the load if it previously failed"""
+        self._check_files()
+        if self.primary is None:
+            self.load()
+        if self.primary is None:
+            raise ModelUnavailable(f"Model not loaded: {self.error}")
+        return self.primary
+
+    def _in_candidate_share(self, username):
+        threshold = int(self.candidate_traffic * 10000)
+        return zlib.crc32(username.lower().encode('utf-8')) % 10000 < threshold
+
+    def version_for(self, username):
+        """Version of the model that score() uses for username"""
+        primary = self.get()
+        candidate = self.candidate
+        if candidate is not None and self.candidate_mode == 'split' and \
+                self._in_candidate_share(username):
+            return candidate.version
+        return primary.version
+
+    def score(self, features, usernames):
+        """
+        Score a feature matrix, one row per username. Returns (labels,
+        probabilities or None, model version per row).
+
+        In split mode the candidate answers for usernames hashing into its
+        traffic share. In shadow mode the primary answers for everyone and
+        the candidate scores the same matrix in the background, its outputs
+        logged next to the primary's in shadow_predictions
+        """
+        primary = self.get()
+        candidate = self.candidate
+        labels, probabilities = primary.score(features)
+        versions = [primary.version] * len(usernames)
+        if candidate is None or not len(usernames):
+            return labels, probabilities, versions
+
+        if self.candidate_mode == 'split':
+            rows = [i for i, username in enumerate(usernames)
+                    if self._in_candidate_share(username)]
+            if rows:
+                c_labels, c_probabilities = candidate.score(features[rows])
+                labels = np.array(labels, copy=True)
+                labels[rows] = c_labels
+                if probabilities is not None and c_probabilities is not None:
+                    probabilities = np.array(probabilities, copy=True)
+                    probabilities[rows] = c_probabilities
+                for i in rows:
+                    versions[i] = candidate.version
+        else:
+            self._submit_shadow(candidate, primary, features, usernames, labels, probabilities)
+        return labels, probabilities, versions
+
+    def _submit_shadow(self, candidate, primary, features, usernames, labels, probabilities):
+        with self._lock:
+            if self._shadow_pending >= MODEL_SHADOW_MAX_PENDING:
+                self.counters['shadow_dropped'] += 1
+                return
+            self._shadow_pending += 1
+        self._shadow.submit(self._run_shadow, candidate, primary, np.array(features, copy=True),
+                            list(usernames), labels, probabilities)
+
+    def _run_shadow(self, candidate, primary, features, usernames, labels, probabilities):
+        from models import repository
+        try:
+            c_labels, c_probabilities = candidate.score(features)
+            now = datetime.utcnow()
+            docs = []
+            for i, username in enumerate(usernames):
+                docs.append({
+                    'username': username,
+                    'timestamp': now,
+                    'primary_version': primary.version,
+                    'primary_prediction': bool(labels[i]),
+                    'primary_probability': None if probabilities is None else float(probabilities[i]),
+                    'candidate_version': candidate.version,
+                    'candidate_prediction': bool(c_labels[i]),
+                    'candidate_probability': None if c_probabilities is None else float(c_probabilities[i]),
+                    'agree': bool(labels[i]) == bool(c_labels[i])
+                })
+            repository.save_shadow_predictions(docs)
+            with self._lock:
+                self.counters['shadow_batches'] += 1
+                self.counters['shadow_rows'] += len(docs)
+                self.counters['shadow_agreements'] += sum(doc['agree'] for doc in docs)
+        except Exception as e:
+            logger.warning(f"Shadow scoring with {candidate.version} failed: {str(e)}")
+            with self._lock:
+                self.counters['shadow_errors'] += 1
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+    def stats(self):
+        primary, candidate, previous = self.primary, self.candidate, self.previous
+        with self._lock:
+            counters = dict(self.counters)
+            shadow_pending = self._shadow_pending
+        rows = counters['shadow_rows']
+        return {
+            'loaded': primary is not None,
+            'error': self.error,
+            'mmap': self.mmap,
+            'state_path': self.state_path,
+            'rss_bytes': _rss_bytes(),
+            'primary': primary.info if primary else None,
+            'candidate': {**candidate.info, 'mode': self.candidate_mode,
+                          'traffic': self.candidate_traffic} if candidate else None,
+            'previous_version': previous.version if previous else None,
+            'shadow_pending': shadow_pending,
+            'shadow_agreement_rate': round(counters['shadow_agreements'] / rows, 4) if rows else None,
+            **counters
+        }
+
+
+model_registry = ModelRegistry()
@@ -1,10 +1,5 @@
 from datetime import datetime
-from pymongo import MongoClient
-from config import MONGODB_URI
-
-client = MongoClient(MONGODB_URI)
-db = client.reddit_predictions
-collection = db.reports
+from models import repository
 
 class Report:
     def __init__(self, user_id, content, report_text, timestamp=None):
@@ -22,4 +17,4 @@ class Report:
         }
 
     def save(self):
-        return collection.insert_one(self.to_dict()) 
\ No newline at end of file
+        return repository.save_report(self.to_dict()) 
\ No newline at end of file
@@ -0,0 +1,133 @@
+from bson import ObjectId
+from datetime import timedelta
+from config import USER_DATA_TTL_DAYS
+from models.db import get_db, is_available
+from models.bulk_writer import writer
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Inserts are buffered by the bulk writer: save_* returns as soon as the
+# document is queued, and documents are spilled to disk rather than lost
+# while MongoDB is unreachable.
+PREDICTIONS = 'predictions'
+FEEDBACK = 'feedback'
+REPORTS = 'reports'
+# Raw Reddit user_data, split out of predictions so it can expire on its own
+USER_SNAPSHOTS = 'user_snapshots'
+# Candidate model outputs scored in shadow mode, next to the primary's
+SHADOW_PREDICTIONS = 'shadow_predictions'
+# Leases and shared results of utils.singleflight.MongoSingleFlight
+SINGLEFLIGHT_LOCKS = 'singleflight_locks'
+# Groups of linked accounts flagged by the utils.graph ring job
+BOT_RINGS = 'bot_rings'
+# State of utils.jobs report jobs, so any worker can answer a poll
+REPORT_JOBS = 'report_jobs'
+# Status of utils.sweep sweeps, and the leases that limit how many run
+SWEEPS = 'sweeps'
+SWEEP_LEASES = 'sweep_leases'
+
+# Fields returned by /api/history/<username>; large blobs are left out
+HISTORY_PROJECTIONS = {
+    PREDICTIONS: {'_id': 1, 'username': 1, 'prediction': 1, 'bot_probability': 1,
+                  'model_version': 1, 'timestamp': 1},
+    FEEDBACK: {'_id': 1, 'username': 1, 'feedback': 1, 'comment': 1,
+               'prediction': 1, 'timestamp': 1},
+    REPORTS: {'_id': 1, 'username': 1, 'cache_key': 1, 'timestamp': 1}
+}
+
+
+def collection(name):
+    return get_db()[name]
+
+
+def save_prediction(prediction_data):
+    """
+    Store a prediction. A user_data blob is moved to user_snapshots under
+    the same _id, where a TTL index expires it after USER_DATA_TTL_DAYS
+    """
+    prediction_data = dict(prediction_data)
+    prediction_data.setdefault('_id', ObjectId())
+    user_data = prediction_data.pop('user_data', None)
+    if user_data is not None:
+        writer.put(USER_SNAPSHOTS, {
+            '_id': prediction_data['_id'],
+            'username': prediction_data.get('username'),
+            'user_data': user_data,
+            'timestamp': prediction_data['timestamp'],
+            'expires_at': prediction_data['timestamp'] + timedelta(days=USER_DATA_TTL_DAYS)
+        })
+    return writer.put(PREDICTIONS, prediction_data)
+
+
+def save_predictions(predictions):
+    return all([save_prediction(prediction) for prediction in predictions])
+
+
+def save_shadow_predictions(docs):
+    return all([writer.put(SHADOW_PREDICTIONS, doc) for doc in docs])
+
+
+def save_bot_rings(docs):
+    return all([writer.put(BOT_RINGS, doc) for doc in docs])
+
+
+def save_feedback(feedback_data):
+    return writer.put(FEEDBACK, feedback_data)
+
+
+def save_report(report_data):
+    return writer.put(REPORTS, report_data)
+
+
+def save_report_job(job, expires_at):
+    """
+    Write job (a utils.jobs job dict) under its job_id. Written directly
+    rather than through the bulk writer so a poll on another worker sees
+    the new state at once
+    """
+    collection(REPORT_JOBS).replace_one(
+        {'_id': job['job_id']}, {**job, '_id': job['job_id'], 'expires_at': expires_at},
+        upsert=True)
+
+
+def find_report_job(job_id, now):
+    """The job stored under job_id, or None if missing or expired at now"""
+    return collection(REPORT_JOBS).find_one(
+        {'_id': job_id, 'expires_at': {'$gt': now}},
+        projection={'_id': 0, 'expires_at': 0})
+
+
+def get_writer_stats():
+    return writer.stats()
+
+
+def find_cached_report(cache_key, since):
+    """Most recent report stored under cache_key no older than since"""
+    if not is_available():
+        return None
+    try:
+        return collection(REPORTS).find_one(
+            {'cache_key': cache_key, 'timestamp': {'$gte': since}},
+            projection={'report': 1},
+            sort=[('timestamp', -1)]
+        )
+    except Exception as e:
+        logger.warning(f"Could not read cached report from MongoDB: {str(e)}")
+        return None
+
+
+def find_history(name, username, limit=20, before=None):
+    """
+    One page of a user's documents from predictions, feedback or reports,
+    newest first. Uses the (username, timestamp) index; pass the timestamp
+    of the last item as before to get the next page
+    """
+    query = {'username': username}
+    if before is not None:
+        query['timestamp'] = {'$lt': before}
+    cursor = collection(name).find(query, projection=HISTORY_PROJECTIONS[name]) \
+        .sort('timestamp', -1).limit(limit)
+    return list(cursor)
@@ -0,0 +1,347 @@
+"""
+Offline latency and throughput benchmark of /api/predict, /api/predict/batch
+and /api/generate-report, run in process through the Flask test client.
+
+Nothing external is called:
+  * Reddit is FakeReddit in place of PRAW, plus the fake OAuth API for the
+    async batch fetcher. Both come from scripts/fake_reddit.py.
+  * The LLM is the stub provider, with --llm-latency-ms and
+    --llm-failure-rate.
+  * MongoDB is mongomock by default. --mongo none runs in offline mode and
+    --mongo URI uses a real (local) mongod. Give a real mongod an empty
+    database (MONGODB_DB) so every run starts from the same state.
+
+    python scripts/bench_pipeline.py --concurrency 1 8 32 --requests 200 --output bench.json
+    python scripts/bench_pipeline.py --compare bench.json --tolerance 0.25
+
+Usernames, their fake activity and the stub's failures are derived from
+fixed names and --seed, so runs differ only in timing.
+
+Every request of a level is for a user not seen before, so predict,
+batch and report measure the uncached path; predict_cached replays a
+small warmed-up set of users. A report's latency lasts until its job is
+done, found by polling /api/reports/<job_id>. The JSON output holds
+p50/p95/p99 latency (ms) and throughput per scenario and concurrency.
+With --compare, levels whose p95 grew or throughput fell by more than
+--tolerance against a previous output are listed as regressions, and the
+exit status is 1.
+"""
+import os
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from aiohttp import web
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fake_reddit import create_app, FakeReddit
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+
+SCENARIOS = ('predict', 'predict_cached', 'batch', 'report')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the predict and report pipeline')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=100, help='Requests per level')
+    parser.add_argument('--batch-size', type=int, default=25, help='Users per batch request')
+    parser.add_argument('--reddit-latency-ms', type=float, default=20,
+                        help='Latency of each fake Reddit round-trip')
+    parser.add_argument('--llm-latency-ms', type=float, default=300)
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the stub LLM failures')
+    parser.add_argument('--mongo', default='mongomock',
+                        help='mongomock, none (offline mode) or a MongoDB URI')
+    parser.add_argument('--output', help='Write the JSON results here (default stdout)')
+    parser.add_argument('--compare', help='Earlier JSON output to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative p95 increase / throughput decrease')
+    parser.add_argument('--verbose', action='store_true', help='Keep the application logs')
+    return parser.parse_args()
+
+
+def start_fake_api(latency_ms):
+    """Serve the fake Reddit OAuth API on a free local port; returns its URL"""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_app(latency_ms, budget=10 ** 9, window=600),
+                           access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = runner.addresses[0][1]
+    threading.Thread(target=loop.run_forever, daemon=True, name='fake-reddit').start()
+    return f"http://127.0.0.1:{port}"
+
+
+def configure_environment(args, api_url, workdir):
+    """Settings read by config at import: stand-ins and scratch paths"""
+    os.environ.update({
+        'REDDIT_CLIENT_ID': 'bench',
+        'REDDIT_CLIENT_SECRET': 'bench',
+        'REDDIT_USER_AGENT': 'bench',
+        'REDDIT_AUTH_URL': f"{api_url}/api/v1/access_token",
+        'REDDIT_API_BASE': api_url,
+        'REDDIT_REQUESTS_PER_MINUTE': '600000',
+        'LLM_PROVIDER': 'stub',
+        'GEMINI_ENABLED': 'true',
+        'LLM_STUB_LATENCY_MS': str(args.llm_latency_ms),
+        'LLM_STUB_FAILURE_RATE': str(args.llm_failure_rate),
+        'SIMILARITY_INDEX_PATH': os.path.join(workdir, 'similarity_index.npz'),
+        'GRAPH_PATH': os.path.join(workdir, 'account_graph.npz'),
+        'BULK_WRITE_SPILL_DIR': os.path.join(workdir, 'spill'),
+        'SWEEP_CHECKPOINT_DIR': os.path.join(workdir, 'sweeps'),
+        'SINGLEFLIGHT_DISTRIBUTED': 'false'
+    })
+    if args.mongo == 'none':
+        os.environ['MONGODB_URI'] = 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100'
+    elif args.mongo != 'mongomock':
+        os.environ['MONGODB_URI'] = args.mongo
+
+
+def load_app(args):
+    """Import the application against the stand-ins; returns the Flask app"""
+    from models import db
+    if args.mongo == 'mongomock':
+        import mongomock
+        db._client = mongomock.MongoClient()
+    from utils import reddit_api
+    reddit_api.reddit = FakeReddit(args.reddit_latency_ms)
+    import app as application
+    from utils.llm import StubProvider
+    application.llm_client.provider = StubProvider(args.llm_latency_ms, args.llm_failure_rate,
+                                                   seed=args.seed)
+    if application.model_registry.model is None:
+        raise SystemExit(f"Could not load model: {application.model_registry.error}")
+    return application.app
+
+
+def username(scenario, concurrency, i):
+    # Every tenth user behaves like a bot and every fiftieth does not exist
+    prefix = 'missing' if i % 50 == 49 else 'bot' if i % 10 == 9 else 'user'
+    return f"{prefix}_{scenario}_{concurrency}_{i}"
+
+
+def user_data_for(name):
+    """A /api/predict response body for name, as the frontend sends to reports"""
+    from utils.reddit_api import get_reddit_user_details
+    user_data = get_reddit_user_details(name)
+    return {**user_data, 'is_bot': name.startswith('bot'),
+            'bot_probability': 0.9 if name.startswith('bot') else 0.1}
+
+
+def percentiles(latencies):
+    import numpy as np
+    if not latencies:
+        return None
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2), 'mean': round(float(values.mean()), 2),
+            'max': round(float(values.max()), 2)}
+
+
+class Level:
+    """Runs count requests through concurrency threads, each with its own test client"""
+
+    def __init__(self, app, concurrency, count):
+        self.app = app
+        self.concurrency = concurrency
+        self.count = count
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = Counter()
+        self.extra = Counter()
+
+    def client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def _one(self, request, i):
+        start = time.perf_counter()
+        try:
+            status = request(self, i)
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.statuses[str(status)] += 1
+
+    def run(self, scenario, request):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(lambda i: self._one(request, i), range(self.count)))
+        elapsed = time.perf_counter() - start
+        errors = sum(n for status, n in self.statuses.items()
+                     if not status.isdigit() or int(status) >= 500)
+        return {
+            'scenario': scenario,
+            'concurrency': self.concurrency,
+            'requests': self.count,
+            'errors': errors,
+            'status_codes': dict(self.statuses),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(self.count / elapsed, 2) if elapsed else None,
+            'latency_ms': percentiles(self.latencies),
+            **self.extra
+        }
+
+
+def predict_request(concurrency):
+    def request(level, i):
+        response = level.client().post(
+            '/api/predict', json={'screen_name': username('predict', concurrency, i)})
+        return response.status_code
+    return request
+
+
+def predict_cached_request(pool):
+    def request(level, i):
+        response = level.client().post('/api/predict', json={'screen_name': pool[i % len(pool)]})
+        with level._lock:
+            level.extra[f"cache_{response.headers.get('X-Cache', 'none').lower()}"] += 1
+        return response.status_code
+    return request
+
+
+def batch_request(concurrency, batch_size):
+    def request(level, i):
+        names = [username(f'batch{i}', concurrency, j) for j in range(batch_size)]
+        response = level.client().post('/api/predict/batch', json={'screen_names': names})
+        # NDJSON stream: reading it to the end is part of the request
+        lines = [line for line in response.get_data(as_text=True).splitlines() if line]
+        with level._lock:
+            level.extra['users'] += len(lines)
+        return response.status_code
+    return request
+
+
+def report_request(user_data):
+    def request(level, i):
+        client = level.client()
+        response = client.post('/api/generate-report', json={'userData': user_data[i]})
+        body = response.get_json() or {}
+        status = body.get('status') if response.status_code == 202 else 'done'
+        while status in ('pending', 'running'):
+            time.sleep(0.01)
+            body = client.get(f"/api/reports/{body['job_id']}").get_json() or {}
+            status = body.get('status')
+        report = body.get('report') or body.get('analysis') or {}
+        with level._lock:
+            level.extra[f"report_{report.get('source', status)}"] += 1
+        return response.status_code
+    return request
+
+
+def run_benchmark(app, args):
+    results = []
+    for scenario in args.scenarios:
+        for concurrency in args.concurrency:
+            level = Level(app, concurrency, args.requests)
+            if scenario == 'predict':
+                request = predict_request(concurrency)
+            elif scenario == 'predict_cached':
+                pool = [username('warm', concurrency, i) for i in range(20)]
+                warm = app.test_client()
+                for name in pool:
+                    warm.post('/api/predict', json={'screen_name': name})
+                request = predict_cached_request(pool)
+            elif scenario == 'batch':
+                request = batch_request(concurrency, args.batch_size)
+            else:
+                names = [username('report', concurrency, i) for i in range(args.requests)]
+                names = [name if not name.startswith('missing') else name.replace('missing', 'user')
+                         for name in names]
+                request = report_request([user_data_for(name) for name in names])
+            result = level.run(scenario, request)
+            if scenario == 'batch':
+                result['users_per_s'] = round(result['users'] / result['elapsed_s'], 2)
+            print(f"  {scenario} x{concurrency}: {result['throughput_rps']} req/s, "
+                  f"p95 {result['latency_ms']['p95']} ms", file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Levels of results that regressed against baseline (matched by scenario and concurrency)"""
+    previous = {(r['scenario'], r['concurrency']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['concurrency']))
+        if before is None or not before.get('latency_ms') or not result.get('latency_ms'):
+            continue
+        p95, p95_before = result['latency_ms']['p95'], before['latency_ms']['p95']
+        if p95 > p95_before * (1 + tolerance):
+            regressions.append({'scenario': result['scenario'],
+                                'concurrency': result['concurrency'],
+                                'metric': 'p95_ms', 'baseline': p95_before, 'current': p95})
+        rps, rps_before = result['throughput_rps'], before['throughput_rps']
+        if rps_before and rps < rps_before * (1 - tolerance):
+            regressions.append({'scenario': result['scenario'],
+                                'concurrency': result['concurrency'],
+                                'metric': 'throughput_rps', 'baseline': rps_before,
+                                'current': rps})
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    api_url = start_fake_api(args.reddit_latency_ms)
+    configure_environment(args, api_url, workdir)
+    if not args.verbose:
+        # Before the application's modules configure logging at INFO
+        logging.basicConfig(level=logging.CRITICAL)
+    app = load_app(args)
+
+    started = datetime.utcnow()
+    results = run_benchmark(app, args)
+    output = {
+        'meta': {
+            'started': started.isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+        },
+        'results': results
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            output['regressions'] = compare(results, json.load(f), args.tolerance)
+        for regression in output['regressions']:
+            print(f"  REGRESSION {regression}", file=sys.stderr)
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    sys.exit(1 if output.get('regressions') else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Offline throughput benchmark for the async Reddit fetcher. Starts the fake
+Reddit server from scripts/fake_reddit.py on a local port and fetches
+--users synthetic usernames at each --concurrency level.
+
+    python scripts/bench_reddit_fetch.py --users 500 --concurrency 1 8 32
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from utils.reddit_async import AsyncRedditFetcher, UserNotFound
+from fake_reddit import create_app
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+
+async def run_level(base_url, usernames, concurrency, requests_per_minute):
+    async with AsyncRedditFetcher(client_id='bench', client_secret='bench',
+                                  auth_url=f"{base_url}/api/v1/access_token",
+                                  api_base=base_url, concurrency=concurrency,
+                                  requests_per_minute=requests_per_minute) as fetcher:
+        start = time.perf_counter()
+        results = await fetcher.fetch_users(usernames)
+        elapsed = time.perf_counter() - start
+
+    found = sum(1 for r in results.values() if isinstance(r, dict))
+    not_found = sum(1 for r in results.values() if isinstance(r, UserNotFound))
+    return {
+        'concurrency': concurrency,
+        'users': len(usernames),
+        'found': found,
+        'not_found': not_found,
+        'errors': len(usernames) - found - not_found,
+        'requests': fetcher.requests,
+        'retries': fetcher.retries,
+        'elapsed_s': round(elapsed, 3),
+        'users_per_s': round(len(usernames) / elapsed, 1) if elapsed else None
+    }
+
+
+async def main_async(args):
+    app = create_app(args.latency_ms, args.budget, args.window)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    usernames = [f"user_{i}" for i in range(args.users)]
+    # Sprinkle in unknown users to exercise the not-found path
+    usernames += [f"missing_{i}" for i in range(args.users // 20)]
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            results.append(await run_level(base_url, usernames, concurrency,
+                                           args.requests_per_minute))
+    finally:
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Async Reddit fetch benchmark')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--latency-ms', type=int, default=50)
+    parser.add_argument('--budget', type=int, default=100000)
+    parser.add_argument('--window', type=int, default=600)
+    parser.add_argument('--requests-per-minute', type=int, default=600000,
+                        help='Initial token-bucket rate before headers arrive')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
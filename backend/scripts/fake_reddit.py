@@ -0,0 +1,197 @@
+"""
+Local stand-ins for Reddit, used to benchmark offline.
+
+The HTTP server stands in for the Reddit OAuth API as used by the async
+fetcher. It serves the two endpoints the fetcher needs:
+
+    POST /api/v1/access_token
+    GET  /user/<name>/about
+
+Every response carries X-Ratelimit-* headers computed from --budget
+requests per --window seconds, and requests beyond the budget get a 429
+like the real API.
+
+FakeReddit replaces the PRAW client (utils.reddit_api.reddit) in process.
+It serves profiles and activity listings.
+
+Both stand-ins treat usernames the same way:
+  * Names starting with "missing" do not exist.
+  * Names starting with "bot" post near-identical comments in a shared set
+    of threads and subreddits.
+  * Everything else is random but derived from the name, so runs are
+    reproducible.
+"""
+from aiohttp import web
+from prawcore.exceptions import NotFound
+from types import SimpleNamespace
+import argparse
+import asyncio
+import hashlib
+import random
+import threading
+import time
+
+
+def _fake_about(name):
+    seed = int(hashlib.md5(name.lower().encode()).hexdigest()[:8], 16)
+    return {
+        "kind": "t2",
+        "data": {
+            "name": name,
+            "verified": bool(seed & 1),
+            "link_karma": seed % 50000,
+            "comment_karma": (seed // 7) % 120000,
+            "created_utc": 1200000000 + seed % 500000000,
+            "icon_img": None
+        }
+    }
+
+
+_WORDS = ("the", "a", "python", "docs", "thanks", "error", "package", "install", "try",
+          "version", "works", "update", "issue", "this", "that", "code", "fixed", "why")
+_BOT_LINES = ("Check out this amazing deal before it is gone",
+              "Great post, I found the same deal here",
+              "This is exactly what I needed, amazing deal")
+
+
+class _Listing:
+    def __init__(self, reddit, make):
+        self._reddit = reddit
+        self._make = make
+
+    def new(self, limit=100):
+        self._reddit.wait()
+        return iter(self._make(limit or 100))
+
+
+class FakeRedditor:
+    """The parts of praw.models.Redditor that utils.reddit_api reads"""
+
+    def __init__(self, reddit, name):
+        self._reddit = reddit
+        self._name = name
+        self._data = None
+        self.submissions = _Listing(reddit, lambda limit: self._items('submission', limit))
+        self.comments = _Listing(reddit, lambda limit: self._items('comment', limit))
+
+    def __getattr__(self, attribute):
+        # Lazy like PRAW: the first attribute read fetches the profile
+        if attribute.startswith('_'):
+            raise AttributeError(attribute)
+        if self._data is None:
+            self._reddit.wait()
+            if self._name.lower().startswith('missing'):
+                raise NotFound(SimpleNamespace(status_code=404))
+            about = _fake_about(self._name)['data']
+            self._data = {**about, 'icon_img': None}
+        return self._data[attribute]
+
+    def _items(self, kind, limit):
+        bot = self._name.lower().startswith('bot')
+        rng = random.Random(f"{self._name.lower()}:{kind}")
+        now = self._reddit.now
+        items = []
+        for i in range(min(limit, self._reddit.items_per_listing)):
+            if bot:
+                thread = rng.randrange(20)
+                created = now - thread * 3600 - rng.randrange(60)
+                text = rng.choice(_BOT_LINES)
+                subreddit = f"deals{thread % 4}"
+                link_id = f"t3_bot{thread}"
+            else:
+                created = now - rng.randrange(30 * 86400)
+                text = ' '.join(rng.choice(_WORDS) for _ in range(rng.randrange(5, 30)))
+                subreddit = f"sub{rng.randrange(500)}"
+                link_id = f"t3_{rng.randrange(10 ** 6)}"
+            items.append(SimpleNamespace(
+                fullname=f"{'t3' if kind == 'submission' else 't1'}_{self._name}_{i}",
+                created_utc=float(created), title=text, selftext='', body=text,
+                subreddit=SimpleNamespace(display_name=subreddit), link_id=link_id))
+        items.sort(key=lambda item: item.created_utc, reverse=True)
+        return items
+
+
+class FakeReddit:
+    """
+    In-process stand-in for praw.Reddit: redditor() profiles plus their
+    submission and comment listings, each network round-trip taking
+    latency_ms
+    """
+
+    def __init__(self, latency_ms=0, items_per_listing=25, now=1717200000):
+        self.latency_ms = latency_ms
+        self.items_per_listing = items_per_listing
+        self.now = now
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def redditor(self, name):
+        return FakeRedditor(self, name)
+
+
+def create_app(latency_ms=0, budget=600, window=600):
+    state = {'window_start': time.monotonic(), 'used': 0, 'requests': 0}
+
+    def ratelimit_headers():
+        now = time.monotonic()
+        if now - state['window_start'] >= window:
+            state['window_start'] = now
+            state['used'] = 0
+        reset = window - (now - state['window_start'])
+        return {
+            'X-Ratelimit-Used': str(state['used']),
+            'X-Ratelimit-Remaining': str(max(budget - state['used'], 0)),
+            'X-Ratelimit-Reset': str(int(reset) + 1)
+        }
+
+    async def access_token(request):
+        return web.json_response({
+            'access_token': 'fake-token',
+            'token_type': 'bearer',
+            'expires_in': 3600
+        })
+
+    async def user_about(request):
+        state['requests'] += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000.0)
+        headers = ratelimit_headers()
+        if state['used'] >= budget:
+            return web.json_response({'error': 429}, status=429, headers=headers)
+        state['used'] += 1
+        headers = ratelimit_headers()
+
+        name = request.match_info['name']
+        if name.lower().startswith('missing'):
+            return web.json_response({'error': 404}, status=404, headers=headers)
+        return web.json_response(_fake_about(name), headers=headers)
+
+    app = web.Application()
+    app['state'] = state
+    app.router.add_post('/api/v1/access_token', access_token)
+    app.router.add_get('/user/{name}/about', user_about)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Reddit API server')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=int, default=50)
+    parser.add_argument('--budget', type=int, default=600,
+                        help='Requests allowed per rate-limit window')
+    parser.add_argument('--window', type=int, default=600,
+                        help='Rate-limit window in seconds')
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.latency_ms, args.budget, args.window),
+                port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Run the bot ring job over the saved account graph (GRAPH_PATH, written by
+the API process) and print the flagged rings as JSON.
+
+    python scripts/find_bot_rings.py
+    python scripts/find_bot_rings.py --graph /tmp/account_graph.npz --min-ring-size 5
+
+Flagged rings are also stored in the bot_rings collection, and the graph
+file is rewritten with the new ring assignments.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import GRAPH_PATH, GRAPH_MIN_RING_SIZE
+from models.bulk_writer import writer
+from utils.graph import account_graph, AccountGraph
+import argparse
+import json
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flag rings of linked bot accounts')
+    parser.add_argument('--graph', default=GRAPH_PATH, help='Saved account graph (.npz)')
+    parser.add_argument('--min-ring-size', type=int, default=GRAPH_MIN_RING_SIZE)
+    parser.add_argument('--no-save', action='store_true', help='Leave the graph file as is')
+    args = parser.parse_args()
+
+    # utils.graph has already loaded GRAPH_PATH into account_graph
+    if os.path.abspath(args.graph) == os.path.abspath(GRAPH_PATH) and len(account_graph):
+        graph = account_graph
+    else:
+        graph = AccountGraph()
+        if not graph.load(args.graph):
+            print(f"No account graph at {args.graph}", file=sys.stderr)
+            sys.exit(1)
+    run = graph.find_rings(min_ring_size=args.min_ring_size)
+    if not args.no_save:
+        graph.save(args.graph)
+    graph.dirty = False
+    writer.flush()
+    print(json.dumps({'run': run, 'rings': graph.list_rings()}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,185 @@
-from pymongo import MongoClient
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.db import get_db
+from models.indexes import ensure_indexes
+from bson import json_util
+from bson.json_util import CANONICAL_JSON_OPTIONS
 from datetime import datetime
 import argparse
+import bson
+import gzip
+import time
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Progress:
+    """Prints documents processed, percentage and rate to stderr"""
+
+    def __init__(self, label, total=None, every=10000):
+        self.label = label
+        self.total = total
+        self.every = every
+        self.done = 0
+        self._next_report = every
+        self._start = time.monotonic()
+
+    def advance(self, count):
+        self.done += count
+        if self.done >= self._next_report:
+            self._report()
+            self._next_report = self.done + self.every
+
+    def finish(self):
+        self._report()
+
+    def _report(self):
+        elapsed = max(time.monotonic() - self._start, 1e-6)
+        percent = f" ({100 * self.done / self.total:.1f}%)" if self.total else ""
+        print(f"  {self.label}: {self.done}{'/' + str(self.total) if self.total else ''} documents"
+              f"{percent}, {self.done / elapsed:.0f} docs/s", file=sys.stderr)
+
+
+def _is_bson(path):
+    return path.endswith('.bson.gz') or path.endswith('.bson')
+
+
+def _read_dump(path):
+    """Yield documents from a dump_collection file without loading it whole"""
+    with gzip.open(path, 'rb') as f:
+        if _is_bson(path):
+            yield from bson.decode_file_iter(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+
 
 class DatabaseManager:
     def __init__(self):
-        self.client = MongoClient('mongodb://localhost:27017/')
-        self.db = self.client.bot_detector
+        self.db = get_db()
 
     def clear_collection(self, collection_name):
         """Clear all documents from a collection"""
         result = self.db[collection_name].delete_many({})
         return f"Deleted {result.deleted_count} documents from {collection_name}"
 
-    def backup_collection(self, collection_name):
-        """Backup a collection"""
+    def backup_collection(self, collection_name, mode='server', batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Backup a collection into <name>_backup_<timestamp>. The default
+        server mode copies with an $out aggregation so no documents pass
+        through this process; stream mode copies cursor batches instead
+        (e.g. when the user lacks aggregation privileges)
+        """
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_collection = f"{collection_name}_backup_{timestamp}"
-        
-        # Copy all documents to backup collection
-        documents = list(self.db[collection_name].find({}))
-        if documents:
-            self.db[backup_collection].insert_many(documents)
-            return f"Backed up {len(documents)} documents to {backup_collection}"
-        return "No documents to backup"
-
-    def restore_backup(self, backup_collection, target_collection):
-        """Restore from a backup collection"""
-        documents = list(self.db[backup_collection].find({}))
-        if documents:
-            self.db[target_collection].delete_many({})
-            self.db[target_collection].insert_many(documents)
-            return f"Restored {len(documents)} documents to {target_collection}"
-        return "No documents to restore"
+
+        total = self.db[collection_name].estimated_document_count()
+        if not total:
+            return "No documents to backup"
+
+        if mode == 'server':
+            self.db[collection_name].aggregate([{'$out': backup_collection}])
+            copied = self.db[backup_collection].estimated_document_count()
+        else:
+            copied = self._copy_batches(self.db[collection_name].find({}, batch_size=batch_size),
+                                        self.db[backup_collection], batch_size, total)
+        return f"Backed up {copied} documents to {backup_collection}"
+
+    def restore_backup(self, backup_collection, target_collection, mode='server',
+                       batch_size=DEFAULT_BATCH_SIZE, merge=False):
+        """
+        Restore from a backup collection. The target is never emptied
+        before the data is in place: server mode uses $out (which replaces
+        the target atomically and keeps its indexes) or $merge with merge=True;
+        stream mode fills a temporary collection and swaps it in with rename
+        """
+        total = self.db[backup_collection].estimated_document_count()
+        if not total:
+            return "No documents to restore"
+
+        if mode == 'server':
+            if merge:
+                stage = {'$merge': {'into': target_collection, 'on': '_id',
+                                    'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+            else:
+                stage = {'$out': target_collection}
+            self.db[backup_collection].aggregate([stage])
+            restored = self.db[target_collection].estimated_document_count()
+            return f"Restored {target_collection} from {backup_collection} ({restored} documents)"
+
+        restored = self._swap_in(
+            target_collection,
+            lambda temp: self._copy_batches(self.db[backup_collection].find({}, batch_size=batch_size),
+                                            temp, batch_size, total))
+        return f"Restored {restored} documents to {target_collection}"
+
+    def dump_collection(self, collection_name, path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Stream a collection to a gzip-compressed file. Files ending in
+        .bson.gz hold concatenated BSON documents (like mongodump); anything
+        else is canonical Extended JSON, one document per line
+        """
+        collection = self.db[collection_name]
+        total = collection.estimated_document_count()
+        progress = Progress(collection_name, total)
+        with gzip.open(path, 'wb') as f:
+            for doc in collection.find({}, batch_size=batch_size):
+                if _is_bson(path):
+                    f.write(bson.encode(doc))
+                else:
+                    f.write(json_util.dumps(doc, json_options=CANONICAL_JSON_OPTIONS).encode('utf-8'))
+                    f.write(b'\n')
+                progress.advance(1)
+        progress.finish()
+        return f"Dumped {progress.done} documents from {collection_name} to {path}"
+
+    def load_dump(self, path, target_collection, batch_size=DEFAULT_BATCH_SIZE):
+        """Restore a file written by dump_collection with an atomic swap-in"""
+        restored = self._swap_in(
+            target_collection,
+            lambda temp: self._copy_batches(_read_dump(path), temp, batch_size, None))
+        return f"Restored {restored} documents from {path} to {target_collection}"
+
+    def _copy_batches(self, documents, target, batch_size, total):
+        progress = Progress(target.name, total)
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                target.insert_many(batch, ordered=False)
+                progress.advance(len(batch))
+                batch = []
+        if batch:
+            target.insert_many(batch, ordered=False)
+            progress.advance(len(batch))
+        progress.finish()
+        return progress.done
+
+    def _swap_in(self, target_collection, fill):
+        """
+        Fill a temporary collection, copy the target's indexes onto it and
+        rename it over the target. If anything fails the temporary
+        collection is dropped and the target is left untouched
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        temp = self.db[f"{target_collection}_restore_{timestamp}"]
+        try:
+            count = fill(temp)
+            if target_collection in self.db.list_collection_names():
+                for name, info in self.db[target_collection].index_information().items():
+                    if name == '_id_':
+                        continue
+                    options = {k: v for k, v in info.items() if k not in ('key', 'v', 'ns')}
+                    temp.create_index(info['key'], name=name, **options)
+            temp.rename(target_collection, dropTarget=True)
+            return count
+        except Exception:
+            temp.drop()
+            raise
 
     def view_collection_stats(self, collection_name):
         """View statistics for a collection"""
@@ -42,24 +190,49 @@ class DatabaseManager:
         }
         return stats
 
+    def create_indexes(self):
+        """Create the indexes the API relies on (safe to re-run)"""
+        created = ensure_indexes(self.db)
+        return '\n'.join(f"{name}: {', '.join(indexes)}" for name, indexes in created.items())
+
 def main():
     parser = argparse.ArgumentParser(description='Database Management Tool')
-    parser.add_argument('action', choices=['clear', 'backup', 'restore', 'stats'])
-    parser.add_argument('collection', help='Collection name')
+    parser.add_argument('action', choices=['clear', 'backup', 'restore', 'stats', 'indexes'])
+    parser.add_argument('collection', nargs='?', help='Collection name')
     parser.add_argument('--backup-name', help='Backup collection name for restore')
-    
+    parser.add_argument('--file', help='Dump to (backup) or load from (restore) a .ndjson.gz or .bson.gz file')
+    parser.add_argument('--mode', choices=['server', 'stream'], default='server',
+                        help='server: $out/$merge inside MongoDB; stream: copy cursor batches')
+    parser.add_argument('--merge', action='store_true',
+                        help='Restore with $merge (upsert by _id) instead of replacing the target')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
     args = parser.parse_args()
     db_manager = DatabaseManager()
 
+    if args.action == 'indexes':
+        print(db_manager.create_indexes())
+        return
+    if not args.collection:
+        print("Error: collection is required for this action")
+        return
+
     if args.action == 'clear':
         print(db_manager.clear_collection(args.collection))
     elif args.action == 'backup':
-        print(db_manager.backup_collection(args.collection))
+        if args.file:
+            print(db_manager.dump_collection(args.collection, args.file, args.batch_size))
+        else:
+            print(db_manager.backup_collection(args.collection, args.mode, args.batch_size))
     elif args.action == 'restore':
+        if args.file:
+            print(db_manager.load_dump(args.file, args.collection, args.batch_size))
+            return
         if not args.backup_name:
-            print("Error: --backup-name is required for restore action")
+            print("Error: --backup-name or --file is required for restore action")
             return
-        print(db_manager.restore_backup(args.backup_name, args.collection))
+        print(db_manager.restore_backup(args.backup_name, args.collection, args.mode,
+                                        args.batch_size, args.merge))
     elif args.action == 'stats':
         print(db_manager.view_collection_stats(args.collection))
 
@@ -0,0 +1,105 @@
+"""
+Score every author who posted or commented in a subreddit during a time
+window, storing the predictions like /api/predict/batch does.
+
+    python scripts/sweep_subreddit.py learnpython --hours 24
+    python scripts/sweep_subreddit.py learnpython --start 2024-05-01 --end 2024-05-02
+    python scripts/sweep_subreddit.py learnpython --hours 6 --checkpoint /tmp/lp.json
+
+Progress (items read per second, queue depth) is printed to stderr and
+the final stats as JSON to stdout. Rerunning a sweep after an
+interruption continues where it stopped: with --checkpoint the window is
+read back from the checkpoint, otherwise the default checkpoint under
+SWEEP_CHECKPOINT_DIR is named after the subreddit and window, so pass the
+same --start and --end.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SWEEP_BATCH_SIZE, SWEEP_QUEUE_SIZE, SWEEP_CHECKPOINT_DIR
+from models.bulk_writer import writer
+from models.registry import model_registry
+from utils.sweep import Sweep, checkpoint_path, load_checkpoint
+from datetime import datetime, timezone
+import argparse
+import json
+import signal
+import threading
+import time
+
+
+def _epoch(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def report_progress(sweep, every, done):
+    while not done.wait(every):
+        stats = sweep.stats()
+        print(f"  r/{stats['subreddit']}: {stats['items_read']} items "
+              f"({stats['items_per_s']} /s), {stats['authors_scored']}/"
+              f"{stats['authors_queued']} authors scored, {stats['bots']} bots, "
+              f"queue {stats['queue_depth']}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score every active author of a subreddit')
+    parser.add_argument('subreddit')
+    parser.add_argument('--hours', type=float, default=24, help='Window ending now')
+    parser.add_argument('--start', help='Window start (ISO date, UTC, or epoch seconds)')
+    parser.add_argument('--end', help='Window end (default now)')
+    parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+                        help='Authors per fetch + predict round')
+    parser.add_argument('--queue-size', type=int, default=SWEEP_QUEUE_SIZE,
+                        help='Max authors waiting to be scored')
+    parser.add_argument('--features', action='store_true',
+                        help='Also compute and store the extended activity features')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default under SWEEP_CHECKPOINT_DIR)')
+    parser.add_argument('--progress-every', type=float, default=10, help='Seconds between reports')
+    args = parser.parse_args()
+
+    end = _epoch(args.end) or time.time()
+    start = _epoch(args.start) or end - args.hours * 3600
+    checkpoint = args.checkpoint
+    loaded = load_checkpoint(checkpoint) if checkpoint and not args.start else None
+    if loaded is not None:
+        start, end = loaded[0]['start'], loaded[0]['end']
+    if not checkpoint:
+        os.makedirs(SWEEP_CHECKPOINT_DIR, exist_ok=True)
+        checkpoint = checkpoint_path(SWEEP_CHECKPOINT_DIR, args.subreddit, start, end)
+
+    if model_registry.load() is None:
+        print(f"Could not load model: {model_registry.error}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        sweep = Sweep(model_registry, args.subreddit, start, end, batch_size=args.batch_size,
+                      queue_size=args.queue_size, checkpoint_path=checkpoint,
+                      features=args.features)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+
+    # Ctrl-C stops after the current batch; the checkpoint is kept
+    signal.signal(signal.SIGINT, lambda *_: sweep.cancel())
+    done = threading.Event()
+    threading.Thread(target=report_progress, args=(sweep, args.progress_every, done),
+                     daemon=True).start()
+    stats = sweep.run()
+    done.set()
+    writer.flush()
+    print(f"Checkpoint: {checkpoint}", file=sys.stderr)
+    print(json.dumps(stats, indent=2))
+    sys.exit(0 if stats['state'] == 'done' else 1)
+
+
+if __name__ == '__main__':
+    main()
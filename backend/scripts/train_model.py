@@ -0,0 +1,351 @@
+"""
+Retrain the bot detection model from stored feedback.
+
+Feedback documents say whether the prediction shown to a user was right
+('Positive') or wrong ('Negative'). Each one is joined with the latest
+prediction for that username made before it, and with the user_data
+snapshot of that prediction, which gives a labelled row. Rows are built
+in batches and appended to an on-disk matrix, so memory use does not grow
+with the collections.
+
+    python scripts/train_model.py --output models/candidates
+    python scripts/train_model.py --estimator sgd --batch-size 5000
+    python scripts/train_model.py --calibration isotonic
+
+The artifact is written next to a <artifact>.metrics.json file holding
+the evaluation metrics and per-stage throughput, and a <artifact>.eval.npz
+sample of the held-out rows the service scores when it loads the model. Load it as a candidate
+through /api/admin/models/candidate to compare it with the primary.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.db import get_db
+from models.repository import PREDICTIONS, FEEDBACK, USER_SNAPSHOTS
+from config import MODEL_PATH
+from utils.preprocessing import preprocess_batch
+from manage_db import Progress
+from datetime import datetime, timedelta
+from utils.evaluation import chunks, evaluate, eval_data_path, save_eval_data
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.frozen import FrozenEstimator
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+import argparse
+import json
+import joblib
+import numpy as np
+import shutil
+import tempfile
+import time
+import zlib
+
+DEFAULT_BATCH_SIZE = 1000
+N_FEATURES = 3
+
+# Values of feedback.prediction sent by the feedback form
+FEEDBACK_CORRECT = 'Positive'
+FEEDBACK_WRONG = 'Negative'
+
+
+class StageTimer:
+    """Rows and wall time per pipeline stage"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, rows, seconds):
+        entry = self.stages.setdefault(stage, {'rows': 0, 'seconds': 0.0})
+        entry['rows'] += rows
+        entry['seconds'] += seconds
+
+    def report(self):
+        return {stage: {'rows': entry['rows'],
+                        'seconds': round(entry['seconds'], 3),
+                        'rows_per_s': round(entry['rows'] / entry['seconds'], 1)
+                        if entry['seconds'] else None}
+                for stage, entry in self.stages.items()}
+
+
+def _feedback_batches(db, since, batch_size):
+    query = {'prediction': {'$in': [FEEDBACK_CORRECT, FEEDBACK_WRONG]},
+             'username': {'$type': 'string'}}
+    if since:
+        query['timestamp'] = {'$gte': since}
+    cursor = db[FEEDBACK].find(query, projection={'username': 1, 'prediction': 1, 'timestamp': 1},
+                               batch_size=batch_size).sort('_id', 1)
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _join_batch(db, feedback, max_lag):
+    """
+    Label a batch of feedback documents. Returns (usernames, user_data
+    list, labels, skipped count). One predictions query and one
+    user_snapshots query per batch; max_lag bounds how long before a
+    feedback its prediction may have been made
+    """
+    usernames = list({doc['username'] for doc in feedback})
+    oldest = min(doc['timestamp'] for doc in feedback) - max_lag
+    newest = max(doc['timestamp'] for doc in feedback)
+    predictions = {}
+    for pred in db[PREDICTIONS].find(
+            {'username': {'$in': usernames}, 'timestamp': {'$gte': oldest, '$lte': newest}},
+            projection={'username': 1, 'prediction': 1, 'timestamp': 1}):
+        predictions.setdefault(pred['username'], []).append(pred)
+
+    matched = []
+    for doc in feedback:
+        earlier = [p for p in predictions.get(doc['username'], [])
+                   if p['timestamp'] <= doc['timestamp']]
+        if earlier:
+            matched.append((doc, max(earlier, key=lambda p: p['timestamp'])))
+
+    snapshots = {}
+    if matched:
+        for snap in db[USER_SNAPSHOTS].find(
+                {'_id': {'$in': [pred['_id'] for _, pred in matched]}},
+                projection={'user_data.post_karma': 1, 'user_data.comment_karma': 1,
+                            'user_data.listed_count': 1}):
+            snapshots[snap['_id']] = snap.get('user_data') or {}
+
+    names, users, labels = [], [], []
+    for doc, pred in matched:
+        user_data = snapshots.get(pred['_id'])
+        if user_data is None:
+            # Snapshot already expired (USER_DATA_TTL_DAYS)
+            continue
+        predicted = bool(pred.get('prediction'))
+        names.append(doc['username'])
+        users.append(user_data)
+        labels.append(predicted if doc['prediction'] == FEEDBACK_CORRECT else not predicted)
+    return names, users, labels, len(feedback) - len(users)
+
+
+def _split(username, test_fraction, calibration_fraction):
+    """
+    'test', 'calibration' or 'train'. Split by username so every row of an
+    account lands on the same side
+    """
+    bucket = zlib.crc32(username.lower().encode('utf-8')) % 10000
+    if bucket < test_fraction * 10000:
+        return 'test'
+    if bucket < (test_fraction + calibration_fraction) * 10000:
+        return 'calibration'
+    return 'train'
+
+
+class RowStore:
+    """Append-only float32 feature rows and uint8 labels in files under a work dir"""
+
+    def __init__(self, work_dir, name):
+        self.x_path = os.path.join(work_dir, f"{name}.X.f32")
+        self.y_path = os.path.join(work_dir, f"{name}.y.u8")
+        self._x = open(self.x_path, 'wb')
+        self._y = open(self.y_path, 'wb')
+        self.rows = 0
+
+    def append(self, features, labels):
+        self._x.write(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+        self._y.write(np.asarray(labels, dtype=np.uint8).tobytes())
+        self.rows += len(labels)
+
+    def open(self):
+        """Close for writing and return (X, y) memory-mapped from disk"""
+        self._x.close()
+        self._y.close()
+        if not self.rows:
+            return np.empty((0, N_FEATURES), dtype=np.float32), np.empty(0, dtype=np.uint8)
+        X = np.memmap(self.x_path, dtype=np.float32, mode='r', shape=(self.rows, N_FEATURES))
+        y = np.memmap(self.y_path, dtype=np.uint8, mode='r', shape=(self.rows,))
+        return X, y
+
+
+def extract(db, stores, args, timer):
+    """
+    Stream feedback into labelled rows on disk, one RowStore per split.
+    Returns rows skipped
+    """
+    calibration_fraction = args.calibration_fraction if args.calibration != 'none' else 0.0
+    since = datetime.fromisoformat(args.since) if args.since else None
+    max_lag = timedelta(hours=args.max_lag_hours)
+    progress = Progress('feedback', every=args.batch_size * 10)
+    skipped = 0
+    for feedback in _feedback_batches(db, since, args.batch_size):
+        start = time.perf_counter()
+        names, users, labels, batch_skipped = _join_batch(db, feedback, max_lag)
+        timer.add('join', len(feedback), time.perf_counter() - start)
+        skipped += batch_skipped
+
+        start = time.perf_counter()
+        if users:
+            features = preprocess_batch(users)
+            labels = np.asarray(labels, dtype=np.uint8)
+            split = np.array([_split(name, args.test_fraction, calibration_fraction)
+                              for name in names])
+            for name, store in stores.items():
+                rows = split == name
+                if rows.any():
+                    store.append(features[rows], labels[rows])
+        timer.add('features', len(users), time.perf_counter() - start)
+        progress.advance(len(feedback))
+    progress.finish()
+    return skipped
+
+
+def train(X, y, args, timer):
+    """
+    Fit the new model. 'sgd' learns with partial_fit over chunks of the
+    on-disk matrix, so memory stays bounded at any size. 'forest' (the
+    estimator the served model uses) needs its training rows in memory:
+    above --max-rows it is fitted on a uniform sample
+    """
+    start = time.perf_counter()
+    if args.estimator == 'sgd':
+        scaler = StandardScaler()
+        for rows in chunks(len(y), args.chunk_size):
+            scaler.partial_fit(X[rows])
+        classifier = SGDClassifier(loss='log_loss', random_state=args.seed)
+        rng = np.random.default_rng(args.seed)
+        for _ in range(args.epochs):
+            slices = list(chunks(len(y), args.chunk_size))
+            for i in rng.permutation(len(slices)):
+                rows = slices[i]
+                classifier.partial_fit(scaler.transform(X[rows]), y[rows], classes=[0, 1])
+        model = make_pipeline(scaler, classifier)
+        rows_seen = len(y) * args.epochs
+    else:
+        if len(y) > args.max_rows:
+            rng = np.random.default_rng(args.seed)
+            sample = np.sort(rng.choice(len(y), size=args.max_rows, replace=False))
+            X, y = np.asarray(X[sample]), np.asarray(y[sample])
+        model = RandomForestClassifier(n_estimators=args.n_estimators, n_jobs=args.n_jobs,
+                                       random_state=args.seed)
+        model.fit(X, y)
+        rows_seen = len(y)
+    timer.add('train', rows_seen, time.perf_counter() - start)
+    return model
+
+
+def calibrate(model, X, y, args, timer):
+    """
+    Fit a sigmoid or isotonic map from the model's scores to probabilities
+    on the calibration rows, which the model was not trained on
+    """
+    start = time.perf_counter()
+    if len(y) > args.max_rows:
+        rng = np.random.default_rng(args.seed)
+        sample = np.sort(rng.choice(len(y), size=args.max_rows, replace=False))
+        X, y = X[sample], y[sample]
+    calibrated = CalibratedClassifierCV(FrozenEstimator(model), method=args.calibration)
+    calibrated.fit(np.asarray(X), np.asarray(y))
+    timer.add('calibrate', len(y), time.perf_counter() - start)
+    return calibrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retrain the bot detection model from feedback')
+    parser.add_argument('--output', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'candidates'),
+        help='Directory for the model artifact and its metrics')
+    parser.add_argument('--estimator', choices=['forest', 'sgd'], default='forest')
+    parser.add_argument('--since', help='Only use feedback from this ISO date on')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Feedback documents joined per round-trip')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Rows per partial_fit / evaluation chunk')
+    parser.add_argument('--max-lag-hours', type=float, default=24,
+                        help='Max time between a prediction and its feedback')
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--calibration', choices=['none', 'sigmoid', 'isotonic'], default='none',
+                        help='Calibrate predict_proba on a separate split of users')
+    parser.add_argument('--calibration-fraction', type=float, default=0.1)
+    parser.add_argument('--eval-max-rows', type=int, default=100000,
+                        help='Held-out rows stored with the artifact for load-time metrics')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Parallel jobs for the forest')
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--max-rows', type=int, default=5000000,
+                        help='Forest only: sample training rows above this')
+    parser.add_argument('--epochs', type=int, default=5, help='SGD passes over the data')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=MODEL_PATH,
+                        help='Model to evaluate on the same test rows for comparison')
+    parser.add_argument('--work-dir', default=None, help='Where the temporary matrices go')
+    args = parser.parse_args()
+
+    timer = StageTimer()
+    os.makedirs(args.output, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    artifact = os.path.join(args.output, f"reddit_bot_detection_model_{stamp}.pkl")
+    work_dir = tempfile.mkdtemp(prefix='train_model_', dir=args.work_dir)
+    try:
+        stores = {name: RowStore(work_dir, name) for name in ('train', 'calibration', 'test')}
+        skipped = extract(get_db(), stores, args, timer)
+        X_train, y_train = stores['train'].open()
+        X_cal, y_cal = stores['calibration'].open()
+        X_test, y_test = stores['test'].open()
+        print(f"Labelled rows: {len(y_train)} train, {len(y_cal)} calibration, "
+              f"{len(y_test)} test, {skipped} skipped (no prediction or snapshot)", file=sys.stderr)
+        if len(np.unique(y_train)) < 2:
+            print("Need training rows of both classes; collect more feedback first", file=sys.stderr)
+            sys.exit(1)
+
+        model = train(X_train, y_train, args, timer)
+        if args.calibration != 'none':
+            if len(np.unique(y_cal)) < 2:
+                print("Not enough calibration rows of both classes; skipping calibration",
+                      file=sys.stderr)
+            else:
+                model = calibrate(model, X_cal, y_cal, args, timer)
+
+        if len(y_test):
+            # A sample of the held-out rows goes with the artifact so the
+            # service can compute the metrics of whatever it loads
+            rows = np.arange(len(y_test))
+            if len(rows) > args.eval_max_rows:
+                rows = np.sort(np.random.default_rng(args.seed).choice(
+                    rows, size=args.eval_max_rows, replace=False))
+            save_eval_data(eval_data_path(artifact), X_test[rows], y_test[rows])
+
+        start = time.perf_counter()
+        metrics = {'model': evaluate(model, X_test, y_test, args.chunk_size), 'baseline': None}
+        if args.baseline and os.path.exists(args.baseline):
+            metrics['baseline'] = evaluate(joblib.load(args.baseline), X_test, y_test,
+                                           args.chunk_size)
+        timer.add('evaluate', len(y_test), time.perf_counter() - start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    start = time.perf_counter()
+    joblib.dump(model, artifact, compress=3)
+    timer.add('save', 1, time.perf_counter() - start)
+
+    result = {
+        'artifact': artifact,
+        'estimator': args.estimator,
+        'calibration': args.calibration,
+        'trained_at': datetime.utcnow().isoformat(),
+        'train_rows': int(len(y_train)),
+        'calibration_rows': int(len(y_cal)),
+        'test_rows': int(len(y_test)),
+        'skipped': skipped,
+        'metrics': metrics,
+        'stages': timer.report()
+    }
+    with open(f"{artifact}.metrics.json", 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
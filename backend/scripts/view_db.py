@@ -1,11 +1,15 @@
-from pymongo import MongoClient
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.db import get_db
 from pprint import pprint
 import json
 
 def view_database():
     # Connect to MongoDB
-    client = MongoClient('mongodb://localhost:27017/')
-    db = client.bot_detector  # Your database name
+    db = get_db()
 
     # List all collections
     print("\n=== Collections ===")
@@ -28,8 +32,7 @@ def view_database():
         print(f"\nTotal documents in {collection}: {len(documents)}")
 
 def export_to_json():
-    client = MongoClient('mongodb://localhost:27017/')
-    db = client.bot_detector
+    db = get_db()
 
     # Export each collection to a JSON file
     for collection_name in db.list_collection_names():
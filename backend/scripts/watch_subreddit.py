@@ -0,0 +1,88 @@
+"""
+Watch the comment stream of a subreddit and score authors whose recent
+activity crosses the rate or repetition thresholds (WATCH_* settings).
+
+    python scripts/watch_subreddit.py learnpython
+    python scripts/watch_subreddit.py learnpython --record /tmp/learnpython.jsonl
+    python scripts/watch_subreddit.py --replay scripts/sample_comment_stream.jsonl --dry-run
+
+--replay reads a JSON-lines event file instead of Reddit (as fast as
+possible, or at --speed times the recorded pace), which makes runs
+reproducible; --record writes the live stream to such a file. --dry-run
+only reports the triggers, without fetching or scoring anyone. Stats are
+printed to stderr every --stats-every seconds and as JSON on exit.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (WATCH_RATE_WINDOW, WATCH_RATE_THRESHOLD, WATCH_REPEAT_THRESHOLD,
+                    WATCH_MAX_AUTHORS)
+from models.bulk_writer import writer
+from models.registry import model_registry
+from utils.watcher import CommentWatcher, read_event_file, EventRecorder
+import argparse
+import json
+import signal
+import threading
+
+
+def report_stats(watcher, every, done):
+    while not done.wait(every):
+        stats = watcher.stats()
+        print(f"  {stats['events']} comments ({stats['events_per_s']} /s), "
+              f"{stats['authors_tracked']} authors tracked, {stats['triggers']} triggers, "
+              f"{stats['scored']} scored, {stats['bots']} bots", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score suspicious authors of a live comment stream')
+    parser.add_argument('subreddit', nargs='?', help='Subreddit to watch (not needed with --replay)')
+    parser.add_argument('--replay', help='JSON-lines event file to read instead of Reddit')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Replay pace relative to the recording; 0 = as fast as possible')
+    parser.add_argument('--record', help='Append the live events to this JSON-lines file')
+    parser.add_argument('--dry-run', action='store_true', help='Count triggers without scoring')
+    parser.add_argument('--rate-window', type=int, default=WATCH_RATE_WINDOW)
+    parser.add_argument('--rate-threshold', type=int, default=WATCH_RATE_THRESHOLD)
+    parser.add_argument('--repeat-threshold', type=int, default=WATCH_REPEAT_THRESHOLD)
+    parser.add_argument('--max-authors', type=int, default=WATCH_MAX_AUTHORS)
+    parser.add_argument('--stats-every', type=float, default=60)
+    args = parser.parse_args()
+    if not args.subreddit and not args.replay:
+        parser.error('a subreddit or --replay is required')
+
+    if not args.dry_run and model_registry.load() is None:
+        print(f"Could not load model: {model_registry.error}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.replay:
+        events = read_event_file(args.replay, args.speed)
+    else:
+        from utils.reddit_api import stream_subreddit_comments
+        events = stream_subreddit_comments(args.subreddit)
+    recorder = EventRecorder(args.record) if args.record else None
+
+    watcher = CommentWatcher(model_registry, subreddit=args.subreddit, score=not args.dry_run,
+                             max_authors=args.max_authors, rate_window=args.rate_window,
+                             rate_threshold=args.rate_threshold,
+                             repeat_threshold=args.repeat_threshold)
+    stopping = threading.Event()
+    # Ctrl-C stops at the next event (or heartbeat) and scores what is queued
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    done = threading.Event()
+    threading.Thread(target=report_stats, args=(watcher, args.stats_every, done),
+                     daemon=True).start()
+    try:
+        stats = watcher.run(events, stop=stopping.is_set, on_event=recorder)
+    finally:
+        done.set()
+        if recorder is not None:
+            recorder.close()
+        writer.flush()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
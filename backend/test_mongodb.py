@@ -1,6 +1,5 @@
-from pymongo import MongoClient
-import os
 from dotenv import load_dotenv
+from models.db import get_client
 
 # Load environment variables
 load_dotenv()
@@ -8,7 +7,7 @@ load_dotenv()
 def test_mongodb_connection():
     try:
         # Connect to MongoDB
-        client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+        client = get_client()
         
         # Test the connection
         client.server_info()
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import mongomock
+import pytest
+
+# The settings are read once, at import of config; point every on-disk
+# path at a scratch directory and use the stub LLM before anything else
+# imports it
+_scratch = tempfile.mkdtemp(prefix='surakshit-tests-')
+for name, value in {
+    'REDDIT_CLIENT_ID': 'test',
+    'REDDIT_CLIENT_SECRET': 'test',
+    'REDDIT_USER_AGENT': 'surakshit-tests',
+    'MONGODB_URI': 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100',
+    'MODEL_CACHE_DIR': os.path.join(_scratch, 'model-cache'),
+    'SIMILARITY_INDEX_PATH': os.path.join(_scratch, 'similarity.npz'),
+    'GRAPH_PATH': os.path.join(_scratch, 'graph.npz'),
+    'BULK_WRITE_SPILL_DIR': os.path.join(_scratch, 'spill'),
+    'SWEEP_CHECKPOINT_DIR': os.path.join(_scratch, 'sweeps'),
+    'LLM_PROVIDER': 'stub',
+    'LLM_STUB_LATENCY_MS': '0',
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db  # noqa: E402
+
+db._client = mongomock.MongoClient()
+
+
+@pytest.fixture
+def mongo():
+    """The (mongomock) database, emptied after the test"""
+    yield db.get_db()
+    db.get_client().drop_database(db.get_db().name)
+
+
+@pytest.fixture
+def scratch_dir(tmp_path):
+    return str(tmp_path)
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND, 'scripts'))
+
+from bench_pipeline import SCENARIOS, compare  # noqa: E402
+
+REQUESTS = 10
+BATCH_SIZE = 3
+
+
+@pytest.fixture(scope='module')
+def bench_output(tmp_path_factory):
+    # A process of its own: the script configures the application's
+    # environment before importing it
+    output = tmp_path_factory.mktemp('bench') / 'bench.json'
+    subprocess.run(
+        [sys.executable, os.path.join(BACKEND, 'scripts', 'bench_pipeline.py'),
+         '--concurrency', '1', '--requests', str(REQUESTS), '--batch-size', str(BATCH_SIZE),
+         '--reddit-latency-ms', '0', '--llm-latency-ms', '0', '--output', str(output)],
+        cwd=BACKEND, check=True, capture_output=True, timeout=300)
+    with open(output) as f:
+        return json.load(f)
+
+
+def test_smoke_run_has_no_errors(bench_output):
+    results = {result['scenario']: result for result in bench_output['results']}
+    assert list(results) == list(SCENARIOS)
+    for result in results.values():
+        assert result['concurrency'] == 1
+        assert result['requests'] == REQUESTS
+        assert result['errors'] == 0
+        assert sum(result['status_codes'].values()) == REQUESTS
+        assert set(result['latency_ms']) == {'p50', 'p95', 'p99', 'mean', 'max'}
+        assert result['throughput_rps'] > 0
+
+    assert results['predict']['status_codes'] == {'200': REQUESTS}
+    assert results['predict_cached']['cache_fresh'] == REQUESTS
+    assert results['batch']['users'] == REQUESTS * BATCH_SIZE
+    assert results['batch']['users_per_s'] > 0
+    assert results['report']['status_codes'] == {'202': REQUESTS}
+    assert results['report']['report_gemini'] == REQUESTS
+
+    meta = bench_output['meta']
+    assert {'started', 'commit', 'python', 'platform', 'cpus', 'args'} <= set(meta)
+    assert meta['args']['mongo'] == 'mongomock' and meta['args']['concurrency'] == [1]
+
+
+def test_compare_flags_regressions(bench_output):
+    results = bench_output['results']
+    assert compare(results, bench_output, 0.2) == []
+
+    slower = [{**result, 'latency_ms': {**result['latency_ms'],
+                                        'p95': result['latency_ms']['p95'] * 2},
+               'throughput_rps': result['throughput_rps'] / 2} for result in results]
+    regressions = compare(slower, bench_output, 0.2)
+    assert {(r['scenario'], r['metric']) for r in regressions} == \
+        {(scenario, metric) for scenario in SCENARIOS for metric in ('p95_ms', 'throughput_rps')}
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import time
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+from models import db
+from models.bulk_writer import BulkWriter
+
+COLLECTION = 'predictions'
+
+
+@pytest.fixture
+def writer(mongo, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, '_available', True)
+    monkeypatch.setattr(db, '_checked_at', time.monotonic())
+    return BulkWriter(max_batch=2, spill_dir=str(tmp_path))
+
+
+def _documents(count):
+    return [(COLLECTION, {'username': f'user{i}'}) for i in range(count)]
+
+
+def _spill_files(writer):
+    return sorted(os.listdir(writer.spill_dir))
+
+
+def _usernames(mongo):
+    return sorted(doc['username'] for doc in mongo[COLLECTION].find())
+
+
+def test_spilled_documents_are_replayed(writer, mongo):
+    writer._spill(_documents(5))
+    assert _spill_files(writer) == [f'pending_writes.{os.getpid()}.ndjson']
+
+    writer._replay_spill()
+    assert _usernames(mongo) == [f'user{i}' for i in range(5)]
+    assert writer.replayed == 5
+    assert _spill_files(writer) == []
+
+
+def test_failure_mid_replay_spills_the_rest_again(writer, mongo, monkeypatch):
+    writer._spill(_documents(5))
+    insert_many = mongomock.collection.Collection.insert_many
+    calls = []
+
+    def failing_insert_many(self, documents, *args, **kwargs):
+        calls.append(len(documents))
+        if len(calls) == 2:
+            raise AutoReconnect('connection reset')
+        return insert_many(self, documents, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'insert_many', failing_insert_many)
+    writer._replay_spill()
+    # The first batch was written; the failed one and the rest are spilled
+    # again rather than lost with the claimed file
+    assert _usernames(mongo) == ['user0', 'user1']
+    assert _spill_files(writer) == [f'pending_writes.{os.getpid()}.ndjson']
+
+    monkeypatch.setattr(db, '_available', True)
+    writer._replay_spill()
+    assert _usernames(mongo) == [f'user{i}' for i in range(5)]
+    assert _spill_files(writer) == []
+
+
+def test_truncated_line_does_not_lose_the_file(writer, mongo):
+    writer._spill(_documents(3))
+    with open(os.path.join(writer.spill_dir, _spill_files(writer)[0]), 'a') as f:
+        f.write('{"collection": "predictions", "docu')
+
+    writer._replay_spill()
+    assert _usernames(mongo) == ['user0', 'user1', 'user2']
+    assert writer.dropped == 1
+    assert _spill_files(writer) == []
+
+
+def test_only_own_and_dead_workers_spills_are_replayed(writer, mongo):
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    live = os.getppid()
+    for pid, name in ((dead.pid, 'dead'), (live, 'live')):
+        path = os.path.join(writer.spill_dir, f'pending_writes.{pid}.ndjson')
+        with open(path, 'w') as f:
+            f.write(f'{{"collection": "{COLLECTION}", "document": {{"username": "{name}"}}}}\n')
+    # A replay that died part-way is picked up as well
+    with open(os.path.join(writer.spill_dir,
+                           f'pending_writes.{live}.ndjson.replaying.{dead.pid}'), 'w') as f:
+        f.write(f'{{"collection": "{COLLECTION}", "document": {{"username": "orphan"}}}}\n')
+
+    writer._replay_spill()
+    assert _usernames(mongo) == ['dead', 'orphan']
+    # The live worker may still append to its file
+    assert _spill_files(writer) == [f'pending_writes.{live}.ndjson']
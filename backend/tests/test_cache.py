@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+from prawcore.exceptions import NotFound
+
+from utils import cache, reddit_api
+from utils.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    entries = TTLCache(maxsize=10, ttl=60)
+    entries.set('a', 1)
+    clock.now += 59
+    assert entries.get('a') == 1
+    clock.now += 1
+    assert entries.get('a') is None
+    assert entries.stats()['expirations'] == 1
+    assert len(entries) == 0
+
+
+def test_per_entry_ttl_overrides_default(clock):
+    entries = TTLCache(maxsize=10, ttl=300)
+    entries.set('found', 1)
+    entries.set('missing', 0, ttl=60)
+    clock.now += 61
+    assert entries.get('missing', 'miss') == 'miss'
+    assert entries.get('found') == 1
+
+
+def test_least_recently_used_evicted_first(clock):
+    entries = TTLCache(maxsize=3, ttl=60)
+    for key in 'abc':
+        entries.set(key, key)
+    # Reading 'a' makes 'b' the least recently used
+    assert entries.get('a') == 'a'
+    entries.set('d', 'd')
+
+    assert entries.get('b') is None
+    assert [entries.get(key) for key in 'acd'] == ['a', 'c', 'd']
+    stats = entries.stats()
+    assert stats['evictions'] == 1
+    assert stats['size'] == 3
+    assert stats['hits'] == 4
+    assert stats['misses'] == 1
+
+
+@pytest.fixture
+def profiles(monkeypatch, clock):
+    """reddit_api with an empty profile cache and a counting fake fetch"""
+    monkeypatch.setattr(reddit_api, 'user_cache', TTLCache(maxsize=10, ttl=300))
+    monkeypatch.setattr(reddit_api, 'REDDIT_CACHE_NEGATIVE_TTL', 60)
+    fetched = []
+
+    def fetch(username):
+        fetched.append(username)
+        if username.lower() == 'ghost':
+            raise NotFound(SimpleNamespace(status_code=404))
+        return {'screen_name': username, 'name': 'Alice', 'achievements': ['Popular Post']}
+
+    monkeypatch.setattr(reddit_api, '_fetch_reddit_user_details', fetch)
+    return fetched
+
+
+def test_cached_profile_uses_callers_casing(profiles):
+    first = reddit_api.get_reddit_user_details('Alice')
+    first['achievements'].append('annotated')
+    second = reddit_api.get_reddit_user_details('alice')
+    bulk = reddit_api.get_reddit_users_details(['ALICE'])
+
+    assert profiles == ['Alice']
+    assert first['screen_name'] == 'Alice'
+    assert second['screen_name'] == 'alice'
+    assert bulk['ALICE']['screen_name'] == 'ALICE'
+    # Changes to a returned dict never reach the cached entry
+    assert second['achievements'] == ['Popular Post']
+
+
+def test_missing_user_cached_for_negative_ttl(profiles, clock):
+    assert reddit_api.get_reddit_user_details('ghost') is None
+    clock.now += 59
+    assert reddit_api.get_reddit_user_details('Ghost') is None
+    assert reddit_api.get_reddit_users_details(['GHOST']) == {'GHOST': None}
+    assert profiles == ['ghost']
+
+    clock.now += 1
+    assert reddit_api.get_reddit_user_details('ghost') is None
+    assert profiles == ['ghost', 'ghost']
@@ -0,0 +1,125 @@
+import time
+
+import numpy as np
+import pytest
+
+from models import db, feature_store
+from utils import pipeline
+from utils.features import compute_features, empty_stats, merge_stats, summarize_activity
+
+NOW = 1_700_000_000.0
+USER = {'screen_name': 'feat', 'post_karma': 120, 'comment_karma': 40,
+        'cake_day': NOW - 400 * 86400}
+
+
+def _items(count, start=NOW - 86400 * 30):
+    """Activity with short and long gaps, repeated texts and a few subreddits"""
+    items, ts = [], start
+    for i in range(count):
+        ts += 30 if i % 4 else 5000 + i * 17
+        items.append({
+            'id': f"t1_{i}",
+            'kind': 'submission' if i % 3 == 0 else 'comment',
+            'created_utc': ts,
+            'text': 'buy cheap followers now' if i % 5 == 0 else f"comment number {i} about things",
+            'subreddit': ('news', 'pics', 'AskReddit', 'gaming')[i % 4]
+        })
+    return items
+
+
+def _assert_same_stats(merged, full):
+    assert merged.keys() == full.keys()
+    for key, value in full.items():
+        if isinstance(value, np.ndarray):
+            np.testing.assert_array_equal(merged[key], value)
+        elif isinstance(value, float):
+            assert merged[key] == pytest.approx(value)
+        else:
+            assert merged[key] == value
+
+
+@pytest.mark.parametrize('split', [1, 7, 20, 39])
+def test_merge_matches_full_summary(split):
+    items = _items(40)
+    merged = merge_stats(summarize_activity(items[:split]), summarize_activity(items[split:]))
+    full = summarize_activity(items)
+
+    _assert_same_stats(merged, full)
+    np.testing.assert_allclose(compute_features(USER, merged, now=NOW),
+                               compute_features(USER, full, now=NOW), rtol=1e-6)
+
+
+def test_merge_with_nothing_new_is_unchanged():
+    old = summarize_activity(_items(10))
+    assert merge_stats(old, empty_stats()) is old
+    assert merge_stats(empty_stats(), old) is old
+
+
+@pytest.fixture
+def store(mongo, monkeypatch):
+    """build_features with the feature store on Mongo and a fake listing"""
+    monkeypatch.setattr(db, '_available', True)
+    monkeypatch.setattr(db, '_checked_at', time.monotonic())
+    monkeypatch.setattr(pipeline, 'FEATURE_STORE_ENABLED', True)
+    monkeypatch.setattr(pipeline, 'SIMILARITY_ENABLED', False)
+    monkeypatch.setattr(pipeline, 'GRAPH_ENABLED', False)
+    monkeypatch.setattr(pipeline, 'compute_features',
+                        lambda user_data, stats, timings=None: compute_features(
+                            user_data, stats, timings, now=NOW))
+    listing = {'items': [], 'calls': []}
+
+    def get_user_activity(username, limit=100, since=None, seen_ids=()):
+        listing['calls'].append(since)
+        return [item for item in sorted(listing['items'], key=lambda item: -item['created_utc'])
+                if (since is None or item['created_utc'] >= since) and item['id'] not in seen_ids]
+
+    monkeypatch.setattr(pipeline, 'get_user_activity', get_user_activity)
+    return listing
+
+
+def test_rescan_merges_new_items(store):
+    items = _items(30)
+    store['items'] = items[:18]
+    pipeline.build_features(dict(USER))
+    store['items'] = items
+    incremental, _ = pipeline.build_features(dict(USER))
+
+    assert store['calls'] == [None, items[17]['created_utc']]
+    full = compute_features(USER, summarize_activity(items), now=NOW)
+    np.testing.assert_allclose(incremental, full, rtol=1e-6)
+    assert feature_store.load('Feat')['version'] == 2
+
+
+def test_rescan_without_new_items(store):
+    store['items'] = _items(12)
+    first, _ = pipeline.build_features(dict(USER))
+    entry = feature_store.load('feat')
+    again, _ = pipeline.build_features(dict(USER))
+
+    np.testing.assert_array_equal(again, first)
+    # Nothing new was counted, so the stored entry is left alone
+    unchanged = feature_store.load('feat')
+    assert unchanged['version'] == entry['version'] == 1
+    assert unchanged['cursor'] == entry['cursor']
+    _assert_same_stats(unchanged['stats'], entry['stats'])
+
+
+def test_concurrent_save_conflicts(mongo, monkeypatch):
+    monkeypatch.setattr(db, '_available', True)
+    monkeypatch.setattr(db, '_checked_at', time.monotonic())
+    items = _items(20)
+    first = summarize_activity(items[:10])
+    assert feature_store.save('race', first, first['last_ts'], [], 0)
+    # A second first scan loses the insert race
+    assert not feature_store.save('race', first, first['last_ts'], [], 0)
+
+    # Two rescans both read version 1; only the first save lands
+    entry = feature_store.load('race')
+    merged = merge_stats(entry['stats'], summarize_activity(items[10:]))
+    assert feature_store.save('race', merged, merged['last_ts'], [], entry['version'])
+    assert not feature_store.save('race', merged, merged['last_ts'], [], entry['version'])
+
+    stored = feature_store.load('race')
+    assert stored['version'] == 2
+    assert stored['stats']['count'] == 20
+    _assert_same_stats(stored['stats'], summarize_activity(items))
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+
+from utils.graph import CO_COMMENT, CONTENT, AccountGraph
+
+
+def _comments(thread, start, subreddits=('deals0', 'deals1', 'deals2')):
+    return [{'kind': 'comment', 'link_id': f't3_{thread}{i}', 'created_utc': start + i * 3600,
+             'subreddit': subreddit} for i, subreddit in enumerate(subreddits)]
+
+
+def _edges(graph, kind):
+    n = len(graph)
+    coo = graph.layers[kind].compact(graph.max_edges)[:n, :n].tocoo()
+    return {(graph.names[a].lower(), graph.names[b].lower(), float(w))
+            for a, b, w in zip(coo.row, coo.col, coo.data)}
+
+
+def _bot_graph():
+    graph = AccountGraph(max_accounts=100)
+    for offset, name in enumerate(('bot_a', 'bot_b', 'bot_c')):
+        graph.add_activity(name, _comments('ring', 1717200000 + offset * 10), 0.9)
+    graph.add_similar('bot_a', [('bot_b', 0.8), ('bot_c', 0.7)])
+    return graph
+
+
+def test_edges_and_rings_survive_save_and_load(mongo, tmp_path):
+    path = str(tmp_path / 'graph.npz')
+    graph = _bot_graph()
+    graph.find_rings()
+    graph.save(path)
+
+    loaded = AccountGraph(max_accounts=100)
+    assert loaded.load(path)
+    assert _edges(loaded, CO_COMMENT) == _edges(graph, CO_COMMENT)
+    assert _edges(loaded, CONTENT) == {('bot_a', 'bot_b', np.float32(0.8)),
+                                       ('bot_a', 'bot_c', np.float32(0.7))}
+    assert (loaded._unique_memberships() == graph._unique_memberships()).all()
+    assert loaded.network_summary('bot_b') == graph.network_summary('bot_b')
+    assert loaded.network_summary('bot_b')['ring']['size'] == 3
+
+    # A rescan after loading is recognized as one
+    assert loaded.add_activity('bot_a', _comments('ring', 1717200000)) == 0
+
+
+def test_saves_merge_instead_of_overwriting(tmp_path):
+    path = str(tmp_path / 'graph.npz')
+    worker_a, worker_b = AccountGraph(max_accounts=100), AccountGraph(max_accounts=100)
+    worker_a.add_activity('bot_a', _comments('ring', 1717200000), 0.9)
+    worker_b.add_activity('bot_b', _comments('ring', 1717200010), 0.8)
+    worker_b.add_activity('bot_c', _comments('ring', 1717200020))
+    worker_b.add_similar('bot_b', [('bot_c', 0.6)])
+    worker_a.save(path)
+    worker_b.save(path)
+
+    merged = AccountGraph(max_accounts=100)
+    assert merged.load(path)
+    assert sorted(name.lower() for name in merged.names) == ['bot_a', 'bot_b', 'bot_c']
+    assert merged.scores[merged._node('bot_a')] == np.float32(0.9)
+    assert _edges(merged, CONTENT) == {('bot_b', 'bot_c', np.float32(0.6))}
+    # Comments logged by both workers are matched against later scans
+    assert merged.add_activity('bot_d', _comments('ring', 1717200030)) == 9
+
+    # Merging the same file again changes nothing
+    edges = _edges(worker_b, CO_COMMENT)
+    assert worker_b.merge_file(path) == 0
+    assert _edges(worker_b, CO_COMMENT) == edges
+    assert worker_a.merge_file(path) == 2
+    assert _edges(worker_a, CONTENT) == {('bot_b', 'bot_c', np.float32(0.6))}
+
+
+def test_maintenance_starts_on_first_use(tmp_path):
+    path = tmp_path / 'graph.npz'
+    graph = AccountGraph(max_accounts=100)
+    graph.autosave(str(path), 0.05)
+    time.sleep(0.2)
+    # The gunicorn master imports the module but never adds accounts
+    assert graph._maintain_pid is None and not path.exists()
+
+    graph.add_activity('bot_a', _comments('ring', 1717200000))
+    deadline = time.monotonic() + 5
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert path.exists()
@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, repository
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def client(mongo, monkeypatch):
+    import app
+    monkeypatch.setattr(db, "_available", True)
+    monkeypatch.setattr(db, "_checked_at", time.monotonic())
+    mongo[repository.PREDICTIONS].insert_many([{
+        "username": "hist_user", "prediction": i % 2, "bot_probability": i / 10,
+        "model_version": "v1", "timestamp": START + timedelta(minutes=i),
+        "user_data": {"screen_name": "hist_user", "post_karma": i}
+    } for i in range(5)] + [{
+        "username": "someone_else", "prediction": 1, "timestamp": START,
+        "user_data": {"screen_name": "someone_else"}
+    }])
+    mongo[repository.REPORTS].insert_one({
+        "username": "hist_user", "cache_key": "abc", "timestamp": START,
+        "report": {"summary": "a long LLM report"}
+    })
+    mongo[repository.FEEDBACK].insert_one({
+        "username": "hist_user", "feedback": "incorrect", "comment": "not a bot",
+        "prediction": 1, "timestamp": START
+    })
+    return app.app.test_client()
+
+
+def test_predictions_paged_newest_first(client):
+    pages, before = [], None
+    while True:
+        query = {"limit": 2, **({"before": before} if before else {})}
+        response = client.get("/api/history/hist_user", query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        pages.append([item["bot_probability"] for item in body["items"]])
+        before = body["next_before"]
+        if before is None:
+            break
+
+    assert pages == [[0.4, 0.3], [0.2, 0.1], [0.0]]
+    assert body["type"] == repository.PREDICTIONS
+
+
+def test_projection_leaves_out_bulky_fields(client):
+    item = client.get("/api/history/hist_user", query_string={"limit": 1}).get_json()["items"][0]
+    assert set(item) == {"_id", "username", "prediction", "bot_probability",
+                         "model_version", "timestamp"}
+    assert item["timestamp"] == (START + timedelta(minutes=4)).isoformat()
+
+    reports = client.get("/api/history/hist_user", query_string={"type": "reports"}).get_json()
+    assert [set(item) for item in reports["items"]] == [{"_id", "username", "cache_key", "timestamp"}]
+
+    feedback = client.get("/api/history/hist_user", query_string={"type": "feedback"}).get_json()
+    assert [item["comment"] for item in feedback["items"]] == ["not a bot"]
+    assert feedback["next_before"] is None
+
+
+@pytest.mark.parametrize("query", [{"type": "user_snapshots"}, {"before": "yesterday"},
+                                   {"limit": "0"}, {"limit": "many"}])
+def test_invalid_parameters_rejected(client, query):
+    assert client.get("/api/history/hist_user", query_string=query).status_code == 400
+
+
+def test_unavailable_without_mongo(client, monkeypatch):
+    monkeypatch.setattr(db, "_available", False)
+    assert client.get("/api/history/hist_user").status_code == 503
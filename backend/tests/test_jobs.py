@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from utils import jobs
+from utils.jobs import ReportJobQueue
+
+
+def _wait_for(queue, job_id, status='done', timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not reach {status}")
+
+
+@pytest.fixture
+def report(monkeypatch):
+    monkeypatch.setattr(jobs, 'get_cached_report', lambda user_data: None)
+    monkeypatch.setattr(jobs, 'generate_report',
+                        lambda user_data: {'summary': f"report for {user_data['screen_name']}"})
+
+
+def test_job_polled_from_another_queue(mongo, report):
+    accepting = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60)
+    job = accepting.submit({'screen_name': 'alice'})
+    _wait_for(accepting, job['job_id'])
+
+    # A fresh queue stands in for another gunicorn worker
+    polled = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60).get(job['job_id'])
+    assert polled['status'] == 'done'
+    assert polled['username'] == 'alice'
+    assert polled['report'] == {'summary': 'report for alice'}
+
+
+def test_failed_job_is_shared(mongo, monkeypatch):
+    def fail(user_data):
+        raise RuntimeError('LLM down')
+
+    monkeypatch.setattr(jobs, 'get_cached_report', lambda user_data: None)
+    monkeypatch.setattr(jobs, 'generate_report', fail)
+    accepting = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60)
+    job = accepting.submit({'screen_name': 'bob'})
+    _wait_for(accepting, job['job_id'], status='failed')
+
+    polled = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60).get(job['job_id'])
+    assert polled['status'] == 'failed'
+    assert polled['error'] == 'LLM down'
+
+
+def test_expired_job_not_found(mongo, report):
+    accepting = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=0)
+    job = accepting.submit({'screen_name': 'carol'})
+    time.sleep(0.05)
+    assert ReportJobQueue(max_workers=1, max_pending=10, job_ttl=0).get(job['job_id']) is None
+    assert ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60).get('missing') is None
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from utils.json_stream import NUMBER, SchemaError, StreamingJSONParser, validate
+
+SCHEMA = {
+    'summary': str,
+    'score': NUMBER,
+    'flags': [str],
+    'details': {'bot': bool, 'signals': [{'name': str, 'weight': NUMBER}]}
+}
+DOCUMENT = {
+    'summary': 'Says "hi" {often} [a lot], with a \\ backslash and é',
+    'score': 0.75,
+    'flags': ['a", "b', 'c}'],
+    'details': {'bot': True,
+                'signals': [{'name': 'rate', 'weight': 2}, {'name': 'x', 'weight': -1.5e-3}]}
+}
+
+
+def _feed(parser, text, size):
+    for start in range(0, len(text), size):
+        if parser.feed(text[start:start + size]):
+            return True
+    return False
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1000])
+def test_any_chunk_boundary(size):
+    # Size 1 splits every escape sequence and string delimiter
+    parser = StreamingJSONParser(SCHEMA)
+    assert _feed(parser, json.dumps(DOCUMENT, ensure_ascii=False), size)
+    assert parser.finish() == DOCUMENT
+
+
+def test_code_fenced_output():
+    text = 'Here is the report:\n```json\n' + json.dumps(DOCUMENT, indent=2) + '\n```\n'
+    parser = StreamingJSONParser(SCHEMA)
+    assert _feed(parser, text, 5)
+    assert parser.finish() == DOCUMENT
+
+
+def test_stops_once_every_field_is_present():
+    text = json.dumps({**DOCUMENT, 'extra': 1})
+    parser = StreamingJSONParser(SCHEMA)
+    # The member ends at the closing brace of details
+    end = text.index('"extra"')
+    assert parser.feed(text[:end])
+    assert parser.stopped_early
+    assert parser.feed('anything after is ignored')
+    assert parser.finish() == DOCUMENT
+
+
+def test_not_complete_until_the_last_field_ends():
+    text = json.dumps({'summary': 'x', 'score': 12})
+    parser = StreamingJSONParser({'summary': str, 'score': NUMBER})
+    # 12 could still be 123
+    assert not parser.feed(text[:-1])
+    assert parser.feed(text[-1:])
+    assert parser.finish() == {'summary': 'x', 'score': 12}
+    assert not parser.stopped_early
+
+
+def test_type_violation_fails_fast():
+    parser = StreamingJSONParser(SCHEMA)
+    with pytest.raises(SchemaError, match=r'\$\.score: expected number, got str'):
+        parser.feed('{"summary": "fine", "score": "high", "flags": [')
+
+
+def test_nested_type_violation():
+    document = {**DOCUMENT,
+                'details': {'bot': True, 'signals': [{'name': 'rate', 'weight': True}]}}
+    with pytest.raises(SchemaError, match=r'\$\.details\.signals\[0\]\.weight'):
+        _feed(StreamingJSONParser(SCHEMA), json.dumps(document), 4)
+
+
+def test_missing_field_at_closing_brace():
+    parser = StreamingJSONParser({'summary': str, 'score': NUMBER})
+    with pytest.raises(SchemaError, match='Missing fields: score'):
+        parser.feed('{"summary": "x"}')
+
+
+@pytest.mark.parametrize('text, message', [
+    ('', 'No JSON object'),
+    ('I cannot help with that', 'No JSON object'),
+    ('{"summary": "cut off', 'Missing fields'),
+    ('{"summary": "x", "score": 1, "flags": ["a", ', 'Missing fields'),
+])
+def test_truncated_input(text, message):
+    parser = StreamingJSONParser(SCHEMA)
+    assert not parser.feed(text)
+    with pytest.raises(SchemaError, match=message):
+        parser.finish()
+
+
+def test_invalid_member_json():
+    with pytest.raises(SchemaError, match='Invalid JSON'):
+        StreamingJSONParser(SCHEMA).feed('{"summary": nope, ')
+
+
+def test_validate():
+    validate(DOCUMENT, SCHEMA)
+    with pytest.raises(SchemaError, match=r'\$\.flags\[1\]: expected str'):
+        validate({**DOCUMENT, 'flags': ['a', 2]}, SCHEMA)
+    with pytest.raises(SchemaError, match=r'\$\.details\.bot: missing'):
+        validate({**DOCUMENT, 'details': {'signals': []}}, SCHEMA)
+    with pytest.raises(SchemaError, match=r'\$\.flags: expected list'):
+        validate({**DOCUMENT, 'flags': 'a'}, SCHEMA)
+    # Booleans are not numbers
+    with pytest.raises(SchemaError):
+        validate(True, NUMBER)
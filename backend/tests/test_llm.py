@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+from utils.json_stream import NUMBER, StreamingJSONParser
+from utils.llm import CircuitBreaker, LLMClient, LLMUnavailable, ProviderError, StubProvider
+
+
+class ScriptedProvider:
+    """Answers call i with behaviours[i] (the last one repeats)"""
+
+    name = 'scripted'
+
+    def __init__(self, *behaviours):
+        self.behaviours = behaviours
+        self.calls = 0
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, timeout, **options):
+        with self._lock:
+            behaviour = self.behaviours[min(self.calls, len(self.behaviours) - 1)]
+            self.calls += 1
+            self.timeouts.append(timeout)
+        return behaviour()
+
+
+def _answer(text, delay=0.0):
+    def behaviour():
+        time.sleep(delay)
+        return text
+    return behaviour
+
+
+def _raise(error):
+    def behaviour():
+        raise error
+    return behaviour
+
+
+def _blocked(event):
+    def behaviour():
+        event.wait(5)
+        return 'late'
+    return behaviour
+
+
+def _client(provider, **kwargs):
+    kwargs.setdefault('breaker', CircuitBreaker(3, 60))
+    return LLMClient(provider, **{'timeout': 1, 'max_concurrency': 2, 'hedge_after_ms': 0,
+                                  **kwargs})
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    time.sleep(0.06)
+    # One trial call at a time while half-open
+    assert breaker.allow() and breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+    assert breaker.stats() == {'state': 'closed', 'consecutive_failures': 0, 'times_opened': 2}
+
+
+def test_open_breaker_short_circuits():
+    provider = ScriptedProvider(_raise(ProviderError('unavailable', code=503)))
+    client = _client(provider)
+    for _ in range(3):
+        with pytest.raises(LLMUnavailable, match='failed'):
+            client.generate('prompt')
+    with pytest.raises(LLMUnavailable, match='Circuit open'):
+        client.generate('prompt')
+    assert provider.calls == 3
+    assert client.stats()['short_circuited'] == 1
+
+
+@pytest.mark.parametrize('error', [ConnectionResetError('reset'), TimeoutError('slow'),
+                                   ProviderError('internal', code=500)])
+def test_transport_timeout_and_5xx_count(error):
+    client = _client(ScriptedProvider(_raise(error)))
+    for _ in range(3):
+        with pytest.raises(LLMUnavailable):
+            client.generate('prompt')
+    assert client.breaker.state == 'open'
+
+
+@pytest.mark.parametrize('behaviour', [_answer('{"score": "high"}'), _answer('no json at all'),
+                                       _raise(ProviderError('blocked prompt', code=400))])
+def test_bad_answers_do_not_open_the_breaker(behaviour):
+    client = _client(ScriptedProvider(behaviour))
+    for _ in range(10):
+        with pytest.raises(LLMUnavailable, match='rejected'):
+            client.generate('prompt', parser_factory=lambda: StreamingJSONParser({'score': NUMBER}))
+    assert client.breaker.state == 'closed'
+    assert client.stats()['invalid'] == 10
+
+
+def test_deadline_includes_the_wait_for_a_slot():
+    release = threading.Event()
+    provider = ScriptedProvider(_blocked(release), _answer('fast'))
+    client = _client(provider, timeout=0.3, max_concurrency=1)
+    with pytest.raises(LLMUnavailable, match='deadline'):
+        client.generate('prompt')
+
+    # The slot frees 0.2 s into the next call, leaving it 0.1 s
+    threading.Timer(0.2, release.set).start()
+    start = time.monotonic()
+    assert client.generate('prompt') == 'fast'
+    assert time.monotonic() - start < 0.3
+    assert provider.timeouts[1] <= 0.15
+
+
+def test_no_slot_before_the_deadline():
+    release = threading.Event()
+    client = _client(ScriptedProvider(_blocked(release)), timeout=0.1, max_concurrency=1)
+    with pytest.raises(LLMUnavailable, match='deadline'):
+        client.generate('prompt')
+    with pytest.raises(LLMUnavailable, match='No free LLM slot'):
+        client.generate('prompt')
+    assert client.stats()['rejected'] == 1
+    release.set()
+
+
+def test_slots_are_held_past_the_callers_timeout():
+    release = threading.Event()
+    provider = ScriptedProvider(_blocked(release))
+    client = _client(provider, timeout=0.1, max_concurrency=2)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable, match='deadline'):
+            client.generate('prompt')
+    # Both provider calls are still running, so no third one starts
+    assert not client._slots.acquire(blocking=False)
+    release.set()
+    deadline = time.monotonic() + 2
+    while not client._slots.acquire(blocking=False) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert provider.calls == 2
+
+
+def test_hedged_call_wins():
+    provider = ScriptedProvider(_answer('slow', delay=0.5), _answer('hedge'))
+    client = _client(provider, hedge_after_ms=50)
+    start = time.monotonic()
+    assert client.generate('prompt') == 'hedge'
+    assert time.monotonic() - start < 0.4
+    stats = client.stats()
+    assert stats['hedged'] == 1 and stats['calls'] == 1 and stats['succeeded'] == 1
+
+
+def test_stub_streams_a_valid_report():
+    from utils.prompts import REPORT_SCHEMA
+    client = _client(StubProvider(latency_ms=0))
+    parser = client.generate('prompt', parser_factory=lambda: StreamingJSONParser(REPORT_SCHEMA))
+    assert parser.finish()['activityScore'] == 5.0
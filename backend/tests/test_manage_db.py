@@ -0,0 +1,77 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from manage_db import DatabaseManager  # noqa: E402
+
+ORIGINAL = [{'_id': i, 'username': f"user{i}", 'score': 0.1} for i in range(5)]
+BACKUP = [{'_id': i, 'username': f"user{i}", 'score': 0.9} for i in range(7)]
+
+
+@pytest.fixture
+def manager(mongo):
+    mongo.users.insert_many(ORIGINAL)
+    mongo.users.create_index('username', name='username_1', unique=True)
+    mongo.users_backup.insert_many(BACKUP)
+    return DatabaseManager()
+
+
+def _assert_untouched(mongo):
+    assert list(mongo.users.find().sort('_id', 1)) == ORIGINAL
+    assert 'username_1' in mongo.users.index_information()
+    assert not [name for name in mongo.list_collection_names() if '_restore_' in name]
+
+
+def test_stream_restore_swaps_in_backup(manager, mongo):
+    message = manager.restore_backup('users_backup', 'users', mode='stream', batch_size=2)
+
+    assert message == "Restored 7 documents to users"
+    assert list(mongo.users.find().sort('_id', 1)) == BACKUP
+    assert mongo.users.index_information()['username_1']['unique']
+    assert not [name for name in mongo.list_collection_names() if '_restore_' in name]
+
+
+def test_failed_fill_leaves_target_intact(manager, mongo, monkeypatch):
+    insert_many = mongomock.collection.Collection.insert_many
+    batches = []
+
+    def fail_on_third_batch(self, documents, *args, **kwargs):
+        batches.append(self.name)
+        if len(batches) == 3:
+            raise mongomock.WriteError('connection reset')
+        return insert_many(self, documents, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'insert_many', fail_on_third_batch)
+    with pytest.raises(mongomock.WriteError):
+        manager.restore_backup('users_backup', 'users', mode='stream', batch_size=2)
+
+    # Two batches reached the temporary collection, none the target
+    assert all('_restore_' in name for name in batches)
+    _assert_untouched(mongo)
+
+
+def test_failed_swap_leaves_target_intact(manager, mongo, monkeypatch):
+    def fail(self, *args, **kwargs):
+        raise mongomock.OperationFailure('rename failed')
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'rename', fail)
+    with pytest.raises(mongomock.OperationFailure):
+        manager.restore_backup('users_backup', 'users', mode='stream', batch_size=2)
+    _assert_untouched(mongo)
+
+
+def test_truncated_dump_leaves_target_intact(manager, mongo, tmp_path):
+    path = str(tmp_path / 'users.ndjson.gz')
+    manager.dump_collection('users_backup', path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+
+    with pytest.raises(EOFError):
+        manager.load_dump(path, 'users', batch_size=2)
+    _assert_untouched(mongo)
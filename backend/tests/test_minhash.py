@@ -0,0 +1,60 @@
+import os
+import time
+
+import numpy as np
+
+from utils.minhash import MinHashIndex
+
+FIRST = np.arange(0, 200, dtype=np.uint32)
+SECOND = np.arange(100, 300, dtype=np.uint32)
+
+
+def _wait_for(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_saves_merge_instead_of_overwriting(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    worker_a, worker_b = MinHashIndex(), MinHashIndex()
+    worker_a.update('alice', FIRST)
+    worker_b.update('Alice', SECOND)
+    worker_b.update('bob', SECOND)
+    worker_a.save(path)
+    worker_b.save(path)
+
+    merged = MinHashIndex()
+    assert merged.load(path)
+    assert sorted(name.lower() for name in merged.names) == ['alice', 'bob']
+    # Both workers' text is in alice's signature, as one update would have it
+    union = MinHashIndex().signature(np.concatenate([FIRST, SECOND]))
+    assert (merged.signatures[merged._ids['alice']] == union).all()
+    assert [name for name, _ in merged.similar('alice', threshold=0.3)] == ['bob']
+
+    # The first worker picks the other's accounts up from the file
+    assert worker_a.merge_file(path) == 2
+    assert worker_a.similar('bob') is not None
+
+
+def test_forked_worker_saves_its_own_accounts(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    index = MinHashIndex()
+    index.autosave(path, 0.05)
+    index.update('parent', FIRST)
+    assert _wait_for(lambda: os.path.exists(path))
+
+    pid = os.fork()
+    if pid == 0:
+        # The parent's save thread did not survive the fork
+        index.update('child', SECOND)
+        saved = _wait_for(lambda: 'child' in (MinHashIndex()._read(path) or ([],))[0])
+        os._exit(0 if saved else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    # The parent merges the child's accounts in once the file changes
+    assert _wait_for(lambda: index.similar('child') is not None)
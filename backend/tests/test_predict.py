@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def app_module(mongo, monkeypatch):
+    import app
+    saved = []
+    monkeypatch.setattr(app, "EXTENDED_FEATURES_ENABLED", False)
+    monkeypatch.setattr(app, "get_reddit_user_details", lambda username: {
+        "screen_name": username, "name": username, "verified": False, "listed_count": 10,
+        "post_karma": 4, "comment_karma": 6, "cake_day": 1500000000.0,
+        "achievements": [], "trophy_case": [], "profile_image": None})
+    monkeypatch.setattr(app.repository, "save_prediction", saved.append)
+    app.saved = saved
+    return app
+
+
+def test_every_scan_is_recorded(app_module):
+    client = app_module.app.test_client()
+    first = client.post("/api/predict", json={"screen_name": "scan_history_user"})
+    second = client.post("/api/predict", json={"screen_name": "scan_history_user"})
+    assert first.status_code == second.status_code == 200
+    assert second.headers["X-Cache"] == "fresh"
+
+    assert [doc["username"] for doc in app_module.saved] == ["scan_history_user"] * 2
+    doc = app_module.saved[-1]
+    assert doc["model_version"] == first.get_json()["model_version"]
+    assert doc["user_data"]["screen_name"] == "scan_history_user"
+    assert "is_bot" not in doc["user_data"]
+
+
+def test_refresh_records_nothing(app_module):
+    # What the prediction cache runs for a stale entry, outside any request
+    assert app_module._compute_prediction("refreshed_user")["screen_name"] == "refreshed_user"
+    assert app_module.saved == []
+
+
+def test_batch_streams_found_missing_and_failed_users(app_module, monkeypatch):
+    from utils import pipeline
+    from utils.reddit_async import FetchError
+
+    def lookups(usernames):
+        for username in usernames:
+            if username.startswith("missing"):
+                yield username, None
+            elif username.startswith("broken"):
+                yield username, FetchError("Reddit returned 500")
+            else:
+                yield username, app_module.get_reddit_user_details(username)
+
+    monkeypatch.setattr(pipeline, "iter_reddit_users_details", lookups)
+    score, calls = app_module.model_registry.score, []
+
+    def counting_score(features, usernames):
+        calls.append(list(usernames))
+        return score(features, usernames)
+
+    monkeypatch.setattr(app_module.model_registry, "score", counting_score)
+    stored = []
+    monkeypatch.setattr(app_module.repository, "save_predictions", stored.extend)
+
+    response = app_module.app.test_client().post("/api/predict/batch", json={
+        "screen_names": ["found_a", "missing_b", "found_c", "broken_d", "Found_A", "found_e"]})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert [(r["screen_name"], r.get("status")) for r in results] == [
+        ("missing_b", 404), ("broken_d", 502),
+        ("found_a", None), ("found_c", None), ("found_e", None)]
+    # The found users are scored together, in one vectorized call
+    assert calls == [["found_a", "found_c", "found_e"]]
+    for result in results[2:]:
+        assert isinstance(result["is_bot"], bool)
+        assert 0.0 <= result["bot_probability"] <= 1.0
+        assert result["model_version"]
+    assert [doc["username"] for doc in stored] == ["found_a", "found_c", "found_e"]
+
+
+def test_batch_scores_in_chunks_as_fetches_complete(app_module, monkeypatch):
+    from utils import pipeline
+
+    progress = []
+
+    def lookups():
+        for i in range(5):
+            progress.append(i)
+            yield f"user{i}", app_module.get_reddit_user_details(f"user{i}")
+
+    monkeypatch.setattr(pipeline, "iter_reddit_users_details", lambda usernames: lookups())
+    stream = pipeline.iter_batch_predictions(app_module.model_registry, None, chunk_size=2)
+    first = next(stream)
+    # The first chunk is out before the remaining users were fetched
+    assert first["screen_name"] == "user0" and progress == [0, 1]
+    assert [r["screen_name"] for r in stream] == [f"user{i}" for i in range(1, 5)]
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'scripts'))
+
+from fake_reddit import create_app  # noqa: E402
+from utils import pipeline, reddit_api, reddit_async  # noqa: E402
+from utils.reddit_async import FetchError, UserNotFound, _BackgroundFetcher  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def fake_reddit():
+    """Base URL of scripts/fake_reddit.py served from a background loop"""
+    loop = asyncio.new_event_loop()
+    port = _free_port()
+    app = create_app()
+    runner = web.AppRunner(app)
+
+    async def start():
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(start(), loop).result()
+    yield f"http://127.0.0.1:{port}", app['state']
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def _fetcher(base_url):
+    return _BackgroundFetcher(client_id='test', client_secret='test',
+                              auth_url=f"{base_url}/api/v1/access_token", api_base=base_url)
+
+
+def test_found_missing_and_invalid(fake_reddit):
+    base_url, state = fake_reddit
+    fetcher = _fetcher(base_url)
+    before = state['requests']
+    results = fetcher.fetch_users(['alice', 'missing_bob', '../admin', 'a' * 21])
+    assert results['alice']['name'] == 'alice'
+    assert isinstance(results['missing_bob'], UserNotFound)
+    # Names Reddit cannot have are rejected without a request
+    assert isinstance(results['../admin'], UserNotFound)
+    assert isinstance(results['a' * 21], UserNotFound)
+    assert state['requests'] - before == 2
+    fetcher.close()
+
+
+def test_results_stream_as_lookups_complete(fake_reddit):
+    base_url, _ = fake_reddit
+    fetcher = _fetcher(base_url)
+    results = dict(fetcher.iter_users(['alice', 'missing_bob', '../admin']))
+    assert results['alice']['name'] == 'alice'
+    assert isinstance(results['missing_bob'], UserNotFound)
+    # Rejected without a request, so it completes first
+    assert next(iter(fetcher.iter_users(['carol', '../admin'])))[0] == '../admin'
+    fetcher.close()
+
+
+def test_calls_share_session_and_token(fake_reddit):
+    base_url, _ = fake_reddit
+    fetcher = _fetcher(base_url)
+    fetcher.fetch_users(['alice'])
+    session, token = fetcher._fetcher._session, fetcher._fetcher._token
+    fetcher.fetch_users(['carol', 'dave'])
+    assert fetcher._fetcher._session is session
+    assert fetcher._fetcher._token == token
+    assert fetcher._fetcher.requests == 3
+    fetcher.close()
+
+
+def test_unreachable_is_not_reported_as_missing():
+    base_url = f"http://127.0.0.1:{_free_port()}"
+    fetcher = _fetcher(base_url)
+    error = fetcher.fetch_users(['alice'])['alice']
+    assert isinstance(error, FetchError)
+    assert error.fallback
+    fetcher.close()
+
+
+def test_transport_errors_retried_through_praw(monkeypatch):
+    monkeypatch.setattr(reddit_async, 'iter_users', lambda usernames: iter([
+        ('erin', FetchError('Reddit unreachable', status=503, fallback=True)),
+        ('frank', FetchError('Reddit returned 500'))
+    ]))
+    monkeypatch.setattr(reddit_api, '_fetch_reddit_user_details',
+                        lambda username: {'screen_name': username, 'name': username})
+    results = reddit_api.get_reddit_users_details(['erin', 'frank'])
+    assert results['erin'] == {'screen_name': 'erin', 'name': 'erin'}
+    assert isinstance(results['frank'], FetchError)
+
+
+def test_batch_reports_failed_lookups(monkeypatch):
+    monkeypatch.setattr(pipeline, 'iter_reddit_users_details', lambda usernames: iter([
+        ('gina', None),
+        ('hank', FetchError('Reddit returned 429', status=503))
+    ]))
+    results = list(pipeline.iter_batch_predictions(None, ['gina', 'hank']))
+    assert [(r['screen_name'], r['status']) for r in results] == [('gina', 404), ('hank', 503)]
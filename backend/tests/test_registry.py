@@ -0,0 +1,65 @@
+import shutil
+import time
+
+import pytest
+
+from config import MODEL_PATH
+from models.registry import ModelRegistry
+
+
+def _registry(state_path, **kwargs):
+    registry = ModelRegistry(path=MODEL_PATH, candidate_path='', mmap=False,
+                             reload_interval=0.01, state_path=state_path, **kwargs)
+    registry.load()
+    return registry
+
+
+def _synced(registry, check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        registry.get()
+        if check():
+            return
+    raise AssertionError("registry state was not applied")
+
+
+@pytest.fixture
+def candidate_path(tmp_path):
+    path = str(tmp_path / 'candidate_model.pkl')
+    shutil.copy(MODEL_PATH, path)
+    return path
+
+
+def test_admin_changes_reach_other_workers(tmp_path, candidate_path):
+    state_path = str(tmp_path / 'registry.json')
+    admin, other = _registry(state_path), _registry(state_path)
+
+    admin.set_candidate(candidate_path, mode='split', traffic=0.5)
+    _synced(other, lambda: other.candidate is not None)
+    assert other.candidate.path == candidate_path
+    assert (other.candidate_mode, other.candidate_traffic) == ('split', 0.5)
+
+    admin.promote()
+    _synced(other, lambda: other.primary.path == candidate_path)
+    assert other.candidate is None
+    assert other.previous.path == MODEL_PATH
+
+    other.rollback()
+    _synced(admin, lambda: admin.primary.path == MODEL_PATH)
+    assert admin.previous.path == candidate_path
+
+
+def test_state_survives_restart(tmp_path, candidate_path):
+    state_path = str(tmp_path / 'registry.json')
+    admin = _registry(state_path)
+    admin.set_candidate(candidate_path)
+    admin.promote()
+
+    restarted = _registry(state_path)
+    assert restarted.sync_state()
+    assert restarted.primary.path == candidate_path
+
+    # Written under another MODEL_PATH: the configured model wins
+    other_deploy = ModelRegistry(path=candidate_path, mmap=False, state_path=state_path)
+    assert not other_deploy.sync_state()
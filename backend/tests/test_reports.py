@@ -0,0 +1,60 @@
+import time
+
+from models import db, repository
+from models.bulk_writer import writer
+from utils import gemini
+from utils.jobs import ReportJobQueue
+
+
+def _report():
+    return {"summary": "cached", "accountData": {}, "behaviorPatterns": []}
+
+
+def test_cached_report_is_enriched(mongo, monkeypatch):
+    user_data = {"screen_name": "ivy", "bot_probability": 0.8, "model_version": "v1"}
+    gemini.report_cache.set(gemini.report_cache_key(user_data), _report())
+    monkeypatch.setattr(gemini, "similarity_fields", lambda user_data: {"similarAccounts": 3})
+    monkeypatch.setattr(gemini, "network_pattern", lambda user_data: {"name": "Network"})
+
+    report = gemini.get_cached_report(user_data)
+    assert report["source"] == "gemini"
+    assert report["botConfidence"] == 80.0
+    assert report["accountData"] == {"similarAccounts": 3}
+    assert report["behaviorPatterns"] == [{"name": "Network"}]
+
+    # The report job takes the cached branch and hands out the same fields
+    job = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60).submit(dict(user_data))
+    assert job["status"] == "done"
+    assert job["report"] == report
+
+
+def test_missing_report_is_none(mongo):
+    assert gemini.get_cached_report({"screen_name": "nobody-cached"}) is None
+
+
+def _wait_for(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job["status"] == "done":
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_fresh_report_stored_once(mongo, monkeypatch):
+    monkeypatch.setattr(db, "_available", True)
+    monkeypatch.setattr(db, "_checked_at", time.monotonic())
+    monkeypatch.setattr(gemini, "GEMINI_ENABLED", True)
+    monkeypatch.setattr(gemini, "_generate_llm_report", lambda user_data: _report())
+    user_data = {"screen_name": "june", "bot_probability": 0.4, "model_version": "v1"}
+    queue = ReportJobQueue(max_workers=1, max_pending=10, job_ttl=60)
+
+    _wait_for(queue, queue.submit(dict(user_data))["job_id"])
+    # A second request is served from the cache and stores nothing
+    assert queue.submit(dict(user_data))["status"] == "done"
+    writer.flush()
+
+    stored = list(mongo[repository.REPORTS].find({"username": "june"}))
+    assert len(stored) == 1
+    assert stored[0]["cache_key"] == gemini.report_cache_key(user_data)
@@ -0,0 +1,160 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+from models import db, repository
+from utils import singleflight
+from utils.singleflight import MongoSingleFlight, SingleFlight
+
+
+def _wait_for(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+@pytest.fixture
+def online(mongo, monkeypatch):
+    monkeypatch.setattr(db, '_available', True)
+    monkeypatch.setattr(db, '_checked_at', time.monotonic())
+    return mongo[repository.SINGLEFLIGHT_LOCKS]
+
+
+def _run_concurrently(flight, key, fn, waiters):
+    """Start a leader, then waiters once it is running; returns their outcomes"""
+    outcomes = [None] * (waiters + 1)
+
+    def call(i):
+        try:
+            outcomes[i] = ('ok', flight.do(key, fn))
+        except Exception as e:
+            outcomes[i] = ('error', e)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(waiters + 1)]
+    threads[0].start()
+    _wait_for(lambda: flight.stats()['in_flight'] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    return threads, outcomes
+
+
+def test_waiters_share_result():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {'value': 42}
+
+    threads, outcomes = _run_concurrently(flight, 'k', fn, waiters=3)
+    _wait_for(lambda: flight.stats()['shared'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert outcomes[0] == ('ok', ({'value': 42}, False))
+    assert all(outcome == ('ok', ({'value': 42}, True)) for outcome in outcomes[1:])
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_waiters_share_exception():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    error = RuntimeError('upstream down')
+
+    def fn():
+        release.wait(5)
+        raise error
+
+    threads, outcomes = _run_concurrently(flight, 'k', fn, waiters=3)
+    _wait_for(lambda: flight.stats()['shared'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(outcome == ('error', error) for outcome in outcomes)
+    assert flight.stats()['errors'] == 1
+    # The failed call is not remembered: the next one runs again
+    assert flight.do('k', lambda: 'recovered') == ('recovered', False)
+
+
+def test_result_shared_across_workers(online):
+    leader = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+    assert leader.do('k', lambda: {'value': 1}) == ({'value': 1}, False)
+    assert online.find_one({'_id': 'test:k'})['state'] == 'done'
+
+    other = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+    assert other.do('k', lambda: pytest.fail('ran twice')) == ({'value': 1}, True)
+    assert other.stats()['remote_shared'] == 1
+
+
+def test_expired_lease_taken_over(online):
+    # A worker that crashed while running left its lease behind
+    online.insert_one({'_id': 'test:k', 'owner': 'dead-worker', 'state': 'running',
+                       'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    flight = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+
+    assert flight.do('k', lambda: 'fresh') == ('fresh', False)
+    assert flight.stats()['takeovers'] == 1
+    doc = online.find_one({'_id': 'test:k'})
+    assert doc['owner'] == flight.owner
+    assert doc['state'] == 'done'
+    assert doc['result'] == 'fresh'
+
+
+def test_held_lease_waited_for_until_it_expires(online):
+    online.insert_one({'_id': 'test:k', 'owner': 'busy-worker', 'state': 'running',
+                       'expires_at': datetime.utcnow() + timedelta(seconds=60)})
+    flight = MongoSingleFlight('test', lease=0.1, result_ttl=60, poll_interval=0.01)
+
+    start = time.monotonic()
+    assert flight.do('k', lambda: 'local') == ('local', False)
+    assert time.monotonic() - start >= 0.1
+    assert flight.stats()['wait_timeouts'] == 1
+    # The other worker's lease is left alone
+    assert online.find_one({'_id': 'test:k'})['owner'] == 'busy-worker'
+
+
+def test_failed_call_releases_lease(online):
+    flight = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+
+    def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        flight.do('k', fail)
+    assert online.find_one({'_id': 'test:k'}) is None
+    other = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+    assert other.do('k', lambda: 'retried') == ('retried', False)
+
+
+def test_runs_locally_while_mongo_offline(mongo, monkeypatch):
+    monkeypatch.setattr(db, '_available', False)
+    monkeypatch.setattr(db, '_checked_at', time.monotonic())
+    flight = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+
+    assert flight.do('k', lambda: 'local') == ('local', False)
+    assert mongo[repository.SINGLEFLIGHT_LOCKS].count_documents({}) == 0
+
+
+def test_runs_locally_when_lock_collection_fails(online, monkeypatch):
+    class Unreachable:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ServerSelectionTimeoutError('no primary')
+            return fail
+
+    monkeypatch.setattr(singleflight.repository, 'collection', lambda name: Unreachable())
+    flight = MongoSingleFlight('test', lease=5, result_ttl=60, poll_interval=0.01)
+
+    assert flight.do('k', lambda: 'local') == ('local', False)
+    assert flight.stats()['mongo_errors'] == 1
@@ -0,0 +1,178 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from models import repository
+from utils import sweep as sweep_module
+from utils.sweep import SeenSet, Sweep, SweepManager, TooManySweeps
+
+START, END = 1717000000, 1717003600
+
+# Newest first, like the listings: (author, created_utc)
+SUBMISSIONS = [('alice', END - 10), ('bob', END - 20), ('[deleted]', END - 30),
+               ('Alice', END - 40), ('carol', END - 50), (None, END - 60),
+               ('missing_dan', END - 70)]
+COMMENTS = [('erin', END - 5), ('bob', END - 15), ('frank', END - 25), ('gina', END - 35),
+            ('ALICE', END - 45), ('hank', END - 55), ('ivan', END - 65), ('judy', END - 75)]
+AUTHORS = ['alice', 'bob', 'carol', 'missing_dan', 'erin', 'frank', 'gina', 'hank', 'ivan',
+           'judy']
+
+
+@pytest.fixture
+def reddit(monkeypatch):
+    """Fake subreddit listings and batch scoring; records each scored batch"""
+    listings = {'submission': SUBMISSIONS, 'comment': COMMENTS}
+    batches, stored = [], []
+
+    def iter_subreddit_items(subreddit, start, end, kind):
+        for i, (author, created) in enumerate(listings[kind]):
+            if start <= created <= end:
+                yield {'id': f'{kind}{i}', 'kind': kind, 'author': author,
+                       'created_utc': created}
+
+    def iter_batch_predictions(registry, usernames):
+        batches.append(list(usernames))
+        for username in usernames:
+            if username.startswith('missing'):
+                yield {'screen_name': username, 'error': 'User not found', 'status': 404}
+            else:
+                yield {'screen_name': username, 'is_bot': username in ('bob', 'gina'),
+                       'bot_probability': 0.5, 'model_version': 'v1'}
+
+    monkeypatch.setattr(sweep_module, 'iter_subreddit_items', iter_subreddit_items)
+    monkeypatch.setattr(sweep_module, 'iter_batch_predictions', iter_batch_predictions)
+    monkeypatch.setattr(repository, 'save_predictions', stored.extend)
+    return batches, stored
+
+
+def test_sweep_scores_each_author_once_in_batches(reddit, tmp_path):
+    batches, stored = reddit
+    path = str(tmp_path / 'python.json')
+    stats = Sweep(None, 'python', START, END, batch_size=3, checkpoint_path=path).run()
+
+    assert stats['state'] == 'done'
+    assert [name.lower() for batch in batches for name in batch] == AUTHORS
+    # Submissions are flushed at the end of their listing, then comments
+    assert [len(batch) for batch in batches] == [3, 1, 3, 3]
+    assert sorted(doc['username'] for doc in stored) == sorted(set(AUTHORS) - {'missing_dan'})
+    assert all(doc['subreddit'] == 'python' for doc in stored)
+    assert (stats['items_read'], stats['authors_scored'], stats['not_found'], stats['bots'],
+            stats['batches']) == (15, 10, 1, 2, 4)
+
+    with open(path) as f:
+        checkpoint = json.load(f)
+    assert checkpoint['done_kinds'] == ['submission', 'comment']
+    assert checkpoint['cursor'] == ['comment', END - 75]
+    assert checkpoint['counters']['authors_scored'] == 10
+    assert all(name in SeenSet(np.load(f'{path}.seen.npy')) for name in AUTHORS)
+
+
+def test_sweep_resumes_from_a_checkpoint(reddit, tmp_path, monkeypatch):
+    batches, _ = reddit
+    path = str(tmp_path / 'python.json')
+    first = Sweep(None, 'python', START, END, batch_size=3, checkpoint_path=path)
+    scored = []
+
+    def save_and_stop(predictions):
+        scored.extend(predictions)
+        if len(batches) == 3:
+            first.cancel()
+
+    monkeypatch.setattr(repository, 'save_predictions', save_and_stop)
+    assert first.run()['state'] == 'cancelled'
+    assert len(batches) == 3
+    with open(path) as f:
+        assert json.load(f)['cursor'] == ['comment', END - 35]
+
+    monkeypatch.setattr(repository, 'save_predictions', scored.extend)
+
+    second = Sweep(None, 'python', START, END, batch_size=3, checkpoint_path=path)
+    stats = second.run()
+    assert stats['state'] == 'done' and stats['resumed']
+    # Only the authors the first run did not reach, each once
+    assert [name.lower() for batch in batches[3:] for name in batch] == \
+        ['hank', 'ivan', 'judy']
+    assert stats['authors_scored'] == 10
+    assert sorted(doc['username'].lower() for doc in scored) == \
+        sorted(set(AUTHORS) - {'missing_dan'})
+
+
+def test_checkpoint_of_another_sweep_is_refused(reddit, tmp_path):
+    path = str(tmp_path / 'python.json')
+    Sweep(None, 'python', START, END, checkpoint_path=path).run()
+    stats = Sweep(None, 'python', START, END + 1, checkpoint_path=path).run()
+    assert stats['state'] == 'failed' and 'another sweep' in stats['error']
+
+
+def test_finished_sweeps_are_pruned(reddit, mongo, tmp_path):
+    manager = SweepManager(1, str(tmp_path), max_finished=2)
+    started = []
+    for hour in range(4):
+        sweep = manager.start(None, 'python', START + hour * 3600, END + hour * 3600)
+        _until(lambda: sweep._finished_at is not None)
+        started.append(sweep.id)
+    manager.list()
+    assert list(manager._sweeps) == started[2:]
+    # Their status is still shared through MongoDB
+    assert manager.get(started[0])['state'] == 'done'
+
+    manager.finished_ttl = 0
+    manager.list()
+    assert manager._sweeps == {}
+
+
+@pytest.fixture
+def idle_sweeps(monkeypatch):
+    """Sweeps that run until cancelled instead of reading Reddit"""
+    def run(self):
+        self.state = 'running'
+        self._stop.wait(10)
+        self.state = 'cancelled'
+        return self.stats()
+
+    monkeypatch.setattr(Sweep, 'run', run)
+
+
+def _until(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return
+        time.sleep(0.02)
+    raise AssertionError("condition not reached")
+
+
+def test_limits_status_and_cancel_across_workers(idle_sweeps, mongo, tmp_path):
+    worker_a = SweepManager(1, str(tmp_path), lease=0.3)
+    worker_b = SweepManager(1, str(tmp_path), lease=0.3)
+    sweep = worker_a.start(None, 'python', START, END)
+
+    with pytest.raises(TooManySweeps):
+        worker_b.start(None, 'golang', START, END)
+    _until(lambda: worker_b.get(sweep.id)['state'] == 'running')
+    assert [stats['id'] for stats in worker_b.list()] == [sweep.id]
+
+    worker_b.cancel(sweep.id)
+    _until(lambda: worker_b.get(sweep.id)['state'] == 'cancelled')
+    # The slot is free again once the sweep has stopped
+    worker_b.start(None, 'golang', START, END).cancel()
+
+
+def test_same_window_runs_once(idle_sweeps, mongo, tmp_path):
+    worker_a = SweepManager(2, str(tmp_path), lease=0.3)
+    worker_b = SweepManager(2, str(tmp_path), lease=0.3)
+    sweep = worker_a.start(None, 'python', START, END)
+    with pytest.raises(TooManySweeps):
+        worker_b.start(None, 'Python', START, END)
+    sweep.cancel()
+
+
+def test_sweep_of_dead_worker_is_lost(mongo, tmp_path):
+    repository.collection(repository.SWEEPS).insert_one({
+        '_id': 'dead', 'id': 'dead', 'state': 'running', 'cancel_requested': False,
+        'updated_at': datetime.utcnow() - timedelta(minutes=5)})
+    assert SweepManager(1, str(tmp_path), lease=60).get('dead')['state'] == 'lost'
+    assert SweepManager(1, str(tmp_path), lease=60).get('unknown') is None
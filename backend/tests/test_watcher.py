@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from utils import watcher
+from utils.watcher import CommentWatcher, RATE, REPETITION, read_event_file
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'scripts', 'sample_comment_stream.jsonl')
+TRIGGERED = {'sample_fast_poster': RATE, 'sample_promo_account': REPETITION}
+
+
+def _replay(cw, shift=0, check=None):
+    triggered = {}
+    for event in read_event_file(SAMPLE):
+        event['created_utc'] += shift
+        reason = cw.process(event)
+        if reason:
+            triggered[event['author']] = reason
+        if check is not None:
+            check(cw)
+    cw.flush()
+    return triggered
+
+
+@pytest.fixture
+def no_scoring(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("dry run must not score")
+
+    monkeypatch.setattr(watcher, 'iter_batch_predictions', fail)
+
+
+def test_dry_run_triggers(no_scoring):
+    cw = CommentWatcher(None, score=False)
+    assert _replay(cw) == TRIGGERED
+    stats = cw.stats()
+    assert (stats['events'], stats['skipped'], stats['triggers']) == (280, 5, 2)
+    assert stats['triggers_by_reason'] == {RATE: 1, REPETITION: 1}
+    assert stats['subreddit'] == 'sample'
+
+
+def test_idle_authors_evicted(no_scoring):
+    cw = CommentWatcher(None, score=False, idle_ttl=600)
+
+    def only_recent(cw):
+        windows = cw.windows
+        assert all(windows.last_seen[row] >= cw.now - 600 for row in windows._rows.values())
+
+    assert _replay(cw, check=only_recent) == TRIGGERED
+    assert cw.windows.evicted_idle > 0
+    assert len(cw.windows) < 60
+
+
+def test_state_bounded(no_scoring):
+    cw = CommentWatcher(None, score=False, max_authors=16, idle_ttl=600)
+    nbytes = cw.windows.nbytes
+
+    def bounded(cw):
+        assert len(cw.windows) <= 16
+        assert len(cw.windows._rows) + len(cw.windows._free) == 16
+        assert cw.windows.nbytes == nbytes
+
+    assert _replay(cw, check=bounded) == TRIGGERED
+    assert cw.windows.evicted_full > 0
+
+
+def test_cooldown(no_scoring):
+    cw = CommentWatcher(None, score=False)
+    _replay(cw)
+    # An hour later the same bursts are within the default 6 hour cooldown
+    assert _replay(cw, shift=3600) == {}
+    cw = CommentWatcher(None, score=False, cooldown=0)
+    _replay(cw)
+    assert _replay(cw, shift=3600) == TRIGGERED
+
+
+def test_scoring_with_stubs(monkeypatch):
+    scored, saved = [], []
+
+    def predictions(registry, usernames):
+        scored.append(list(usernames))
+        for username in usernames:
+            if username == 'sample_promo_account':
+                yield {"screen_name": username, "error": "User not found", "status": 404}
+            else:
+                yield {"screen_name": username, "is_bot": True, "bot_probability": 0.9,
+                       "model_version": "stub"}
+
+    monkeypatch.setattr(watcher, 'iter_batch_predictions', predictions)
+    monkeypatch.setattr(watcher.repository, 'save_predictions', saved.extend)
+    cw = CommentWatcher(None, score=True, score_batch_size=1)
+    assert _replay(cw) == TRIGGERED
+
+    assert sorted(sum(scored, [])) == sorted(TRIGGERED)
+    stats = cw.stats()
+    assert (stats['scored'], stats['bots'], stats['not_found'], stats['batches']) == (1, 1, 1, 2)
+    [doc] = saved
+    assert doc['username'] == 'sample_fast_poster'
+    assert doc['trigger']['reason'] == RATE
+    assert doc['subreddit'] == 'sample'
@@ -0,0 +1,69 @@
+from sklearn.metrics import roc_auc_score
+import numpy as np
+import os
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def chunks(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    for start in range(0, rows, chunk_size):
+        yield slice(start, min(start + chunk_size, rows))
+
+
+def evaluate(model, X, y, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Classification metrics (fractions in [0, 1]) of model on the held-out
+    rows X, y, predicting one chunk at a time so X can be memory-mapped.
+    brier is the mean squared error of the bot probability, a measure of
+    how well calibrated the probabilities are
+    """
+    tp = fp = tn = fn = 0
+    squared_error = 0.0
+    # One float32 per row, needed for ROC AUC
+    scores = np.empty(len(y), dtype=np.float32) if hasattr(model, 'predict_proba') else None
+    for rows in chunks(len(y), chunk_size):
+        truth = np.asarray(y[rows]).astype(bool)
+        predicted = np.asarray(model.predict(X[rows])).astype(bool)
+        tp += int((predicted & truth).sum())
+        fp += int((predicted & ~truth).sum())
+        tn += int((~predicted & ~truth).sum())
+        fn += int((~predicted & truth).sum())
+        if scores is not None:
+            scores[rows] = model.predict_proba(X[rows])[:, 1]
+            squared_error += float(np.square(scores[rows] - truth).sum())
+
+    total = tp + fp + tn + fn
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    metrics = {
+        'rows': total,
+        'accuracy': round((tp + tn) / total, 4) if total else None,
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        'confusion': {'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn},
+        'roc_auc': None,
+        'brier': round(squared_error / total, 4) if scores is not None and total else None
+    }
+    if scores is not None and 0 < tp + fn < total:
+        metrics['roc_auc'] = round(float(roc_auc_score(np.asarray(y), scores)), 4)
+    return metrics
+
+
+def eval_data_path(model_path):
+    """Held-out rows written next to a model artifact by scripts/train_model.py"""
+    return f"{model_path}.eval.npz"
+
+
+def save_eval_data(path, X, y):
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp, X=np.asarray(X, dtype=np.float32), y=np.asarray(y, dtype=np.uint8))
+    os.replace(tmp, path)
+
+
+def load_eval_data(path):
+    """(X, y) from a save_eval_data file, or None if there is none"""
+    if not path or not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data['X'], data['y']
@@ -0,0 +1,301 @@
+from collections import defaultdict
+from datetime import datetime
+import numpy as np
+import re
+import threading
+import time
+import zlib
+
+# Fixed output schema: extract_features always returns a float32 vector with
+# one value per name, in this order
+FEATURE_NAMES = (
+    # account
+    'post_karma',
+    'comment_karma',
+    'account_age_days',
+    'karma_per_day',
+    'comment_post_karma_ratio',
+    'verified',
+    # temporal
+    'items_sampled',
+    'submission_fraction',
+    'items_per_day',
+    'interval_mean',
+    'interval_std',
+    'interval_cv',
+    'interval_min',
+    'burstiness',
+    'short_interval_fraction',
+    'hour_entropy',
+    # text
+    'duplicate_ratio',
+    'ngram_repetition',
+    'mean_text_length',
+    'subreddit_diversity',
+)
+
+# Intervals shorter than this (seconds) count as "short", a common
+# signature of scheduled or scripted posting
+SHORT_INTERVAL = 60
+NGRAM_SIZE = 3
+
+# Distinct-count sketches (linear counting bitmaps). They are fixed size
+# and merge with a bitwise OR, so stats from separate fetches combine
+# without keeping the raw text around
+TEXT_BITS = 4096
+NGRAM_BITS = 65536
+SUBREDDIT_BITS = 1024
+
+_WORD = re.compile(r"\w+")
+
+
+def _stable_hash(value):
+    return zlib.crc32(value.encode('utf-8'))
+
+
+def _bitmap(hashes, bits):
+    bitmap = np.zeros(bits // 8, dtype=np.uint8)
+    if len(hashes):
+        positions = np.asarray(hashes, dtype=np.uint64) % bits
+        np.bitwise_or.at(bitmap, (positions // 8).astype(np.intp),
+                         (1 << (positions % 8)).astype(np.uint8))
+    return bitmap
+
+
+def estimate_distinct(bitmap):
+    """Linear counting estimate of how many distinct values were added"""
+    bits = bitmap.size * 8
+    zeros = bits - int(np.unpackbits(bitmap).sum())
+    if zeros == 0:
+        return float(bits)
+    return float(-bits * np.log(zeros / bits))
+
+
+def _text_of(item):
+    return (item.get('text') or '').strip().lower()
+
+
+def item_texts(items):
+    """Normalized, non-empty texts of activity items"""
+    return [text for text in (_text_of(item) for item in items) if text]
+
+
+def ngram_hashes(texts):
+    """crc32 of every NGRAM_SIZE-word window of each text, in order"""
+    hashes = []
+    for text in texts:
+        words = _WORD.findall(text)
+        hashes.extend(_stable_hash(' '.join(words[i:i + NGRAM_SIZE]))
+                      for i in range(len(words) - NGRAM_SIZE + 1))
+    return hashes
+
+
+def repeated_ngrams(stats):
+    """Estimated number of n-gram occurrences that repeat an earlier one"""
+    if not stats['ngram_total']:
+        return 0
+    unique = min(estimate_distinct(stats['ngram_bitmap']), stats['ngram_total'])
+    return int(round(stats['ngram_total'] - unique))
+
+
+def empty_stats():
+    return {
+        'count': 0,
+        'submissions': 0,
+        'first_ts': None,
+        'last_ts': None,
+        'interval_count': 0,
+        'interval_sum': 0.0,
+        'interval_sumsq': 0.0,
+        'interval_min': None,
+        'short_intervals': 0,
+        'hour_hist': np.zeros(24, dtype=np.int64),
+        'text_count': 0,
+        'text_len_sum': 0,
+        'text_bitmap': np.zeros(TEXT_BITS // 8, dtype=np.uint8),
+        'ngram_total': 0,
+        'ngram_bitmap': np.zeros(NGRAM_BITS // 8, dtype=np.uint8),
+        'subreddit_bitmap': np.zeros(SUBREDDIT_BITS // 8, dtype=np.uint8),
+    }
+
+
+def summarize_activity(items, timings=None):
+    """
+    Reduce a list of activity items (see reddit_api.get_user_activity) to
+    additive statistics. Everything derived from timestamps is computed
+    on NumPy arrays in one pass
+    """
+    timings = timings if timings is not None else {}
+    stats = empty_stats()
+    if not items:
+        return stats
+
+    start = time.perf_counter()
+    ts = np.sort(np.fromiter((item['created_utc'] for item in items),
+                             dtype=np.float64, count=len(items)))
+    intervals = np.diff(ts)
+    stats['count'] = len(items)
+    stats['submissions'] = sum(1 for item in items if item.get('kind') == 'submission')
+    stats['first_ts'] = float(ts[0])
+    stats['last_ts'] = float(ts[-1])
+    if intervals.size:
+        stats['interval_count'] = int(intervals.size)
+        stats['interval_sum'] = float(intervals.sum())
+        stats['interval_sumsq'] = float(np.square(intervals).sum())
+        stats['interval_min'] = float(intervals.min())
+        stats['short_intervals'] = int((intervals < SHORT_INTERVAL).sum())
+    hours = ((ts % 86400) // 3600).astype(np.intp)
+    stats['hour_hist'] = np.bincount(hours, minlength=24).astype(np.int64)
+    timings['temporal'] = timings.get('temporal', 0.0) + (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    texts = item_texts(items)
+    ngrams = ngram_hashes(texts)
+    stats['text_count'] = len(texts)
+    stats['text_len_sum'] = sum(len(text) for text in texts)
+    stats['text_bitmap'] = _bitmap([_stable_hash(text) for text in texts], TEXT_BITS)
+    stats['ngram_total'] = len(ngrams)
+    stats['ngram_bitmap'] = _bitmap(ngrams, NGRAM_BITS)
+    timings['text'] = timings.get('text', 0.0) + (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    subreddits = {item['subreddit'].lower() for item in items if item.get('subreddit')}
+    stats['subreddit_bitmap'] = _bitmap([_stable_hash(s) for s in subreddits], SUBREDDIT_BITS)
+    timings['subreddit'] = timings.get('subreddit', 0.0) + (time.perf_counter() - start) * 1000
+    return stats
+
+
+def merge_stats(old, new):
+    """
+    Combine stats of an earlier fetch (old) with stats of strictly newer
+    activity (new), as if both had been summarized together
+    """
+    if not old['count']:
+        return new
+    if not new['count']:
+        return old
+
+    merged = dict(old)
+    for key in ('count', 'submissions', 'interval_count', 'interval_sum', 'interval_sumsq',
+                'short_intervals', 'text_count', 'text_len_sum', 'ngram_total'):
+        merged[key] = old[key] + new[key]
+    merged['first_ts'] = min(old['first_ts'], new['first_ts'])
+    merged['last_ts'] = max(old['last_ts'], new['last_ts'])
+    minimums = [m for m in (old['interval_min'], new['interval_min']) if m is not None]
+
+    # The gap between the newest old item and the oldest new item is an
+    # interval neither side has counted yet
+    gap = new['first_ts'] - old['last_ts']
+    if gap >= 0:
+        merged['interval_count'] += 1
+        merged['interval_sum'] += gap
+        merged['interval_sumsq'] += gap * gap
+        merged['short_intervals'] += int(gap < SHORT_INTERVAL)
+        minimums.append(gap)
+    merged['interval_min'] = min(minimums) if minimums else None
+
+    merged['hour_hist'] = np.asarray(old['hour_hist']) + np.asarray(new['hour_hist'])
+    for key in ('text_bitmap', 'ngram_bitmap', 'subreddit_bitmap'):
+        merged[key] = np.bitwise_or(old[key], new[key])
+    return merged
+
+
+def compute_features(user_data, stats, timings=None, now=None):
+    """Turn account fields plus activity stats into the FEATURE_NAMES vector"""
+    timings = timings if timings is not None else {}
+    now = now if now is not None else datetime.utcnow().timestamp()
+    features = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+    index = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+    start = time.perf_counter()
+    post_karma = float(user_data.get('post_karma', 0) or 0)
+    comment_karma = float(user_data.get('comment_karma', 0) or 0)
+    cake_day = user_data.get('cake_day')
+    age_days = max((now - cake_day) / 86400.0, 0.0) if cake_day else 0.0
+    features[index['post_karma']] = post_karma
+    features[index['comment_karma']] = comment_karma
+    features[index['account_age_days']] = age_days
+    features[index['karma_per_day']] = (post_karma + comment_karma) / max(age_days, 1.0)
+    features[index['comment_post_karma_ratio']] = comment_karma / max(post_karma, 1.0)
+    features[index['verified']] = 1.0 if user_data.get('verified') else 0.0
+    timings['account'] = timings.get('account', 0.0) + (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    count = stats['count']
+    features[index['items_sampled']] = count
+    if count:
+        features[index['submission_fraction']] = stats['submissions'] / count
+        span_days = max((stats['last_ts'] - stats['first_ts']) / 86400.0, 1.0 / 24)
+        features[index['items_per_day']] = count / span_days
+    n = stats['interval_count']
+    if n:
+        mean = stats['interval_sum'] / n
+        std = float(np.sqrt(max(stats['interval_sumsq'] / n - mean * mean, 0.0)))
+        features[index['interval_mean']] = mean
+        features[index['interval_std']] = std
+        features[index['interval_cv']] = std / mean if mean else 0.0
+        features[index['interval_min']] = stats['interval_min']
+        # Goh-Barabasi burstiness: -1 periodic, 0 Poisson, 1 bursty
+        features[index['burstiness']] = (std - mean) / (std + mean) if std + mean else 0.0
+        features[index['short_interval_fraction']] = stats['short_intervals'] / n
+    hist = np.asarray(stats['hour_hist'], dtype=np.float64)
+    if hist.sum():
+        p = hist[hist > 0] / hist.sum()
+        # Normalized to [0, 1]: 1 means activity spread evenly over the day
+        features[index['hour_entropy']] = float(-(p * np.log2(p)).sum() / np.log2(24))
+    timings['temporal'] = timings.get('temporal', 0.0) + (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    text_count = stats['text_count']
+    if text_count:
+        unique_texts = min(estimate_distinct(stats['text_bitmap']), text_count)
+        features[index['duplicate_ratio']] = 1.0 - unique_texts / text_count
+        features[index['mean_text_length']] = stats['text_len_sum'] / text_count
+    if stats['ngram_total']:
+        unique_ngrams = min(estimate_distinct(stats['ngram_bitmap']), stats['ngram_total'])
+        features[index['ngram_repetition']] = 1.0 - unique_ngrams / stats['ngram_total']
+    if count:
+        features[index['subreddit_diversity']] = \
+            min(estimate_distinct(stats['subreddit_bitmap']), count) / count
+    timings['text'] = timings.get('text', 0.0) + (time.perf_counter() - start) * 1000
+    return features
+
+
+def extract_features(user_data, items):
+    """
+    Full pipeline for one scan. Returns (float32 vector in FEATURE_NAMES
+    order, {feature group: milliseconds})
+    """
+    timings = {}
+    stats = summarize_activity(items, timings)
+    features = compute_features(user_data, stats, timings)
+    feature_timer.record(timings)
+    return features, timings
+
+
+def features_as_dict(features):
+    return {name: float(value) for name, value in zip(FEATURE_NAMES, features)}
+
+
+class FeatureTimer:
+    """Running per-group cost of feature extraction, reported on /health"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(float)
+        self._counts = defaultdict(int)
+
+    def record(self, timings):
+        with self._lock:
+            for group, ms in timings.items():
+                self._totals[group] += ms
+                self._counts[group] += 1
+
+    def stats(self):
+        with self._lock:
+            return {group: {'calls': self._counts[group],
+                            'avg_ms': round(self._totals[group] / self._counts[group], 3)}
+                    for group in self._totals}
+
+
+feature_timer = FeatureTimer()
@@ -1,93 +1,239 @@
-import google.generativeai as genai
-import os
 from dotenv import load_dotenv
+import copy
+import hashlib
 import json
-from datetime import datetime
+import logging
+import threading
+from datetime import datetime, timedelta
+from config import (REPORT_CACHE_SIZE, REPORT_CACHE_TTL, GEMINI_ENABLED, REPORT_MAX_OUTPUT_TOKENS,
+                    SIMILARITY_ENABLED, GRAPH_ENABLED)
+from utils.cache import TTLCache
+from utils.llm import llm_client, LLMUnavailable
+from utils.json_stream import StreamingJSONParser, SchemaError
+from utils.prompts import REPORT_SCHEMA, prompt_fields, build_report_prompt, estimate_tokens
+from utils.singleflight import create_flight
+from utils.minhash import similarity_index
+from utils.graph import account_graph, CO_COMMENT, CONTENT, SUBREDDIT
+from utils.preprocessing import preprocess_batch
+from models import repository
+from models.db import is_available
+# Module import, not the instance: models.registry imports this package,
+# so scripts that import it first would hit a partially initialized module
+from models import registry
 
 load_dotenv()
 
-# Configure Gemini with basic model
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Report cache: in-memory tier in front of a persistent tier (the reports
+# collection, when MongoDB is available), both keyed by report_cache_key()
+report_cache = TTLCache(maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL)
+# Concurrent cache misses for the same key make one LLM call
+report_flight = create_flight('report')
+
+
+class GenerationStats:
+    """Prompt/output size and parse cost of LLM reports, reported on /health"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reports = 0
+        self.early_stops = 0
+        self.schema_errors = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.parse_seconds = 0.0
+
+    def record(self, prompt, parser, error=None):
+        with self._lock:
+            self.prompt_tokens += estimate_tokens(prompt)
+            if parser is not None:
+                self.output_tokens += (parser.chars + 3) // 4
+                self.parse_seconds += parser.parse_seconds
+            if error is not None:
+                self.schema_errors += 1
+                return
+            self.reports += 1
+            # Stopped before the provider finished the closing brace
+            self.early_stops += int(parser is not None and parser.stopped_early)
+
+    def stats(self):
+        with self._lock:
+            calls = self.reports + self.schema_errors
+            return {
+                'reports': self.reports,
+                'schema_errors': self.schema_errors,
+                'early_stops': self.early_stops,
+                'avg_prompt_tokens_est': round(self.prompt_tokens / calls, 1) if calls else None,
+                'avg_output_tokens_est': round(self.output_tokens / calls, 1) if calls else None,
+                'avg_parse_ms': round(self.parse_seconds * 1000 / calls, 3) if calls else None
+            }
+
+
+generation_stats = GenerationStats()
+
+
+def get_report_generation_stats():
+    return generation_stats.stats()
+
+
+def get_report_cache_stats():
+    return {
+        **report_cache.stats(),
+        'persistent': is_available()
+    }
+
+
+def report_cache_key(user_data):
+    """
+    Stable hash of exactly the fields that go into the prompt, so two
+    requests that would produce the same prompt share a cache entry
+    """
+    payload = json.dumps(prompt_fields(user_data), sort_keys=True,
+                         separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _percent(value):
+    return None if value is None else round(float(value) * 100, 1)
+
+
+def model_scores(user_data):
+    """
+    The confidence and metric fields of a report, as percentages: the
+    model's bot probability for this user and the held-out metrics of the
+    model version that scored it (computed once at model load). Metrics
+    are None when that version has no held-out data
+    """
+    probability = user_data.get('bot_probability')
+    version = user_data.get('model_version')
+    if probability is None:
+        # Clients may send user data from before probabilities were returned
+        try:
+            _, probabilities, versions = registry.model_registry.score(
+                preprocess_batch([user_data]), [user_data.get('screen_name') or ''])
+            if probabilities is not None:
+                probability, version = float(probabilities[0]), versions[0]
+        except Exception as e:
+            logger.warning(f"Could not score user for report: {str(e)}")
+    if probability is None:
+        probability = 1.0 if user_data.get('is_bot') else 0.0
+
+    metrics = registry.model_registry.metrics_for(version) or {}
+    bot_confidence = _percent(probability)
+    return {
+        "accuracy": _percent(metrics.get('accuracy')),
+        "precision": _percent(metrics.get('precision')),
+        "recall": _percent(metrics.get('recall')),
+        "botConfidence": bot_confidence,
+        "humanConfidence": round(100 - bot_confidence, 1)
+    }
+
+
+def _get_cached_report(key):
+    report = report_cache.get(key)
+    if report is not None:
+        return copy.deepcopy(report)
+
+    doc = repository.find_cached_report(
+        key, since=datetime.utcnow() - timedelta(seconds=REPORT_CACHE_TTL))
+    if not doc:
+        return None
+    report_cache.set(key, doc['report'])
+    return copy.deepcopy(doc['report'])
+
+
+def get_cached_report(user_data):
+    """
+    Return the cached report for user_data without calling Gemini,
+    or None if there is no fresh entry. Enriched like generate_report
+    """
+    report = _get_cached_report(report_cache_key(user_data))
+    return _enrich_report(report, user_data) if report is not None else None
+
+
+def _store_cached_report(key, user_data, report):
+    report_cache.set(key, copy.deepcopy(report))
+    repository.save_report({
+        'cache_key': key,
+        'username': user_data.get('screen_name'),
+        'report': report,
+        'timestamp': datetime.utcnow()
+    })
 
 
 def generate_report(user_data):
     """
     Generate a detailed report about a Reddit user using Gemini basic model
-    Returns a structured JSON with analysis metrics
+    Returns a structured JSON with analysis metrics. Reports are cached by
+    report_cache_key(); fallback analyses are never cached. Gemini only
+    writes the text: confidence and metric fields always come from the
+    model (model_scores). The LLM call is bounded by the llm_client
+    deadline and skipped while its circuit is open
     """
-    try:
-        model = genai.GenerativeModel('gemini-pro')
-
-        # Enhanced prompt for structured JSON output
-        prompt = f"""
-        Analyze the following Reddit user data and return a detailed structured analysis in JSON format:
-
-        User Profile:
-        - Username: {user_data.get('screen_name')}
-        - Account Status: {'Verified' if user_data.get('verified') else 'Not Verified'}
-        - Post Karma: {user_data.get('post_karma', 0)}
-        - Comment Karma: {user_data.get('comment_karma', 0)}
-        - Total Activity: {user_data.get('listed_count', 0)}
-        - Account Age: {user_data.get('cake_day')}
-        - Achievements: {', '.join(user_data.get('achievements', []))}
-        - Trophy Case: {', '.join(user_data.get('trophy_case', []))}
-        
-        Bot Detection:
-        - Classification: {'Likely Bot' if user_data.get('is_bot') else 'Likely Human'}
-
-        Please provide a comprehensive analysis in JSON format with these fields:
-        {
-          "accuracy": number, // overall accuracy score (0-100)
-          "precision": number, // precision score (0-100)
-          "recall": number, // recall score (0-100)
-          "botConfidence": number, // confidence in bot classification (0-100)
-          "humanConfidence": number, // confidence in human classification (0-100)
-          "analysisResult": string, // 1-2 sentence summary of the analysis
-          "keyIndicators": string, // key indicators supporting the classification
-          "accountData": {
-            "accountAge": number, // account age in days
-            "totalPosts": number, // total post count
-            "totalComments": number, // total comment count
-            "avgResponseTime": number, // average response time in seconds
-            "suspiciousActivities": number, // count of suspicious activities
-            "repeatedPhrases": number, // count of repeated phrases
-            "similarAccounts": number, // count of similar accounts
-            "reportCount": number // count of user reports
-          },
-          "activityScore": number, // activity score on scale of 0-10
-          "activityMetrics": [
-            {
-              "name": string, // e.g., "Normal Activity"
-              "value": number, // percentage (0-100)
-              "color": string // hex color code
-            }
-          ],
-          "behaviorPatterns": [
-            {
-              "name": string, // pattern name
-              "description": string, // pattern description
-              "isSuspicious": boolean // whether pattern indicates bot behavior
-            }
-          ]
-        }
+    if not GEMINI_ENABLED:
+        return create_fallback_analysis(user_data)
+
+    key = report_cache_key(user_data)
+    report = _get_cached_report(key)
+    if report is None:
+        report, _ = report_flight.do(key, lambda: _generate_and_store(key, user_data))
+        if report is None:
+            return create_fallback_analysis(user_data)
+        report = copy.deepcopy(report)
+    return _enrich_report(report, user_data)
+
+
+def _enrich_report(report, user_data):
+    """
+    Fill an LLM report (cached ones too) with the fields computed locally
+    for user_data: model scores, similarity and the network pattern
+    """
+    report.update(model_scores(user_data))
+    similarity = similarity_fields(user_data)
+    if similarity and isinstance(report.get("accountData"), dict):
+        report["accountData"].update(similarity)
+    network = network_pattern(user_data)
+    if network and isinstance(report.get("behaviorPatterns"), list):
+        report["behaviorPatterns"] = [pattern for pattern in report["behaviorPatterns"]
+                                      if pattern.get("name") != network["name"]] + [network]
+    report["source"] = "gemini"
+    return report
 
-        Base your analysis on these factors:
-        1. Account activity (karma distribution, post frequency)
-        2. Account age and verification status
-        3. Achievement significance
-        4. Content patterns
-        5. Response time patterns
 
-        The JSON must be properly formatted and contain all fields above.
-        """
+def _generate_and_store(key, user_data):
+    report = _generate_llm_report(user_data)
+    if report is not None:
+        _store_cached_report(key, user_data, report)
+    return report
+
+
+def _generate_llm_report(user_data):
+    """
+    Ask Gemini for the analysis. The response is streamed into a parser
+    that validates it against REPORT_SCHEMA and stops reading once every
+    field is in. Returns the parsed report, or None if the call fails or
+    the response does not match the schema
+    """
+    prompt = build_report_prompt(prompt_fields(user_data))
+    parsers = []
+
+    def new_parser():
+        parser = StreamingJSONParser(REPORT_SCHEMA)
+        parsers.append(parser)
+        return parser
 
-        response = model.generate_content(
+    try:
+        parser = llm_client.generate(
             prompt,
+            parser_factory=new_parser,
             generation_config={
                 'temperature': 0.2,  # Lower temperature for more structured output
                 'top_p': 0.8,
                 'top_k': 40,
-                'max_output_tokens': 2048,
+                'max_output_tokens': REPORT_MAX_OUTPUT_TOKENS,
             },
             safety_settings=[
                 {"category": "HARM_CATEGORY_HARASSMENT",
@@ -100,32 +246,69 @@ def generate_report(user_data):
                     "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
             ]
         )
+        generation_stats.record(prompt, parser)
+        return parser.result
+    except LLMUnavailable as e:
+        if isinstance(e.__cause__, SchemaError):
+            generation_stats.record(prompt, parsers[-1] if parsers else None, error=e)
+            logger.warning(f"Gemini report did not match the schema: {str(e.__cause__)}")
+        else:
+            logger.warning(f"Skipping Gemini report: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error generating report: {str(e)}")
+        return None
 
-        # Extract the JSON from the response text and parse it
-        try:
-            # Look for JSON in the response
-            text = response.text
-            if '{' in text and '}' in text:
-                json_start = text.find('{')
-                json_end = text.rfind('}') + 1
-                json_str = text[json_start:json_end]
-                analysis_data = json.loads(json_str)
-                return analysis_data
-            else:
-                # If no JSON found, create fallback structured data
-                return create_fallback_analysis(user_data)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, use fallback
-            return create_fallback_analysis(user_data)
 
-    except Exception as e:
-        print(f"Error generating report: {str(e)}")
-        return create_fallback_analysis(user_data)
+def similarity_fields(user_data):
+    """
+    repeatedPhrases and similarAccounts measured from the user's text: the
+    estimated number of repeated n-grams and the number of indexed
+    accounts above SIMILARITY_THRESHOLD. None until the user's activity has
+    been scanned (build_features)
+    """
+    if not SIMILARITY_ENABLED:
+        return None
+    username = user_data.get('screen_name') or user_data.get('name')
+    return similarity_index.lookup(username) if username else None
+
+
+_EDGE_DESCRIPTIONS = {
+    SUBREDDIT: 'shared subreddits',
+    CO_COMMENT: 'commenting in the same threads within minutes',
+    CONTENT: 'near-duplicate text'
+}
+
+
+def network_pattern(user_data):
+    """
+    The "Network Analysis" behavior pattern from the account graph as of
+    the last bot ring job, or None if the user was not part of that run
+    """
+    if not GRAPH_ENABLED:
+        return None
+    username = user_data.get('screen_name') or user_data.get('name')
+    summary = account_graph.network_summary(username) if username else None
+    if summary is None:
+        return None
+    ring = summary['ring']
+    if ring:
+        links = ', '.join(_EDGE_DESCRIPTIONS[kind] for kind, count in ring['edges'].items()
+                          if count) or 'shared activity'
+        description = (f"Part of a ring of {ring['size']} linked accounts, {ring['bots']} of "
+                       f"them scored as bots (linked by {links})")
+    elif summary['connections']:
+        description = (f"Linked to {summary['connections']} scanned accounts, none of them "
+                       f"in a detected bot ring")
+    else:
+        description = "No links to other scanned accounts"
+    return {"name": "Network Analysis", "description": description, "isSuspicious": bool(ring)}
 
 
 def create_fallback_analysis(user_data):
     """
-    Create a fallback analysis if Gemini fails to generate proper JSON
+    Create the analysis locally, used when Gemini is disabled or fails to
+    generate proper JSON
     """
     # Calculate basic metrics
     is_bot = user_data.get('is_bot', False)
@@ -135,9 +318,8 @@ def create_fallback_analysis(user_data):
     comment_karma = user_data.get('comment_karma', 0)
     total_activity = user_data.get('listed_count', 0)
 
-    # Generate suspicious activity metrics based on heuristics
-    bot_confidence = 85 if is_bot else 15
-    human_confidence = 100 - bot_confidence
+    # Confidence from the model's probability, metrics from its held-out set
+    scores = model_scores(user_data)
 
     # Calculate suspicious metrics based on activity and bot status
     suspicious_activities = int(total_activity * 0.01) + (20 if is_bot else 0)
@@ -147,6 +329,11 @@ def create_fallback_analysis(user_data):
     repeated_phrases = min(repeated_phrases, 50)
 
     similar_accounts = 8 if is_bot else 1
+
+    similarity = similarity_fields(user_data)
+    if similarity:
+        repeated_phrases = similarity['repeatedPhrases']
+        similar_accounts = similarity['similarAccounts']
     report_count = 5 if is_bot else 0
 
     # Calculate activity distribution
@@ -158,11 +345,8 @@ def create_fallback_analysis(user_data):
     activity_score = 8.5 if is_bot else 6.2
 
     return {
-        "accuracy": 92,
-        "precision": 94,
-        "recall": 91,
-        "botConfidence": bot_confidence,
-        "humanConfidence": human_confidence,
+        "source": "local",
+        **scores,
         "analysisResult": "This account displays multiple indicators consistent with automated behavior." if is_bot else "This account displays patterns typical of genuine human activity.",
         "keyIndicators": f"High posting frequency, repetitive content patterns, unusual activity hours, {suspicious_activities} flagged actions." if is_bot else "Normal posting frequency, varied content, typical activity hours, minimal automated behaviors.",
         "accountData": {
@@ -209,7 +393,7 @@ def create_fallback_analysis(user_data):
                 "description": "Limited engagement in conversations, often non-contextual responses" if is_bot else "Natural conversation flow with appropriate responses",
                 "isSuspicious": is_bot
             },
-            {
+            network_pattern(user_data) or {
                 "name": "Network Analysis",
                 "description": f"Found {similar_accounts} similar bot accounts with matching behavior patterns" if is_bot else "No suspicious network connections identified",
                 "isSuspicious": is_bot
@@ -0,0 +1,821 @@
+from datetime import datetime
+from config import (GRAPH_ENABLED, GRAPH_PATH, GRAPH_MAX_ACCOUNTS, GRAPH_MAX_EDGES,
+                    GRAPH_MAX_COMMENTS, GRAPH_CO_COMMENT_WINDOW, GRAPH_MAX_THREAD_PARTNERS,
+                    GRAPH_MIN_SHARED_SUBREDDITS, GRAPH_MAX_SUBREDDIT_ACCOUNTS,
+                    GRAPH_MIN_CO_COMMENTS, GRAPH_WEIGHT_SUBREDDIT, GRAPH_WEIGHT_CO_COMMENT,
+                    GRAPH_WEIGHT_CONTENT, GRAPH_EDGE_THRESHOLD, GRAPH_MIN_RING_SIZE,
+                    GRAPH_MAX_RING_SIZE, GRAPH_RING_BOT_FRACTION, GRAPH_LPA_ITERATIONS,
+                    GRAPH_SAVE_INTERVAL, GRAPH_RING_INTERVAL)
+from models import repository
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+import atexit
+import fcntl
+import json
+import logging
+import numpy as np
+import os
+import threading
+import time
+import zlib
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUBREDDIT = 'shared_subreddits'
+CO_COMMENT = 'co_commenting'
+CONTENT = 'content'
+KINDS = (SUBREDDIT, CO_COMMENT, CONTENT)
+
+_SHIFT32 = np.uint64(32)
+# Members listed per ring in API responses (the bot_rings documents keep all)
+_LISTED_MEMBERS = 50
+# Accounts per block when counting shared subreddits
+_PAIR_BLOCK = 2048
+
+
+class RingJobRunning(Exception):
+    pass
+
+
+def _grown(array, needed):
+    """array, or a copy with room for at least needed rows"""
+    if needed <= len(array):
+        return array
+    new = np.zeros((max(needed, len(array) * 2, 1024),) + array.shape[1:], dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+
+class _EdgeLayer:
+    """
+    Undirected weighted edges of one kind, as an upper-triangular CSR
+    matrix over every possible account id plus a COO buffer of edges added
+    since the last compaction. reduce says how repeated edges combine:
+    'sum' counts events (co-commenting), 'max' keeps the strongest
+    observation (content similarity re-measured on every scan)
+    """
+
+    def __init__(self, size, reduce):
+        self.reduce = reduce
+        self.matrix = sparse.csr_matrix((size, size), dtype=np.float32)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.cols = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.pending = 0
+        self.pruned = 0
+
+    def add(self, a, b, weights):
+        a, b = np.asarray(a, dtype=np.int32), np.asarray(b, dtype=np.int32)
+        keep = a != b
+        a, b = a[keep], b[keep]
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float32), keep.shape)[keep]
+        end = self.pending + len(a)
+        self.rows = _grown(self.rows, end)
+        self.cols = _grown(self.cols, end)
+        self.weights = _grown(self.weights, end)
+        self.rows[self.pending:end] = np.minimum(a, b)
+        self.cols[self.pending:end] = np.maximum(a, b)
+        self.weights[self.pending:end] = weights
+        self.pending = end
+
+    def compact(self, max_edges):
+        """Fold the buffer into the matrix, keeping the max_edges strongest edges"""
+        if self.pending:
+            rows, cols = self.rows[:self.pending], self.cols[:self.pending]
+            weights = self.weights[:self.pending]
+            size = self.matrix.shape[0]
+            keys = rows.astype(np.int64) * size + cols
+            if self.reduce == 'max':
+                order = np.lexsort((-weights, keys))
+                keys, weights = keys[order], weights[order]
+                first = np.r_[True, keys[1:] != keys[:-1]]
+                keys, weights = keys[first], weights[first]
+            else:
+                keys, inverse = np.unique(keys, return_inverse=True)
+                weights = np.bincount(inverse, weights).astype(np.float32)
+            new = sparse.csr_matrix((weights, (keys // size, keys % size)),
+                                    shape=self.matrix.shape, dtype=np.float32)
+            if self.reduce == 'max':
+                self.matrix = self.matrix.maximum(new).tocsr()
+            else:
+                self.matrix = (self.matrix + new).tocsr()
+            self.pending = 0
+            # The buffer keeps its capacity only while it is small
+            if len(self.rows) > 65536:
+                self.rows, self.cols = self.rows[:0].copy(), self.cols[:0].copy()
+                self.weights = self.weights[:0].copy()
+        if self.matrix.nnz > max_edges:
+            data = self.matrix.data
+            cutoff = np.partition(data, data.size - max_edges)[data.size - max_edges]
+            before = self.matrix.nnz
+            data[data < cutoff] = 0
+            self.matrix.eliminate_zeros()
+            self.pruned += before - self.matrix.nnz
+        return self.matrix
+
+    @property
+    def nbytes(self):
+        m = self.matrix
+        return int(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes + self.rows.nbytes +
+                   self.cols.nbytes + self.weights.nbytes)
+
+
+class AccountGraph:
+    """
+    Links between scanned accounts, for finding coordinated bot rings.
+
+    Accounts are added by build_features with their recent activity:
+      * shared subreddits - which subreddits the account was active in. The
+        edges are derived by the ring job from the account x subreddit
+        matrix, counting only subreddits with at most
+        max_subreddit_accounts known members (sharing a huge subreddit says
+        nothing)
+      * co-commenting - comments in the same thread within window seconds
+        of a comment by another account, found as each comment is added
+        by searching a log of (thread, time, account) sorted on
+        (thread hash << 32 | time); counts accumulate per pair
+      * content - near-duplicate text pairs from the MinHash index, with
+        the estimated similarity as weight
+
+    Edge kinds are kept as separate upper-triangular CSR matrices with a
+    COO buffer for incremental insertion (see _EdgeLayer). find_rings()
+    combines them, takes connected components of the strong edges, splits
+    oversized components by label propagation and flags groups in which
+    most scored members were scored as bots.
+
+    Memory is bounded by max_accounts, max_edges (per stored kind, weakest
+    dropped first) and max_comments (oldest dropped first); stats() reports
+    the array bytes in use
+    """
+
+    def __init__(self, max_accounts=GRAPH_MAX_ACCOUNTS, max_edges=GRAPH_MAX_EDGES,
+                 max_comments=GRAPH_MAX_COMMENTS, window=GRAPH_CO_COMMENT_WINDOW,
+                 max_partners=GRAPH_MAX_THREAD_PARTNERS):
+        self.max_accounts = max_accounts
+        self.max_edges = max_edges
+        self.max_comments = max_comments
+        self.window = window
+        self.max_partners = max_partners
+        self._lock = threading.RLock()
+        self._job_lock = threading.Lock()
+        self._maintain = None
+        self._maintain_pid = None
+        self._ring_lock = None
+        self._file_signature = None
+        self._reset()
+
+    def _reset(self):
+        self.names = []
+        self._ids = {}
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.layers = {CO_COMMENT: _EdgeLayer(self.max_accounts, 'sum'),
+                       CONTENT: _EdgeLayer(self.max_accounts, 'max')}
+        self.subreddits = []
+        self._subreddit_ids = {}
+        # (account << 32 | subreddit id); unique up to _memberships_unique
+        self._memberships = np.zeros(0, dtype=np.uint64)
+        self._memberships_size = 0
+        self._memberships_unique = 0
+        # Comment log as two runs sorted by key: the bulk, and recent
+        # additions merged into it once they reach a twentieth of its size
+        self._log_keys = np.zeros(0, dtype=np.uint64)
+        self._log_nodes = np.zeros(0, dtype=np.uint32)
+        self._recent_keys = np.zeros(0, dtype=np.uint64)
+        self._recent_nodes = np.zeros(0, dtype=np.uint32)
+        self.ring_of = np.zeros(0, dtype=np.int32)
+        self.degree = np.zeros(0, dtype=np.int32)
+        self.rings = []
+        self.last_run = None
+        self.dropped_accounts = 0
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def _node(self, username, create=False):
+        key = username.lower()
+        node = self._ids.get(key)
+        if node is not None or not create:
+            return node
+        if len(self.names) >= self.max_accounts:
+            self.dropped_accounts += 1
+            return None
+        node = len(self.names)
+        self.names.append(username)
+        self._ids[key] = node
+        self.scores = _grown(self.scores, node + 1)
+        self.scores[node] = np.nan
+        return node
+
+    def add_activity(self, username, items, probability=None):
+        """
+        Add an account (or new activity of a known one): its subreddits,
+        and co-commenting edges for comments near other accounts' comments
+        in the same thread. Returns the number of co-commenting edges added
+        """
+        self._ensure_maintained()
+        with self._lock:
+            node = self._node(username, create=True)
+            if node is None:
+                return 0
+            if probability is not None:
+                self.scores[node] = probability
+            self._add_subreddits(node, {item['subreddit'].lower() for item in items
+                                        if item.get('subreddit')})
+            comments = [item for item in items
+                        if item.get('kind') == 'comment' and item.get('link_id')]
+            added = self._add_comments(node, comments) if comments else 0
+            self.dirty = True
+            return added
+
+    def _add_subreddits(self, node, subreddits):
+        if not subreddits:
+            return
+        ids = []
+        for name in subreddits:
+            if name not in self._subreddit_ids:
+                self._subreddit_ids[name] = len(self.subreddits)
+                self.subreddits.append(name)
+            ids.append(self._subreddit_ids[name])
+        keys = (np.uint64(node) << _SHIFT32) | np.asarray(ids, dtype=np.uint64)
+        end = self._memberships_size + len(keys)
+        self._memberships = _grown(self._memberships, end)
+        self._memberships[self._memberships_size:end] = keys
+        self._memberships_size = end
+        # Rescans repeat memberships; drop them once they could double the array
+        if end > 2 * max(self._memberships_unique, 4096):
+            self._unique_memberships()
+
+    def _unique_memberships(self):
+        unique = np.unique(self._memberships[:self._memberships_size])
+        self._memberships = unique
+        self._memberships_size = self._memberships_unique = len(unique)
+        return unique
+
+    def _add_comments(self, node, comments):
+        keys = np.fromiter(
+            ((zlib.crc32(c['link_id'].encode('utf-8')) << 32) | int(c['created_utc'])
+             for c in comments), dtype=np.uint64, count=len(comments))
+        keys = np.unique(keys)
+        matches = [self._log_matches(self._log_keys, self._log_nodes, keys),
+                   self._log_matches(self._recent_keys, self._recent_nodes, keys)]
+        partner_of, partners, exact = (np.concatenate(column) for column in zip(*matches))
+        # A comment already in the log under this account is a rescan
+        duplicate = np.zeros(len(keys), dtype=bool)
+        duplicate[partner_of[(partners == node) & exact]] = True
+        keep = (partners != node) & ~duplicate[partner_of]
+        partners = partners[keep]
+        if len(partners):
+            self.layers[CO_COMMENT].add(np.full(len(partners), node), partners, 1.0)
+
+        keys = keys[~duplicate]
+        recent_keys = np.concatenate([self._recent_keys, keys])
+        recent_nodes = np.concatenate([self._recent_nodes,
+                                       np.full(len(keys), node, dtype=np.uint32)])
+        order = np.argsort(recent_keys, kind='stable')
+        self._recent_keys, self._recent_nodes = recent_keys[order], recent_nodes[order]
+        if len(self._recent_keys) > max(4096, len(self._log_keys) // 20):
+            self._merge_log()
+        return len(partners)
+
+    def _log_matches(self, log_keys, log_nodes, keys):
+        """
+        (index into keys, account, same key) for the entries of a sorted log
+        run in the same thread as a key and within window seconds of it, at
+        most max_partners per key
+        """
+        window = np.uint64(self.window)
+        lo = np.searchsorted(log_keys, keys - window, side='left')
+        hi = np.searchsorted(log_keys, keys + window, side='right')
+        counts = np.minimum(hi - lo, self.max_partners)
+        of = np.repeat(np.arange(len(keys)), counts)
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(lo, counts) + offsets
+        return of, log_nodes[positions].astype(np.int64), log_keys[positions] == keys[of]
+
+    def _merge_log(self):
+        keys = np.concatenate([self._log_keys, self._recent_keys])
+        nodes = np.concatenate([self._log_nodes, self._recent_nodes])
+        if len(keys) > self.max_comments:
+            newest = np.argpartition(keys & np.uint64(0xFFFFFFFF),
+                                     len(keys) - self.max_comments)[-self.max_comments:]
+            keys, nodes = keys[newest], nodes[newest]
+        order = np.argsort(keys, kind='stable')
+        self._log_keys, self._log_nodes = keys[order], nodes[order]
+        self._recent_keys = self._recent_keys[:0]
+        self._recent_nodes = self._recent_nodes[:0]
+
+    def add_similar(self, username, similar):
+        """Content edges from username to [(username, similarity)] (MinHashIndex.similar)"""
+        self._ensure_maintained()
+        with self._lock:
+            node = self._node(username)
+            others = [(self._ids.get(name.lower()), score) for name, score in similar]
+            others = [(other, score) for other, score in others if other is not None]
+            if node is None or not others:
+                return 0
+            self.layers[CONTENT].add(np.full(len(others), node), [o for o, _ in others],
+                                     [s for _, s in others])
+            self.dirty = True
+            return len(others)
+
+    def set_score(self, username, probability):
+        self._ensure_maintained()
+        with self._lock:
+            node = self._node(username)
+            if node is not None and probability is not None:
+                self.scores[node] = probability
+                self.dirty = True
+
+    def _snapshot(self):
+        with self._lock:
+            n = len(self.names)
+            matrices = {kind: layer.compact(self.max_edges)[:n, :n]
+                        for kind, layer in self.layers.items()}
+            memberships = self._unique_memberships()
+            return (n, list(self.names), self.scores[:n].copy(), matrices, memberships,
+                    len(self.subreddits))
+
+    def _subreddit_edges(self, n, memberships, subreddit_count):
+        nodes = (memberships >> _SHIFT32).astype(np.int64)
+        subreddits = (memberships & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        members = np.bincount(subreddits, minlength=subreddit_count)
+        keep = (members[subreddits] >= 2) & (members[subreddits] <= GRAPH_MAX_SUBREDDIT_ACCOUNTS)
+        incidence = sparse.csr_matrix(
+            (np.ones(int(keep.sum()), dtype=np.float32), (nodes[keep], subreddits[keep])),
+            shape=(n, subreddit_count))
+        # Shared counts of one block of accounts at a time: most pairs share
+        # a single subreddit and are dropped before the next block
+        transposed = incidence.T.tocsr()
+        blocks = []
+        for start in range(0, n, _PAIR_BLOCK):
+            shared = (incidence[start:start + _PAIR_BLOCK] @ transposed).tocoo()
+            keep = (shared.data >= GRAPH_MIN_SHARED_SUBREDDITS) & \
+                (shared.col > shared.row + start)
+            blocks.append((shared.data[keep], shared.row[keep] + start, shared.col[keep]))
+        data, rows, cols = (np.concatenate(column) for column in zip(*blocks)) if blocks \
+            else (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32),
+                  np.zeros(0, dtype=np.int32))
+        return sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+
+    def find_rings(self, min_ring_size=GRAPH_MIN_RING_SIZE):
+        """
+        Batch job: combine the edge kinds into one account graph, cluster it
+        and flag bot rings. Each pair's strength is the sum of the weights
+        of the kinds it qualifies on (GRAPH_WEIGHT_*); pairs at or above
+        GRAPH_EDGE_THRESHOLD are linked. Clusters are connected components,
+        split by label propagation when larger than GRAPH_MAX_RING_SIZE. A
+        cluster of at least min_ring_size accounts is a ring when at
+        least two and a GRAPH_RING_BOT_FRACTION share of its scored members
+        were scored as bots. Flagged rings are stored in bot_rings
+        """
+        if not self._job_lock.acquire(blocking=False):
+            raise RingJobRunning("A bot ring job is already running")
+        try:
+            started = time.perf_counter()
+            n, names, scores, matrices, memberships, subreddit_count = self._snapshot()
+            matrices[SUBREDDIT] = self._subreddit_edges(n, memberships, subreddit_count)
+
+            strength = sparse.csr_matrix((n, n), dtype=np.float32)
+            qualifying = {SUBREDDIT: (GRAPH_MIN_SHARED_SUBREDDITS, GRAPH_WEIGHT_SUBREDDIT),
+                          CO_COMMENT: (GRAPH_MIN_CO_COMMENTS, GRAPH_WEIGHT_CO_COMMENT),
+                          CONTENT: (np.finfo(np.float32).tiny, GRAPH_WEIGHT_CONTENT)}
+            for kind, (minimum, weight) in qualifying.items():
+                matrix = matrices[kind].copy()
+                matrix.data = np.where(matrix.data >= minimum, weight, 0).astype(np.float32)
+                matrix.eliminate_zeros()
+                strength = strength + matrix
+            strength.data[strength.data < GRAPH_EDGE_THRESHOLD] = 0
+            strength.eliminate_zeros()
+            linked = (strength + strength.T).tocsr()
+
+            _, labels = connected_components(linked, directed=False)
+            labels = self._split_large(linked, labels)
+            rings, ring_of = self._flag(names, scores, labels, matrices, min_ring_size)
+            degree = np.diff(linked.indptr).astype(np.int32)
+
+            run = {
+                'at': datetime.utcnow().isoformat(),
+                'accounts': n,
+                'links': int(linked.nnz // 2),
+                'edges': {kind: int(matrix.nnz) for kind, matrix in matrices.items()},
+                'clusters': int(len(np.unique(labels))) if n else 0,
+                'rings': len(rings),
+                'seconds': round(time.perf_counter() - started, 3)
+            }
+            with self._lock:
+                self.rings, self.ring_of, self.degree, self.last_run = rings, ring_of, degree, run
+                self.dirty = True
+            repository.save_bot_rings([
+                {**ring_public(ring), 'members': ring['all_members'], 'run_at': datetime.utcnow()}
+                for ring in rings])
+            logger.info(f"Bot ring job: {run}")
+            return run
+        finally:
+            self._job_lock.release()
+
+    def _split_large(self, linked, labels):
+        sizes = np.bincount(labels)
+        large = np.flatnonzero(sizes > GRAPH_MAX_RING_SIZE)
+        if not len(large):
+            return labels
+        labels = labels.astype(np.int64)
+        nodes = np.flatnonzero(np.isin(labels, large))
+        sub = linked[nodes][:, nodes].tocsr()
+        communities = _label_propagation(sub, GRAPH_LPA_ITERATIONS)
+        labels[nodes] = labels.max() + 1 + communities
+        return labels
+
+    def _flag(self, names, scores, labels, matrices, min_ring_size):
+        n = len(names)
+        ring_of = np.full(n, -1, dtype=np.int32)
+        if not n:
+            return [], ring_of
+        _, labels = np.unique(labels, return_inverse=True)
+        sizes = np.bincount(labels)
+        scored = ~np.isnan(scores)
+        scored_count = np.bincount(labels, weights=scored.astype(float), minlength=len(sizes))
+        bots = np.bincount(labels, weights=(scored & (np.nan_to_num(scores) >= 0.5)).astype(float),
+                           minlength=len(sizes))
+        probability_sum = np.bincount(labels, weights=np.nan_to_num(scores),
+                                      minlength=len(sizes))
+        flagged = np.flatnonzero((sizes >= min_ring_size) & (bots >= 2) &
+                                 (bots >= GRAPH_RING_BOT_FRACTION * np.maximum(scored_count, 1)))
+        flagged = flagged[np.argsort(-sizes[flagged], kind='stable')]
+
+        # Edges inside each ring, by kind
+        inside = {}
+        for kind, matrix in matrices.items():
+            coo = matrix.tocoo()
+            same = labels[coo.row] == labels[coo.col]
+            inside[kind] = np.bincount(labels[coo.row[same]], minlength=len(sizes))
+
+        rings = []
+        for ring_id, label in enumerate(flagged):
+            members = np.flatnonzero(labels == label)
+            ring_of[members] = ring_id
+            member_names = [names[i] for i in members]
+            rings.append({
+                'ring': ring_id,
+                'size': int(sizes[label]),
+                'scored': int(scored_count[label]),
+                'bots': int(bots[label]),
+                'mean_probability': round(float(probability_sum[label] / scored_count[label]), 3),
+                'edges': {kind: int(counts[label]) for kind, counts in inside.items()},
+                'members': member_names[:_LISTED_MEMBERS],
+                'all_members': member_names
+            })
+        return rings, ring_of
+
+    def network_summary(self, username):
+        """
+        {'connections', 'ring'} of username as of the last ring job, or
+        None if the account is not in the graph or no job has run since it
+        was added
+        """
+        self._ensure_maintained()
+        with self._lock:
+            node = self._node(username)
+            if node is None or node >= len(self.ring_of):
+                return None
+            ring = self.ring_of[node]
+            return {
+                'connections': int(self.degree[node]),
+                'ring': ring_public(self.rings[ring]) if ring >= 0 else None
+            }
+
+    def list_rings(self):
+        self._ensure_maintained()
+        with self._lock:
+            return [ring_public(ring) for ring in self.rings]
+
+    def save(self, path, merge=True):
+        """
+        Write the graph (edges compacted) to path (.npz) atomically. With
+        merge, the file's contents are merged in first (see merge_file), all
+        under an exclusive lock on path.lock, so processes sharing the file
+        add to it rather than overwrite each other
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if merge:
+                self.merge_file(path)
+            with self._lock:
+                n = len(self.names)
+                arrays = {
+                    'names': _encode(self.names),
+                    'scores': self.scores[:n].copy(),
+                    'subreddits': _encode(self.subreddits),
+                    'memberships': self._unique_memberships().copy(),
+                    'ring_of': self.ring_of.copy(),
+                    'degree': self.degree.copy(),
+                    'rings': _encode([json.dumps({'rings': self.rings,
+                                                  'last_run': self.last_run})])
+                }
+                self._merge_log()
+                arrays['log_keys'] = self._log_keys.copy()
+                arrays['log_nodes'] = self._log_nodes.copy()
+                for kind, layer in self.layers.items():
+                    matrix = layer.compact(self.max_edges)
+                    arrays[f'{kind}_data'] = matrix.data.copy()
+                    arrays[f'{kind}_indices'] = matrix.indices.copy()
+                    arrays[f'{kind}_indptr'] = matrix.indptr[:n + 1].copy()
+                self.dirty = False
+            tmp = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp, **arrays)
+            os.replace(tmp, path)
+            self._file_signature = _file_signature(path)
+        return n
+
+    def _read(self, path):
+        """(names, subreddits, rings, arrays) of a save() file; None if missing"""
+        if not path or not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files
+                      if name not in ('names', 'subreddits', 'rings')}
+            names = _decode(data['names']) if len(arrays['scores']) else []
+            subreddits = _decode(data['subreddits'])
+            # Files written before ring results were saved have none
+            rings = json.loads(_decode(data['rings'])[0]) if 'rings' in data.files \
+                else {'rings': [], 'last_run': None}
+        return names, subreddits, rings, arrays
+
+    def merge_file(self, path):
+        """
+        Merge a save() file (another process's copy) into this graph.
+        Accounts, subreddits, memberships and logged comments are united,
+        missing scores are taken from the file, and each edge keeps the
+        larger weight of the two copies, so merging a file again changes
+        nothing (a pair counted in both processes keeps the larger count).
+        The file's ring job results replace ours when they are newer.
+        Returns the number of accounts added
+        """
+        signature = _file_signature(path)
+        loaded = self._read(path)
+        if loaded is None:
+            return 0
+        names, subreddits, rings, arrays = loaded
+        with self._lock:
+            before = len(self.names)
+            # Accounts beyond max_accounts map to -1 and are left out
+            nodes = np.array([self._node(name, create=True) for name in names], dtype=float)
+            mapped = ~np.isnan(nodes)
+            nodes = np.where(mapped, nodes, -1).astype(np.int64)
+
+            scores = arrays['scores']
+            fill = np.flatnonzero(mapped & ~np.isnan(scores))
+            fill = fill[np.isnan(self.scores[nodes[fill]])]
+            self.scores[nodes[fill]] = scores[fill]
+
+            if len(arrays['memberships']):
+                self._add_file_memberships(nodes, mapped, subreddits, arrays['memberships'])
+
+            log_nodes = arrays['log_nodes'].astype(np.int64)
+            keep = mapped[log_nodes]
+            self._merge_log()
+            keys = np.concatenate([self._log_keys, arrays['log_keys'][keep]])
+            log_nodes = np.concatenate([self._log_nodes,
+                                        nodes[log_nodes[keep]].astype(np.uint32)])
+            order = np.lexsort((log_nodes, keys))
+            keys, log_nodes = keys[order], log_nodes[order]
+            first = np.r_[True, (keys[1:] != keys[:-1]) | (log_nodes[1:] != log_nodes[:-1])]
+            self._log_keys, self._log_nodes = self._log_keys[:0], self._log_nodes[:0]
+            self._recent_keys, self._recent_nodes = keys[first], log_nodes[first]
+            self._merge_log()
+
+            for kind, layer in self.layers.items():
+                indptr = arrays[f'{kind}_indptr']
+                rows = len(indptr) - 1
+                if rows <= 0:
+                    continue
+                coo = sparse.csr_matrix(
+                    (arrays[f'{kind}_data'], arrays[f'{kind}_indices'], indptr),
+                    shape=(rows, len(names))).tocoo()
+                keep = mapped[coo.row] & mapped[coo.col]
+                a, b = nodes[coo.row[keep]], nodes[coo.col[keep]]
+                theirs = sparse.csr_matrix(
+                    (coo.data[keep], (np.minimum(a, b), np.maximum(a, b))),
+                    shape=layer.matrix.shape, dtype=np.float32)
+                layer.compact(self.max_edges)
+                layer.matrix = layer.matrix.maximum(theirs).tocsr()
+                layer.compact(self.max_edges)
+
+            last_run = rings['last_run']
+            if last_run and (self.last_run is None or last_run['at'] > self.last_run['at']):
+                ring_of = np.full(len(self.names), -1, dtype=np.int32)
+                degree = np.zeros(len(self.names), dtype=np.int32)
+                ran = np.flatnonzero(mapped[:len(arrays['ring_of'])])
+                ring_of[nodes[ran]] = arrays['ring_of'][ran]
+                degree[nodes[ran]] = arrays['degree'][ran]
+                self.rings, self.ring_of, self.degree = rings['rings'], ring_of, degree
+                self.last_run = last_run
+            self._file_signature = signature
+            return len(self.names) - before
+
+    def _add_file_memberships(self, nodes, mapped, subreddits, memberships):
+        ids = []
+        for name in subreddits:
+            if name not in self._subreddit_ids:
+                self._subreddit_ids[name] = len(self.subreddits)
+                self.subreddits.append(name)
+            ids.append(self._subreddit_ids[name])
+        ids = np.asarray(ids, dtype=np.uint64)
+        accounts = (memberships >> _SHIFT32).astype(np.int64)
+        keep = mapped[accounts]
+        keys = (nodes[accounts[keep]].astype(np.uint64) << _SHIFT32) | \
+            ids[(memberships[keep] & np.uint64(0xFFFFFFFF)).astype(np.int64)]
+        end = self._memberships_size + len(keys)
+        self._memberships = _grown(self._memberships, end)
+        self._memberships[self._memberships_size:end] = keys
+        self._memberships_size = end
+        self._unique_memberships()
+
+    def load(self, path):
+        """Replace the contents with a save() file; False if missing or too large"""
+        signature = _file_signature(path) if path else None
+        loaded = self._read(path)
+        if loaded is None:
+            return False
+        names, subreddits, rings, data = loaded
+        if len(names) > self.max_accounts:
+            logger.warning(f"Ignoring account graph {path}: more than "
+                           f"{self.max_accounts} accounts")
+            return False
+        with self._lock:
+            self._reset()
+            n = len(names)
+            self.names = names
+            self._ids = {name.lower(): i for i, name in enumerate(names)}
+            self.scores = data['scores'].astype(np.float32)
+            self.subreddits = subreddits
+            self._subreddit_ids = {name: i for i, name in enumerate(subreddits)}
+            self._memberships = data['memberships'].astype(np.uint64)
+            self._memberships_size = self._memberships_unique = len(self._memberships)
+            self._log_keys = data['log_keys'].astype(np.uint64)
+            self._log_nodes = data['log_nodes'].astype(np.uint32)
+            self.ring_of = data['ring_of'].astype(np.int32)
+            self.degree = data['degree'].astype(np.int32)
+            self.rings, self.last_run = rings['rings'], rings['last_run']
+            for kind, layer in self.layers.items():
+                indptr = data[f'{kind}_indptr']
+                indptr = np.concatenate([indptr, np.full(self.max_accounts + 1 - len(indptr),
+                                                         indptr[-1] if len(indptr) else 0,
+                                                         dtype=indptr.dtype)])
+                layer.matrix = sparse.csr_matrix(
+                    (data[f'{kind}_data'], data[f'{kind}_indices'], indptr),
+                    shape=(self.max_accounts, self.max_accounts))
+            self._file_signature = signature
+        logger.info(f"Loaded account graph with {n} accounts from {path}")
+        return True
+
+    def autosave(self, path, save_interval, ring_interval=0):
+        """
+        Save to path every save_interval seconds and at exit, merging with
+        what other processes saved there, and merge their changes in when
+        the file changes. With ring_interval, one process at a time (the
+        holder of path.ring.lock) also runs the ring job that often; the
+        others pick up its results from the file. The thread starts on
+        first use in each process, so every preforked gunicorn worker runs
+        its own and the master, which never sees a scan, runs none
+        """
+        self._maintain = (path, save_interval, ring_interval)
+
+    def _ensure_maintained(self):
+        if self._maintain is None or self._maintain_pid == os.getpid():
+            return
+        with self._lock:
+            if self._maintain_pid == os.getpid():
+                return
+            self._maintain_pid = os.getpid()
+        threading.Thread(target=self._maintain_periodically, args=self._maintain, daemon=True,
+                         name='account-graph').start()
+        atexit.register(self._save_at_exit, self._maintain[0], os.getpid())
+
+    def _maintain_periodically(self, path, save_interval, ring_interval):
+        last_ring_job = time.monotonic()
+        while True:
+            time.sleep(save_interval)
+            if ring_interval and time.monotonic() - last_ring_job >= ring_interval:
+                last_ring_job = time.monotonic()
+                if self._ring_lock is None:
+                    self._ring_lock = _try_lock(f"{path}.ring.lock")
+                if self._ring_lock is not None:
+                    run_ring_job(self)
+            try:
+                if self.dirty:
+                    self.save(path)
+                elif _file_signature(path) != self._file_signature:
+                    self.merge_file(path)
+            except Exception as e:
+                logger.error(f"Could not save account graph: {str(e)}")
+
+    def _save_at_exit(self, path, pid):
+        # atexit handlers are inherited by forked children
+        if pid == os.getpid() and self.dirty:
+            self.save(path)
+
+    def stats(self):
+        with self._lock:
+            layers = {kind: {'edges': int(layer.matrix.nnz), 'pending': layer.pending,
+                             'pruned': layer.pruned} for kind, layer in self.layers.items()}
+            return {
+                'accounts': len(self.names),
+                'max_accounts': self.max_accounts,
+                'dropped_accounts': self.dropped_accounts,
+                'subreddits': len(self.subreddits),
+                'memberships': self._memberships_size,
+                'comments_logged': len(self._log_keys) + len(self._recent_keys),
+                'layers': layers,
+                'array_bytes': int(sum(layer.nbytes for layer in self.layers.values()) +
+                                   self.scores.nbytes + self._memberships.nbytes +
+                                   self._log_keys.nbytes + self._log_nodes.nbytes +
+                                   self._recent_keys.nbytes + self._recent_nodes.nbytes +
+                                   self.ring_of.nbytes + self.degree.nbytes),
+                'last_run': self.last_run,
+                'job_running': self._job_lock.locked()
+            }
+
+
+def _encode(strings):
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _decode(array):
+    return bytes(array).decode('utf-8').split('\n') if len(array) else []
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _try_lock(path):
+    """An open file holding an exclusive lock on path, or None if another process holds it"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    lock = open(path, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def ring_public(ring):
+    return {k: v for k, v in ring.items() if k != 'all_members'}
+
+
+def _label_propagation(matrix, iterations):
+    """
+    Community labels (0..k-1) of a symmetric weighted CSR graph: every node
+    repeatedly takes the label with the largest total edge weight among its
+    neighbours (ties to the smallest label). Updates are synchronous and
+    vectorized, and stop when nothing changes or after iterations rounds
+    """
+    size = matrix.shape[0]
+    labels = np.arange(size, dtype=np.int64)
+    rows = np.repeat(np.arange(size, dtype=np.int64), np.diff(matrix.indptr))
+    for _ in range(iterations):
+        keys = rows * size + labels[matrix.indices]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        weight = np.bincount(inverse, matrix.data)
+        node, label = unique // size, unique % size
+        order = np.lexsort((label, -weight, node))
+        first = order[np.r_[True, node[order][1:] != node[order][:-1]]]
+        updated = labels.copy()
+        updated[node[first]] = label[first]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return np.unique(labels, return_inverse=True)[1]
+
+
+account_graph = AccountGraph()
+
+
+def run_ring_job(graph=None):
+    """find_rings() for the admin API and the periodic job; errors are logged"""
+    try:
+        return (graph or account_graph).find_rings()
+    except RingJobRunning:
+        return None
+    except Exception as e:
+        logger.error(f"Bot ring job failed: {str(e)}")
+        return None
+
+
+if GRAPH_ENABLED and GRAPH_PATH:
+    try:
+        account_graph.load(GRAPH_PATH)
+    except Exception as e:
+        logger.error(f"Could not load account graph: {str(e)}")
+    # Each worker keeps its own copy and merges it with the others' through
+    # the file; only the worker holding the ring lock runs the ring job
+    account_graph.autosave(GRAPH_PATH, GRAPH_SAVE_INTERVAL, GRAPH_RING_INTERVAL)
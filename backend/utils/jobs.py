@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo.errors import PyMongoError
+from config import REPORT_JOB_WORKERS, REPORT_JOB_MAX_PENDING, REPORT_JOB_TTL
+from models import repository
+from models.db import is_available
+from utils.cache import TTLCache
+from utils.gemini import (generate_report, get_cached_report, report_cache_key,
+                          create_fallback_analysis)
+import copy
+import logging
+import threading
+import uuid
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class ReportJobQueue:
+    """
+    Runs generate_report on a bounded worker pool. Identical pending
+    requests (same report_cache_key) share one job. Every state change is
+    also written to the report_jobs collection for job_ttl seconds, so
+    behind several gunicorn workers a poll that reaches another worker
+    still finds the job. Without MongoDB jobs are only known to the worker
+    that accepted them.
+
+    Every job carries an 'analysis' usable at once: the locally built
+    analysis while the report is pending, the report once it is done.
+    """
+
+    def __init__(self, max_workers, max_pending, job_ttl):
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='report-job')
+        self._jobs = TTLCache(maxsize=max(max_pending * 10, 1000), ttl=job_ttl)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    def submit(self, user_data):
+        """
+        Queue a report for user_data and return a snapshot of its job.
+        Raises JobQueueFull when max_pending jobs are already waiting.
+        """
+        key = report_cache_key(user_data)
+        with self._lock:
+            job_id = self._pending.get(key)
+            job = self._jobs.get(job_id) if job_id else None
+            if job is not None:
+                self.deduplicated += 1
+                return copy.deepcopy(job)
+
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'username': user_data.get('screen_name'),
+            'status': 'pending',
+            'report': None,
+            'analysis': None,
+            'error': None,
+            'created_at': datetime.utcnow().isoformat()
+        }
+
+        # Cached reports complete immediately without using a worker
+        report = get_cached_report(user_data)
+        if report is not None:
+            self._jobs.set(job['job_id'], job)
+            self._finish(job, report)
+            return copy.deepcopy(job)
+
+        job['analysis'] = create_fallback_analysis(user_data)
+        with self._lock:
+            # Another request may have queued the same report meanwhile
+            job_id = self._pending.get(key)
+            existing = self._jobs.get(job_id) if job_id else None
+            if existing is not None:
+                self.deduplicated += 1
+                return copy.deepcopy(existing)
+            if len(self._pending) >= self.max_pending:
+                raise JobQueueFull(
+                    f"Too many pending reports (max {self.max_pending})")
+            self._pending[key] = job['job_id']
+            self._jobs.set(job['job_id'], job)
+            self.submitted += 1
+            snapshot = copy.deepcopy(job)
+
+        self._store(snapshot)
+        self._executor.submit(self._run, job, key, user_data)
+        return snapshot
+
+    def get(self, job_id):
+        """Snapshot of a job accepted by any worker, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return copy.deepcopy(job)
+        if not is_available():
+            return None
+        try:
+            return repository.find_report_job(job_id, datetime.utcnow())
+        except PyMongoError as e:
+            logger.warning(f"Could not read report job {job_id}: {str(e)}")
+            return None
+
+    def _store(self, snapshot):
+        if not is_available():
+            return
+        try:
+            repository.save_report_job(
+                snapshot, datetime.utcnow() + timedelta(seconds=self.job_ttl))
+        except PyMongoError as e:
+            logger.warning(f"Could not store report job {snapshot['job_id']}: {str(e)}")
+
+    def _update(self, job, **changes):
+        with self._lock:
+            job.update(changes)
+            snapshot = copy.deepcopy(job)
+        self._store(snapshot)
+
+    def _run(self, job, key, user_data):
+        self._update(job, status='running')
+        try:
+            report = generate_report(user_data)
+            self._finish(job, report)
+        except Exception as e:
+            logger.error(f"Report job {job['job_id']} failed: {str(e)}")
+            with self._lock:
+                self.failed += 1
+            self._update(job, status='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _finish(self, job, report):
+        self._update(job, report=report, analysis=report, status='done',
+                     completed_at=datetime.utcnow().isoformat())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'max_pending': self.max_pending,
+                'submitted': self.submitted,
+                'deduplicated': self.deduplicated,
+                'failed': self.failed
+            }
+
+
+report_jobs = ReportJobQueue(REPORT_JOB_WORKERS, REPORT_JOB_MAX_PENDING,
+                             REPORT_JOB_TTL)
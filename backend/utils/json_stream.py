@@ -0,0 +1,149 @@
+import json
+import time
+
+# Schema notation used by validate() and StreamingJSONParser:
+#   str, bool, NUMBER      a value of that type
+#   {'key': schema, ...}   an object with (at least) these keys
+#   [schema]               a list whose items all match schema
+NUMBER = 'number'
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def validate(value, schema, path='$'):
+    """Raise SchemaError unless value matches schema"""
+    if schema == NUMBER:
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif isinstance(schema, dict):
+        if not isinstance(value, dict):
+            raise SchemaError(f"{path}: expected object")
+        for key, item_schema in schema.items():
+            if key not in value:
+                raise SchemaError(f"{path}.{key}: missing")
+            validate(value[key], item_schema, f"{path}.{key}")
+        return
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            raise SchemaError(f"{path}: expected list")
+        for i, item in enumerate(value):
+            validate(item, schema[0], f"{path}[{i}]")
+        return
+    else:
+        ok = isinstance(value, schema)
+    if not ok:
+        raise SchemaError(f"{path}: expected {getattr(schema, '__name__', schema)}, "
+                          f"got {type(value).__name__}")
+
+
+class StreamingJSONParser:
+    """
+    Incrementally parses one JSON object from LLM output chunks. Text
+    before the opening brace (e.g. a ```json fence) is skipped. Each
+    top-level member is decoded and validated against schema as soon as its
+    value is complete, so a wrong field fails fast, and feed() returns True
+    once every field of schema is present: the caller can stop reading the
+    stream there. Every character is scanned once.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.result = {}
+        self.chars = 0
+        self.parse_seconds = 0.0
+        self.complete = False
+        self._buf = ''
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self._in_value = False
+
+    def _member(self, end):
+        """Decode the member buf[member_start:end] and validate it"""
+        text = self._buf[self._member_start:end].strip()
+        self._member_start = None
+        self._in_value = False
+        if not text:
+            return
+        try:
+            member = json.loads('{' + text + '}')
+        except json.JSONDecodeError as e:
+            raise SchemaError(f"Invalid JSON near: {text[:60]}") from e
+        for key, value in member.items():
+            if key in self.schema:
+                validate(value, self.schema[key], f"$.{key}")
+            self.result[key] = value
+        if all(key in self.result for key in self.schema):
+            self.complete = True
+
+    def feed(self, chunk):
+        """Consume a chunk; returns True once all schema fields are parsed"""
+        if self.complete:
+            return True
+        start = time.perf_counter()
+        self._buf += chunk
+        self.chars += len(chunk)
+        buf = self._buf
+        i = self._pos
+        while i < len(buf) and not self.complete:
+            c = buf[i]
+            if not self._started:
+                if c == '{':
+                    self._started = True
+                    self._depth = 1
+                    self._member_start = i + 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._in_value:
+                        self._member(i + 1)
+            elif c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._in_value:
+                    self._member(i + 1)
+                elif self._depth == 0:
+                    if self._member_start is not None:
+                        self._member(i)
+                    self.complete = all(key in self.result for key in self.schema)
+                    if not self.complete:
+                        self._raise_missing()
+            elif self._depth == 1:
+                if c == ':':
+                    self._in_value = True
+                elif c == ',':
+                    if self._member_start is not None:
+                        self._member(i)
+                    self._member_start = i + 1
+            i += 1
+        self._pos = i
+        self.parse_seconds += time.perf_counter() - start
+        return self.complete
+
+    @property
+    def stopped_early(self):
+        """Complete before the object's closing brace was read"""
+        return self.complete and self._depth > 0
+
+    def _raise_missing(self):
+        missing = [key for key in self.schema if key not in self.result]
+        raise SchemaError(f"Missing fields: {', '.join(missing)}")
+
+    def finish(self):
+        """Result once the stream ended; raises SchemaError if incomplete"""
+        if not self.complete:
+            if not self._started:
+                raise SchemaError("No JSON object in response")
+            self._raise_missing()
+        return self.result
@@ -0,0 +1,324 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (GEMINI_API_KEY, LLM_PROVIDER, LLM_TIMEOUT, LLM_MAX_CONCURRENCY,
+                    LLM_BREAKER_FAILURES, LLM_BREAKER_RESET, LLM_HEDGE_AFTER_MS,
+                    LLM_STUB_LATENCY_MS, LLM_STUB_FAILURE_RATE)
+import json
+import logging
+import random
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """The call was skipped or failed: circuit open, no free slot, deadline or provider error"""
+    pass
+
+
+class ProviderError(Exception):
+    """A failure on the provider's side; code is its HTTP status, like google.api_core errors"""
+
+    def __init__(self, message, code=503):
+        super().__init__(message)
+        self.code = code
+
+
+def trips_breaker(error):
+    """
+    Whether a failed call counts against the circuit breaker: transport
+    errors, timeouts and 5xx responses do. An answer that does not parse or
+    match the schema, or a 4xx (bad request, blocked prompt), says nothing
+    about the provider's health
+    """
+    if isinstance(error, OSError):
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and code >= 500
+
+
+class GeminiProvider:
+    """Gemini through google.generativeai, one GenerativeModel per process"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key=GEMINI_API_KEY, model_name='gemini-pro'):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt, timeout, **options):
+        response = self._get_model().generate_content(
+            prompt, request_options={'timeout': timeout}, **options)
+        return response.text
+
+    def stream(self, prompt, timeout, **options):
+        response = self._get_model().generate_content(
+            prompt, stream=True, request_options={'timeout': timeout}, **options)
+        for chunk in response:
+            yield chunk.text
+
+
+class StubProvider:
+    """
+    Offline stand-in for the LLM: waits latency_ms (+/- 50% jitter), fails
+    with probability failure_rate and otherwise answers a fixed valid report
+    """
+
+    name = 'stub'
+
+    RESPONSE = {
+        "analysisResult": "Stub analysis generated offline.",
+        "keyIndicators": "Stub provider, no model was called.",
+        "accountData": {
+            "accountAge": 0, "totalPosts": 0, "totalComments": 0, "avgResponseTime": 0,
+            "suspiciousActivities": 0, "repeatedPhrases": 0, "similarAccounts": 0,
+            "reportCount": 0
+        },
+        "activityScore": 5.0,
+        "activityMetrics": [
+            {"name": "Normal Activity", "value": 100, "color": "#22c55e"}
+        ],
+        "behaviorPatterns": [
+            {"name": "Stub", "description": "Generated by the stub provider",
+             "isSuspicious": False}
+        ]
+    }
+
+    def __init__(self, latency_ms=LLM_STUB_LATENCY_MS, failure_rate=LLM_STUB_FAILURE_RATE,
+                 seed=None):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    CHUNK_CHARS = 64
+
+    def _draw(self):
+        with self._lock:
+            delay = self.latency_ms * self._random.uniform(0.5, 1.5) / 1000
+            fail = self._random.random() < self.failure_rate
+        return delay, fail
+
+    def generate(self, prompt, timeout, **options):
+        delay, fail = self._draw()
+        time.sleep(min(delay, timeout))
+        if fail:
+            raise ProviderError("Stub provider failure")
+        if delay > timeout:
+            raise TimeoutError("Stub provider timed out")
+        return json.dumps(self.RESPONSE)
+
+    def stream(self, prompt, timeout, **options):
+        """The same response in CHUNK_CHARS pieces spread over the latency"""
+        delay, fail = self._draw()
+        text = json.dumps(self.RESPONSE)
+        pieces = [text[i:i + self.CHUNK_CHARS] for i in range(0, len(text), self.CHUNK_CHARS)]
+        step = delay / len(pieces)
+        elapsed = 0.0
+        for piece in pieces:
+            if elapsed + step > timeout:
+                raise TimeoutError("Stub provider timed out")
+            time.sleep(step)
+            elapsed += step
+            if fail:
+                raise ProviderError("Stub provider failure")
+            yield piece
+
+
+PROVIDERS = {'gemini': GeminiProvider, 'stub': StubProvider}
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After failure_threshold consecutive failures it
+    opens and calls are skipped for reset_timeout seconds; then one trial
+    call is let through (half-open) and its outcome closes or reopens it
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """The allowed call never reached the provider, or its outcome does not count"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opened += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures,
+                    'times_opened': self.opened}
+
+
+class LLMClient:
+    """
+    Calls the provider with a per-call deadline, at most max_concurrency
+    calls in flight and a circuit breaker in front. With hedge_after_ms set,
+    a second identical call is sent when the first is slower than that and
+    a slot is free; the first answer wins. The deadline covers the wait
+    for a slot too. Every failure surfaces as LLMUnavailable so callers can
+    fall back at once, but only those trips_breaker() accepts count
+    against the breaker.
+
+    With parser_factory, the response is streamed (when the provider can)
+    into a fresh parser per call, reading stops as soon as feed() returns
+    True and the parser is returned instead of the text
+    """
+
+    def __init__(self, provider, timeout=LLM_TIMEOUT, max_concurrency=LLM_MAX_CONCURRENCY,
+                 breaker=None, hedge_after_ms=LLM_HEDGE_AFTER_MS):
+        self.provider = provider
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.hedge_after_ms = hedge_after_ms
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+        # Slots are held until the provider call returns, even after the
+        # caller gave up on it, so the provider never sees more than
+        # max_concurrency calls from this process
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='llm-call')
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'succeeded': 0, 'failed': 0, 'timeouts': 0,
+                         'invalid': 0, 'short_circuited': 0, 'rejected': 0, 'hedged': 0}
+        self._latency_total = 0.0
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _call(self, prompt, parser_factory, options, deadline):
+        try:
+            timeout = max(deadline - time.monotonic(), 0.001)
+            if parser_factory is None:
+                return self.provider.generate(prompt, timeout=timeout, **options)
+            parser = parser_factory()
+            if hasattr(self.provider, 'stream'):
+                for chunk in self.provider.stream(prompt, timeout=timeout, **options):
+                    if parser.feed(chunk):
+                        break
+            else:
+                parser.feed(self.provider.generate(prompt, timeout=timeout, **options))
+            parser.finish()
+            return parser
+        finally:
+            self._slots.release()
+
+    def generate(self, prompt, parser_factory=None, **options):
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise LLMUnavailable("Circuit open")
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            self.breaker.release()
+            self._count('rejected')
+            raise LLMUnavailable("No free LLM slot before the deadline")
+        self._count('calls')
+        futures = [self._executor.submit(self._call, prompt, parser_factory, options, deadline)]
+
+        if self.hedge_after_ms:
+            done, _ = wait(futures, timeout=min(self.hedge_after_ms / 1000,
+                                                max(deadline - time.monotonic(), 0)))
+            if not done and self._slots.acquire(blocking=False):
+                self._count('hedged')
+                futures.append(self._executor.submit(self._call, prompt, parser_factory, options,
+                                                     deadline))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    self.breaker.record_success()
+                    with self._lock:
+                        self.counters['succeeded'] += 1
+                        self._latency_total += time.monotonic() - start
+                    return future.result()
+                error = future.exception()
+
+        if error is None:
+            self.breaker.record_failure()
+            self._count('timeouts')
+            raise LLMUnavailable(f"LLM call exceeded {self.timeout}s deadline")
+        if not trips_breaker(error):
+            self.breaker.release()
+            self._count('invalid')
+            raise LLMUnavailable(f"LLM answer rejected: {str(error)}") from error
+        self.breaker.record_failure()
+        self._count('failed')
+        raise LLMUnavailable(f"LLM call failed: {str(error)}") from error
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            latency = self._latency_total
+        return {
+            'provider': self.provider.name,
+            'timeout_s': self.timeout,
+            'max_concurrency': self.max_concurrency,
+            'circuit': self.breaker.stats(),
+            'avg_latency_ms': round(latency * 1000 / counters['succeeded'], 1)
+            if counters['succeeded'] else None,
+            **counters
+        }
+
+
+def create_client(provider=LLM_PROVIDER, **kwargs):
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {provider}")
+    return LLMClient(PROVIDERS[provider](), **kwargs)
+
+
+llm_client = create_client()
@@ -0,0 +1,366 @@
+from config import (SIMILARITY_ENABLED, SIMILARITY_INDEX_PATH, SIMILARITY_NUM_PERM,
+                    SIMILARITY_BANDS, SIMILARITY_THRESHOLD, SIMILARITY_MAX_BUCKET,
+                    SIMILARITY_SAVE_INTERVAL)
+import atexit
+import fcntl
+import logging
+import numpy as np
+import os
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_SHIFT32 = np.uint64(32)
+# Shingles hashed per step when signing, bounds the (num_perm, n) temporary
+_SIGN_CHUNK = 4096
+
+
+class MinHashIndex:
+    """
+    MinHash signatures of accounts' text in an LSH index.
+
+    A signature is num_perm uint32 minimums of multiply-shift hashes of the
+    account's word n-gram hashes (see features.ngram_hashes); the fraction
+    of equal positions in two signatures estimates the Jaccard similarity
+    of their n-gram sets. Signatures are cut into bands of num_perm / bands
+    rows; accounts sharing any band key are candidates, so with the
+    defaults (64 / 16) pairs above ~0.5 similarity are found with high
+    probability while a lookup reads a handful of buckets.
+
+    Storage is array-backed: per account one signature row, one row of
+    band keys (uint32) and, per band, a sorted (key, id) column searched
+    with np.searchsorted. Accounts changed since the last rebuild of the
+    sorted columns are kept in a small pending set and scanned directly.
+    That is about 4 * num_perm + 16 * bands bytes per account (384 with the
+    defaults) plus its username
+    """
+
+    def __init__(self, num_perm=SIMILARITY_NUM_PERM, bands=SIMILARITY_BANDS,
+                 max_bucket=SIMILARITY_MAX_BUCKET, seed=1, capacity=1024):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_bucket = max_bucket
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Odd 64-bit multipliers for multiply-shift hashing
+        self._a = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self._band_mult = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + \
+            np.uint64(1)
+        self._lock = threading.RLock()
+        self._autosave = None
+        self._autosave_pid = None
+        self._file_signature = None
+        self._reset(capacity)
+
+    def _reset(self, capacity):
+        self.size = 0
+        self.names = []
+        self._ids = {}
+        self.signatures = np.zeros((capacity, self.num_perm), dtype=np.uint32)
+        self.band_keys = np.zeros((capacity, self.bands), dtype=np.uint32)
+        self.repeated = np.zeros(capacity, dtype=np.uint32)
+        self.updated = np.zeros(capacity, dtype=np.uint32)
+        self._sorted_keys = np.zeros((self.bands, 0), dtype=np.uint32)
+        self._sorted_ids = np.zeros((self.bands, 0), dtype=np.uint32)
+        self._pending = set()
+        self.dirty = False
+        self.rebuilds = 0
+
+    def signature(self, hashes):
+        """MinHash signature (uint32, num_perm) of a set of uint32 hashes, or None"""
+        hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+        if not hashes.size:
+            return None
+        signature = np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        for start in range(0, hashes.size, _SIGN_CHUNK):
+            x = hashes[start:start + _SIGN_CHUNK]
+            # (a * x + b) mod 2^64, top 32 bits: a universal hash family
+            h = ((self._a[:, None] * x[None, :] + self._b[:, None]) >> _SHIFT32).astype(np.uint32)
+            np.minimum(signature, h.min(axis=1), out=signature)
+        return signature
+
+    def _band_keys(self, signatures):
+        products = signatures.astype(np.uint64) * self._band_mult
+        sums = products.reshape(-1, self.bands, self.rows).sum(axis=2, dtype=np.uint64)
+        return (sums >> _SHIFT32).astype(np.uint32)
+
+    def _grow(self):
+        capacity = max(len(self.signatures) * 2, 1024)
+        for name in ('signatures', 'band_keys', 'repeated', 'updated'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _rebuild(self):
+        keys = self.band_keys[:self.size].T
+        order = np.argsort(keys, axis=1, kind='stable')
+        self._sorted_keys = np.take_along_axis(keys, order, axis=1)
+        self._sorted_ids = order.astype(np.uint32)
+        self._pending.clear()
+        self.rebuilds += 1
+
+    def update(self, username, hashes, repeated=None, merge=True):
+        """
+        Index the n-gram hashes of username's text. With merge the new
+        signature is combined with the stored one (element-wise minimum,
+        the signature of the union), so incremental scans that only see
+        new items still describe everything seen. Returns the account id,
+        or None when there was no text
+        """
+        signature = self.signature(hashes)
+        self._ensure_autosave()
+        with self._lock:
+            key = username.lower()
+            account = self._ids.get(key)
+            if signature is None:
+                if account is not None and repeated is not None:
+                    self.repeated[account] = repeated
+                return account
+            if account is None:
+                if self.size == len(self.signatures):
+                    self._grow()
+                account = self.size
+                self.size += 1
+                self.names.append(username)
+                self._ids[key] = account
+            elif merge:
+                signature = np.minimum(signature, self.signatures[account])
+            self.signatures[account] = signature
+            self.band_keys[account] = self._band_keys(signature[None, :])[0]
+            if repeated is not None:
+                self.repeated[account] = repeated
+            self.updated[account] = int(time.time())
+            self._pending.add(account)
+            self.dirty = True
+            if len(self._pending) > max(4096, self.size // 20):
+                self._rebuild()
+            return account
+
+    def _candidates(self, keys):
+        found = []
+        for band in range(self.bands):
+            column = self._sorted_keys[band]
+            lo = np.searchsorted(column, keys[band], side='left')
+            hi = np.searchsorted(column, keys[band], side='right')
+            found.append(self._sorted_ids[band, lo:min(hi, lo + self.max_bucket)])
+        if self._pending:
+            pending = np.fromiter(self._pending, dtype=np.uint32, count=len(self._pending))
+            found.append(pending[(self.band_keys[pending] == keys).any(axis=1)])
+        ids = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.uint32)
+        # Sorted columns may still hold an account's keys from before its
+        # last update
+        return ids[(self.band_keys[ids] == keys).any(axis=1)]
+
+    def similar(self, username, threshold=SIMILARITY_THRESHOLD, limit=20):
+        """
+        [(username, estimated Jaccard similarity)] of indexed accounts at or
+        above threshold, most similar first; None if username is not indexed
+        """
+        self._ensure_autosave()
+        with self._lock:
+            account = self._ids.get(username.lower())
+            if account is None:
+                return None
+            signature = self.signatures[account]
+            ids = self._candidates(self.band_keys[account])
+            ids = ids[ids != account]
+            similarity = (self.signatures[ids] == signature).mean(axis=1)
+            keep = similarity >= threshold
+            ids, similarity = ids[keep], similarity[keep]
+            order = np.argsort(-similarity, kind='stable')[:limit]
+            return [(self.names[i], round(float(similarity[j]), 3))
+                    for j, i in zip(order, ids[order])]
+
+    def lookup(self, username, threshold=SIMILARITY_THRESHOLD):
+        """{'repeatedPhrases', 'similarAccounts'} for username, or None if not indexed"""
+        similar = self.similar(username, threshold, limit=self.size)
+        if similar is None:
+            return None
+        with self._lock:
+            repeated = int(self.repeated[self._ids[username.lower()]])
+        return {'repeatedPhrases': repeated, 'similarAccounts': len(similar)}
+
+    def save(self, path, merge=True):
+        """
+        Write the index to path (.npz) atomically. With merge, accounts
+        already in the file are merged in first (see merge_file), all under
+        an exclusive lock on path.lock, so processes sharing the file add
+        to it rather than overwrite each other
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if merge:
+                self.merge_file(path)
+            with self._lock:
+                n = self.size
+                arrays = {
+                    'signatures': self.signatures[:n].copy(),
+                    'band_keys': self.band_keys[:n].copy(),
+                    'repeated': self.repeated[:n].copy(),
+                    'updated': self.updated[:n].copy(),
+                    'names': np.frombuffer('\n'.join(self.names).encode('utf-8'),
+                                           dtype=np.uint8),
+                    'meta': np.array([self.num_perm, self.bands, self.seed], dtype=np.int64)
+                }
+                self.dirty = False
+            tmp = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp, **arrays)
+            os.replace(tmp, path)
+            self._file_signature = _file_signature(path)
+        return n
+
+    def _read(self, path):
+        """(names, arrays) of a save() file; None if missing or incompatible"""
+        if not path or not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if tuple(data['meta']) != (self.num_perm, self.bands, self.seed):
+                logger.warning(f"Ignoring similarity index {path}: built with other parameters")
+                return None
+            arrays = {name: data[name] for name in
+                      ('signatures', 'band_keys', 'repeated', 'updated')}
+            names = bytes(data['names']).decode('utf-8').split('\n') \
+                if len(arrays['signatures']) else []
+        return names, arrays
+
+    def merge_file(self, path):
+        """
+        Merge the accounts of a save() file (another process's copy) into
+        this index: new accounts are added, known ones get the union of
+        both signatures, as update(merge=True) would. Returns the number of
+        accounts added or changed
+        """
+        signature = _file_signature(path)
+        loaded = self._read(path)
+        if loaded is None:
+            return 0
+        names, arrays = loaded
+        with self._lock:
+            ids = np.array([self._ids.get(name.lower(), -1) for name in names], dtype=np.int64)
+            known = ids >= 0
+            both = ids[known]
+            merged = np.minimum(self.signatures[both], arrays['signatures'][known])
+            changed = (merged != self.signatures[both]).any(axis=1)
+            accounts, merged = both[changed], merged[changed]
+            self.signatures[accounts] = merged
+            self.band_keys[accounts] = self._band_keys(merged)
+            self.repeated[both] = np.maximum(self.repeated[both], arrays['repeated'][known])
+            self.updated[both] = np.maximum(self.updated[both], arrays['updated'][known])
+
+            new = np.flatnonzero(~known)
+            while self.size + len(new) > len(self.signatures):
+                self._grow()
+            rows = np.arange(self.size, self.size + len(new))
+            for name in ('signatures', 'band_keys', 'repeated', 'updated'):
+                getattr(self, name)[rows] = arrays[name][new]
+            for row, i in zip(rows, new):
+                self.names.append(names[i])
+                self._ids[names[i].lower()] = int(row)
+            self.size += len(new)
+            if len(accounts) or len(new):
+                self._rebuild()
+            self._file_signature = signature
+        return int(len(accounts) + len(new))
+
+    def load(self, path):
+        """Replace the contents with a save() file; False if missing or incompatible"""
+        signature = _file_signature(path) if path else None
+        loaded = self._read(path)
+        if loaded is None:
+            return False
+        names, data = loaded
+        n = len(data['signatures'])
+        with self._lock:
+            self._reset(max(n, 1024))
+            self.signatures[:n] = data['signatures']
+            self.band_keys[:n] = data['band_keys']
+            self.repeated[:n] = data['repeated']
+            self.updated[:n] = data['updated']
+            self.size = n
+            self.names = names
+            self._ids = {name.lower(): i for i, name in enumerate(names)}
+            self._rebuild()
+            self._file_signature = signature
+        logger.info(f"Loaded similarity index with {n} accounts from {path}")
+        return True
+
+    def autosave(self, path, interval):
+        """
+        Save to path every interval seconds and at exit, merging with what
+        other processes saved there, and merge their new accounts in when
+        the file changes. The thread starts on first use in each process,
+        so every preforked gunicorn worker runs its own
+        """
+        self._autosave = (path, interval)
+
+    def _ensure_autosave(self):
+        if self._autosave is None or self._autosave_pid == os.getpid():
+            return
+        with self._lock:
+            if self._autosave_pid == os.getpid():
+                return
+            self._autosave_pid = os.getpid()
+        path, interval = self._autosave
+        threading.Thread(target=self._save_periodically, args=(path, interval), daemon=True,
+                         name='similarity-save').start()
+        atexit.register(self._save_at_exit, path, os.getpid())
+
+    def _save_periodically(self, path, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                if self.dirty:
+                    self.save(path)
+                elif _file_signature(path) != self._file_signature:
+                    self.merge_file(path)
+            except Exception as e:
+                logger.error(f"Could not save similarity index: {str(e)}")
+
+    def _save_at_exit(self, path, pid):
+        # atexit handlers are inherited by forked children
+        if pid == os.getpid() and self.dirty:
+            self.save(path)
+
+    def stats(self):
+        with self._lock:
+            n = self.size
+            return {
+                'accounts': n,
+                'num_perm': self.num_perm,
+                'bands': self.bands,
+                'pending': len(self._pending),
+                'rebuilds': self.rebuilds,
+                'array_bytes': int(self.signatures[:n].nbytes + self.band_keys[:n].nbytes +
+                                   self.repeated[:n].nbytes + self.updated[:n].nbytes +
+                                   self._sorted_keys.nbytes + self._sorted_ids.nbytes)
+            }
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+similarity_index = MinHashIndex()
+
+if SIMILARITY_ENABLED and SIMILARITY_INDEX_PATH:
+    try:
+        similarity_index.load(SIMILARITY_INDEX_PATH)
+    except Exception as e:
+        logger.error(f"Could not load similarity index: {str(e)}")
+    # Each worker keeps its own copy and merges it with the others' through
+    # the file, so a lookup sees accounts other workers scanned within
+    # SIMILARITY_SAVE_INTERVAL
+    similarity_index.autosave(SIMILARITY_INDEX_PATH, SIMILARITY_SAVE_INTERVAL)
@@ -0,0 +1,185 @@
+from config import (FEATURE_ACTIVITY_LIMIT, FEATURE_STORE_ENABLED, FEATURE_STORE_MAX_NEW_ITEMS,
+                    PREDICT_CACHE_ENABLED, PREDICT_CACHE_SIZE, PREDICT_CACHE_MAX_BYTES,
+                    PREDICT_CACHE_FRESH_TTL, PREDICT_CACHE_STALE_TTL,
+                    PREDICT_CACHE_REFRESH_WORKERS, SIMILARITY_ENABLED, GRAPH_ENABLED,
+                    BATCH_SCORE_CHUNK_SIZE, BATCH_SCORE_MAX_WAIT)
+from models import feature_store
+from utils.reddit_api import iter_reddit_users_details, get_user_activity, FetchError
+from utils.preprocessing import preprocess_batch
+from utils.features import (summarize_activity, merge_stats, compute_features, feature_timer,
+                            item_texts, ngram_hashes, repeated_ngrams)
+from utils.minhash import similarity_index
+from utils.graph import account_graph
+from utils.result_cache import StaleWhileRevalidateCache, MISS, COALESCED
+from utils.singleflight import create_flight
+import logging
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+predict_cache = StaleWhileRevalidateCache(
+    PREDICT_CACHE_SIZE, PREDICT_CACHE_MAX_BYTES, PREDICT_CACHE_FRESH_TTL,
+    PREDICT_CACHE_STALE_TTL, PREDICT_CACHE_REFRESH_WORKERS) if PREDICT_CACHE_ENABLED else None
+# Without the cache, concurrent predictions of one user still run once.
+# Kept in-process: scoring is cheap next to the fetch it waits on
+predict_flight = create_flight('predict', distributed=False)
+
+
+def get_predict_cache_stats():
+    return predict_cache.stats() if predict_cache is not None else None
+
+
+def cached_prediction(registry, username, compute):
+    """
+    (result, cache status) of compute() for username. Results are keyed by
+    username and the model version that scores it, so a reload, promotion
+    or rollback starts from a cold entry. compute runs without a request
+    context when it refreshes a stale entry in the background
+    """
+    key = (username.lower(), registry.version_for(username))
+    if predict_cache is None:
+        result, shared = predict_flight.do(key, compute)
+        return result, COALESCED if shared else MISS
+    return predict_cache.get_or_compute(key, compute)
+
+
+def normalize_usernames(usernames):
+    """
+    Strip blanks and drop duplicates (case-insensitive) while keeping the
+    order in which the usernames were submitted
+    """
+    seen = set()
+    result = []
+    for username in usernames:
+        if not isinstance(username, str):
+            continue
+        username = username.strip()
+        if username and username.lower() not in seen:
+            seen.add(username.lower())
+            result.append(username)
+    return result
+
+
+def build_features(user_data):
+    """
+    Compute the extended feature vector for one user. Returns (float32
+    vector, {stage: milliseconds}) where the stages are the feature store
+    lookup, the Reddit fetch, each feature group, the similarity index and
+    the account graph.
+
+    With the feature store enabled a rescan only fetches activity newer
+    than the stored cursor and merges it into the stored aggregates; the
+    new text is merged into the user's MinHash signature and the new
+    activity added to the account graph the same way
+    """
+    username = user_data.get("name") or user_data["screen_name"]
+    timings = {}
+
+    start = time.perf_counter()
+    entry = feature_store.load(username) if FEATURE_STORE_ENABLED else None
+    timings["store"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if entry:
+        items = get_user_activity(username, limit=FEATURE_STORE_MAX_NEW_ITEMS,
+                                  since=entry["cursor"], seen_ids=entry["recent_ids"])
+    else:
+        items = get_user_activity(username, limit=FEATURE_ACTIVITY_LIMIT)
+    timings["fetch"] = (time.perf_counter() - start) * 1000
+
+    stats = summarize_activity(items, timings)
+    if entry:
+        stats = merge_stats(entry["stats"], stats)
+    features = compute_features(user_data, stats, timings)
+
+    if SIMILARITY_ENABLED:
+        start = time.perf_counter()
+        similarity_index.update(username, ngram_hashes(item_texts(items)), repeated_ngrams(stats))
+        timings["similarity"] = (time.perf_counter() - start) * 1000
+
+    if GRAPH_ENABLED:
+        start = time.perf_counter()
+        account_graph.add_activity(username, items, user_data.get("bot_probability"))
+        if SIMILARITY_ENABLED:
+            account_graph.add_similar(username, similarity_index.similar(username) or [])
+        timings["graph"] = (time.perf_counter() - start) * 1000
+
+    if FEATURE_STORE_ENABLED and (items or not entry):
+        start = time.perf_counter()
+        newest = sorted(items, key=lambda item: item["created_utc"], reverse=True)
+        recent_ids = [item["id"] for item in newest] + (entry["recent_ids"] if entry else [])
+        feature_store.save(username, stats, stats["last_ts"], recent_ids,
+                           entry["version"] if entry else 0)
+        timings["store"] += (time.perf_counter() - start) * 1000
+
+    logger.info(f"Feature scan for {username}: {len(items)} new items"
+                f"{' (incremental)' if entry else ''}")
+    feature_timer.record(timings)
+    return features, timings
+
+
+def score_users(registry, users):
+    """
+    Score a list of user_data dicts with one vectorized predict call
+    through the model registry. Returns (labels, bot_probabilities,
+    model_versions); probabilities are None when the model does not
+    support predict_proba
+    """
+    features = preprocess_batch(users)
+    labels, probabilities, versions = registry.score(
+        features, [user["screen_name"] for user in users])
+    if GRAPH_ENABLED and probabilities is not None:
+        for user, probability in zip(users, probabilities):
+            account_graph.set_score(user["screen_name"], float(probability))
+    return labels, probabilities, versions
+
+
+def iter_batch_predictions(registry, usernames, chunk_size=BATCH_SCORE_CHUNK_SIZE,
+                           max_wait=BATCH_SCORE_MAX_WAIT):
+    """
+    Fetch every profile concurrently (cached users are not refetched) and
+    yield one dict per username as results come in: lookup failures right
+    away (404 for users that do not exist, 502/503 when Reddit failed),
+    found users scored chunk_size at a time with one predict call per
+    chunk, or sooner once the first of them has waited max_wait seconds
+    """
+    found = []
+    waiting_since = None
+    for username, user_data in iter_reddit_users_details(usernames):
+        if isinstance(user_data, FetchError):
+            yield {"screen_name": username, "error": f"Reddit lookup failed: {str(user_data)}",
+                   "status": user_data.status}
+        elif not user_data:
+            yield {"screen_name": username, "error": "User not found", "status": 404}
+        else:
+            if not found:
+                waiting_since = time.monotonic()
+            found.append(user_data)
+        if found and (len(found) >= chunk_size or
+                      time.monotonic() - waiting_since >= max_wait):
+            yield from _score_chunk(registry, found)
+            found = []
+    if found:
+        yield from _score_chunk(registry, found)
+
+
+def _score_chunk(registry, users):
+    try:
+        labels, probabilities, versions = score_users(registry, users)
+    except Exception as e:
+        logger.error(f"Batch inference error: {str(e)}")
+        for user_data in users:
+            yield {"screen_name": user_data["screen_name"], "error": str(e), "status": 500}
+        return
+
+    for i, user_data in enumerate(users):
+        result = {
+            **user_data,
+            "is_bot": bool(labels[i]),
+            "model_version": versions[i]
+        }
+        if probabilities is not None:
+            result["bot_probability"] = float(probabilities[i])
+        yield result
@@ -1,6 +1,19 @@
+import numpy as np
+
+
 def preprocess_data(input_data):
     return [
         input_data.get("post_karma", 0),
         input_data.get("comment_karma", 0),
         input_data.get("listed_count", 0)
     ]
+
+
+def preprocess_batch(users):
+    """
+    Build a single feature matrix (one row per user) so the model can
+    score a whole batch with one vectorized predict call
+    """
+    if not users:
+        return np.empty((0, 3), dtype=np.float64)
+    return np.array([preprocess_data(user) for user in users], dtype=np.float64)
@@ -0,0 +1,83 @@
+from datetime import datetime
+from string import Template
+from utils.json_stream import NUMBER
+import json
+
+# Fields the LLM must return. Confidence and metric fields are not asked
+# for: they come from the model (gemini.model_scores)
+REPORT_SCHEMA = {
+    'analysisResult': str,
+    'keyIndicators': str,
+    'accountData': {
+        'accountAge': NUMBER,
+        'totalPosts': NUMBER,
+        'totalComments': NUMBER,
+        'avgResponseTime': NUMBER,
+        'suspiciousActivities': NUMBER,
+        'repeatedPhrases': NUMBER,
+        'similarAccounts': NUMBER,
+        'reportCount': NUMBER
+    },
+    'activityScore': NUMBER,
+    'activityMetrics': [{'name': str, 'value': NUMBER, 'color': str}],
+    'behaviorPatterns': [{'name': str, 'description': str, 'isSuspicious': bool}]
+}
+
+# Long lists add tokens without changing the analysis
+MAX_LIST_ITEMS = 10
+
+
+def _schema_hint(schema):
+    """Compact one-line rendering of a schema, e.g. {"a":str,"b":[{"c":num}]}"""
+    if schema == NUMBER:
+        return 'num'
+    if isinstance(schema, dict):
+        return '{' + ','.join(f'"{key}":{_schema_hint(value)}'
+                              for key, value in schema.items()) + '}'
+    if isinstance(schema, list):
+        return '[' + _schema_hint(schema[0]) + ']'
+    return schema.__name__
+
+
+# Built once at import; build_report_prompt only substitutes the user line
+_REPORT_TEMPLATE = Template(
+    "Explain the bot detection result for this Reddit account. Reply with one JSON object only, "
+    "no prose, matching: " + _schema_hint(REPORT_SCHEMA).replace('$', '$$') + ". "
+    "accountAge in days, avgResponseTime in seconds, activityScore 0-10, "
+    "activityMetrics values are percentages summing to 100, colors hex. "
+    "Keep strings under 200 characters.\n"
+    "User: $user"
+)
+
+
+def prompt_fields(user_data, now=None):
+    """
+    The only user fields that go into the prompt. report_cache_key() hashes
+    exactly this dict
+    """
+    now = now if now is not None else datetime.utcnow().timestamp()
+    cake_day = user_data.get('cake_day')
+    probability = user_data.get('bot_probability')
+    return {
+        'name': user_data.get('screen_name'),
+        'verified': bool(user_data.get('verified')),
+        'post_karma': user_data.get('post_karma', 0),
+        'comment_karma': user_data.get('comment_karma', 0),
+        'activity': user_data.get('listed_count', 0),
+        'age_days': int((now - cake_day) / 86400) if cake_day else None,
+        'achievements': list(user_data.get('achievements', []))[:MAX_LIST_ITEMS],
+        'trophies': list(user_data.get('trophy_case', []))[:MAX_LIST_ITEMS],
+        'model': 'bot' if user_data.get('is_bot') else 'human',
+        'bot_probability': None if probability is None else round(float(probability), 2)
+    }
+
+
+def build_report_prompt(fields):
+    """Prompt for the fields returned by prompt_fields()"""
+    return _REPORT_TEMPLATE.substitute(
+        user=json.dumps(fields, separators=(',', ':'), default=str))
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English/JSON)"""
+    return (len(text) + 3) // 4
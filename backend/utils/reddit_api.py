@@ -1,5 +1,14 @@
 import praw
-from config import REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT
+from prawcore.exceptions import NotFound, RequestException, ResponseException, TooManyRequests
+from config import (REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT,
+                    REDDIT_CACHE_SIZE, REDDIT_CACHE_TTL, REDDIT_CACHE_NEGATIVE_TTL,
+                    REDDIT_ASYNC_ENABLED, BATCH_FETCH_WORKERS)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.cache import TTLCache
+from utils.singleflight import create_flight
+from utils import reddit_async
+from utils.reddit_async import FetchError
+import copy
 import logging
 
 # Set up logging
@@ -18,32 +27,261 @@ except Exception as e:
     logger.error(f"Failed to initialize Reddit API: {str(e)}")
     raise
 
+# Profile cache keyed by lowercased username. Users that do not exist are
+# cached as _NOT_FOUND with a shorter TTL so repeated lookups of a bad
+# name do not spend rate limit either.
+_MISSING = object()
+_NOT_FOUND = object()
+user_cache = TTLCache(maxsize=REDDIT_CACHE_SIZE, ttl=REDDIT_CACHE_TTL)
+# Concurrent lookups of an uncached user share one API call
+fetch_flight = create_flight('reddit_fetch')
+
+
+def get_cache_stats():
+    return user_cache.stats()
+
+
+def _fetch_reddit_user_details(username):
+    user = reddit.redditor(username)
+
+    # Test if user exists by accessing a property
+    user.name  # This will raise an exception if user doesn't exist
+
+    return {
+        "screen_name": username,
+        "name": user.name,
+        "verified": user.verified,
+        "listed_count": user.comment_karma + user.link_karma,
+        "post_karma": user.link_karma,
+        "comment_karma": user.comment_karma,
+        "cake_day": user.created_utc,
+        "achievements": ["Popular Post", "Buzz-Worthy Post"],
+        "trophy_case": ["Four-Year Club", "Verified Email"],
+        "profile_image": user.icon_img if hasattr(user, 'icon_img') else None
+    }
+
+
+def _as_requested(user_data, username):
+    """
+    Copy of a cached user_data for a caller: callers annotate the dict,
+    and screen_name echoes the caller's spelling, not that of whoever
+    filled the cache
+    """
+    user_data = copy.deepcopy(user_data)
+    user_data["screen_name"] = username
+    return user_data
+
+
 def get_reddit_user_details(username):
+    try:
+        return _lookup_user(username)
+    except FetchError:
+        return None
+
+
+def _lookup_user(username):
+    """
+    user_data from the profile cache or Reddit, None if the user does not
+    exist; raises FetchError when the lookup failed
+    """
+    key = username.lower()
+    cached = user_cache.get(key, _MISSING)
+    if cached is _NOT_FOUND:
+        return None
+    if cached is not _MISSING:
+        return _as_requested(cached, username)
+
+    user_data, _ = fetch_flight.do(key, lambda: _load_user(username))
+    return _as_requested(user_data, username) if user_data else None
+
+
+def _load_user(username):
+    """Fetch a user into the profile cache; user_data or None"""
+    key = username.lower()
     try:
         logger.info(f"Fetching details for user: {username}")
-        user = reddit.redditor(username)
-        
-        # Test if user exists by accessing a property
-        user.name  # This will raise an exception if user doesn't exist
-        
-        return {
-            "screen_name": username,
-            "name": user.name,
-            "verified": user.verified,
-            "listed_count": user.comment_karma + user.link_karma,
-            "post_karma": user.link_karma,
-            "comment_karma": user.comment_karma,
-            "cake_day": user.created_utc,
-            "achievements": ["Popular Post", "Buzz-Worthy Post"],
-            "trophy_case": ["Four-Year Club", "Verified Email"],
-            "profile_image": user.icon_img if hasattr(user, 'icon_img') else None
-        }
-    except praw.exceptions.NotFound:
+        user_data = _fetch_reddit_user_details(username)
+    except NotFound:
         logger.error(f"User not found: {username}")
+        user_cache.set(key, _NOT_FOUND, ttl=REDDIT_CACHE_NEGATIVE_TTL)
         return None
-    except praw.exceptions.RedditAPIException as e:
+    except TooManyRequests as e:
+        logger.error(f"Reddit rate limit hit for user {username}: {str(e)}")
+        raise FetchError(str(e), status=503)
+    except RequestException as e:
+        logger.error(f"Could not reach Reddit for user {username}: {str(e)}")
+        raise FetchError(str(e), status=503)
+    except (ResponseException, praw.exceptions.RedditAPIException) as e:
         logger.error(f"Reddit API error for user {username}: {str(e)}")
-        return None
+        raise FetchError(str(e))
     except Exception as e:
         logger.error(f"Unexpected error fetching user {username}: {str(e)}")
-        return None
+        raise FetchError(str(e))
+
+    user_cache.set(key, user_data)
+    return user_data
+
+
+def get_user_activity(username, limit=100, since=None, seen_ids=()):
+    """
+    Most recent submissions and comments of a user (up to limit of each),
+    as plain dicts for utils.features. With since (a created_utc cursor)
+    the newest-first listings are only read until they reach items older
+    than the cursor, so a rescan costs O(new items). seen_ids skips items
+    at the cursor that were already counted. Returns [] if the listing fails
+    """
+    seen_ids = set(seen_ids)
+    try:
+        user = reddit.redditor(username)
+        items = []
+        for submission in user.submissions.new(limit=limit):
+            if since is not None and submission.created_utc < since:
+                break
+            if submission.fullname in seen_ids:
+                continue
+            items.append({
+                "id": submission.fullname,
+                "kind": "submission",
+                "created_utc": submission.created_utc,
+                "text": f"{submission.title}\n{submission.selftext}".strip(),
+                "subreddit": submission.subreddit.display_name
+            })
+        for comment in user.comments.new(limit=limit):
+            if since is not None and comment.created_utc < since:
+                break
+            if comment.fullname in seen_ids:
+                continue
+            items.append({
+                "id": comment.fullname,
+                "kind": "comment",
+                "created_utc": comment.created_utc,
+                "text": comment.body,
+                "subreddit": comment.subreddit.display_name,
+                "link_id": comment.link_id
+            })
+        return items
+    except Exception as e:
+        logger.error(f"Error fetching activity for user {username}: {str(e)}")
+        return []
+
+
+def iter_subreddit_items(subreddit, start, end, kind):
+    """
+    Stream the submissions or comments (kind) of a subreddit created in
+    [start, end] (epoch seconds), newest first, as small dicts. Listings are
+    read page by page and reading stops at the first item older than
+    start. Reddit only serves about the newest 1000 items of a listing, so
+    on busy subreddits a long window is cut short
+    """
+    sub = reddit.subreddit(subreddit)
+    listing = sub.new(limit=None) if kind == "submission" else sub.comments(limit=None)
+    for item in listing:
+        if item.created_utc < start:
+            break
+        if item.created_utc > end:
+            continue
+        yield {
+            "id": item.fullname,
+            "kind": kind,
+            "author": item.author.name if item.author is not None else None,
+            "created_utc": item.created_utc
+        }
+
+
+def stream_subreddit_comments(subreddit, skip_existing=True):
+    """
+    Follow the comment stream of a subreddit (PRAW polls it and backs off
+    while it is quiet), yielding each new comment as a small dict, and
+    None after a poll with nothing new. Runs until the caller stops
+    iterating
+    """
+    stream = reddit.subreddit(subreddit).stream.comments(skip_existing=skip_existing,
+                                                         pause_after=0)
+    for comment in stream:
+        if comment is None:
+            yield None
+            continue
+        yield {
+            "id": comment.fullname,
+            "author": comment.author.name if comment.author is not None else None,
+            "created_utc": comment.created_utc,
+            "body": comment.body,
+            "subreddit": comment.subreddit.display_name,
+            "link_id": comment.link_id
+        }
+
+
+def _lookup_or_error(username):
+    try:
+        return _lookup_user(username)
+    except FetchError as e:
+        return e
+
+
+def _iter_with_threads(usernames):
+    workers = max(1, min(BATCH_FETCH_WORKERS, len(usernames)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_lookup_or_error, username): username
+                   for username in usernames}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def get_reddit_users_details(usernames):
+    """
+    Bulk variant of get_reddit_user_details. Returns {username: user_data,
+    None if the user does not exist, or the FetchError of a failed lookup}
+    """
+    return dict(iter_reddit_users_details(usernames))
+
+
+def iter_reddit_users_details(usernames):
+    """
+    Look up many users, yielding (username, result) as each lookup
+    completes, with results as in get_reddit_users_details. Cached users
+    come first, the rest are fetched concurrently by the async fetcher;
+    users it could not reach or authenticate for are retried through PRAW
+    """
+    misses = []
+    for username in usernames:
+        cached = user_cache.get(username.lower(), _MISSING)
+        if cached is _NOT_FOUND:
+            yield username, None
+        elif cached is not _MISSING:
+            yield username, _as_requested(cached, username)
+        else:
+            misses.append(username)
+
+    if not misses:
+        return
+    if not REDDIT_ASYNC_ENABLED:
+        yield from _iter_with_threads(misses)
+        return
+
+    logger.info(f"Fetching details for {len(misses)} users")
+    retry = []
+    pending = set(misses)
+    try:
+        for username, user_data in reddit_async.iter_users(misses):
+            pending.discard(username)
+            if isinstance(user_data, reddit_async.UserNotFound):
+                logger.error(f"User not found: {username}")
+                user_cache.set(username.lower(), _NOT_FOUND,
+                               ttl=REDDIT_CACHE_NEGATIVE_TTL)
+                yield username, None
+            elif isinstance(user_data, FetchError):
+                logger.error(f"Could not fetch user {username}: {str(user_data)}")
+                if user_data.fallback:
+                    retry.append(username)
+                else:
+                    yield username, user_data
+            else:
+                user_cache.set(username.lower(), user_data)
+                yield username, _as_requested(user_data, username)
+    except Exception as e:
+        logger.error(f"Async fetch failed, falling back to PRAW: {str(e)}")
+        retry.extend(username for username in misses if username in pending)
+
+    if retry:
+        logger.info(f"Retrying {len(retry)} users through PRAW")
+        yield from _iter_with_threads(retry)
@@ -0,0 +1,309 @@
+import aiohttp
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import quote
+from config import (REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT,
+                    REDDIT_AUTH_URL, REDDIT_API_BASE, REDDIT_ASYNC_CONCURRENCY,
+                    REDDIT_REQUESTS_PER_MINUTE, REDDIT_REQUEST_TIMEOUT)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3
+# Reddit usernames: 3-20 letters, digits, '-' or '_' (some early accounts
+# are shorter)
+USERNAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,20}$')
+
+
+class UserNotFound(Exception):
+    pass
+
+
+class FetchError(Exception):
+    """
+    A lookup that failed without telling whether the user exists. status
+    is the HTTP status to report for it (503 when Reddit rate limited us
+    or could not be reached, 502 for an error response); with fallback the
+    lookup is worth retrying through PRAW (auth or transport failures)
+    """
+
+    def __init__(self, message, status=502, fallback=False):
+        super().__init__(message)
+        self.status = status
+        self.fallback = fallback
+
+
+def _as_fetch_error(error):
+    if isinstance(error, (UserNotFound, FetchError)):
+        return error
+    if isinstance(error, aiohttp.ClientResponseError):
+        return FetchError(f"Reddit returned {error.status}",
+                          status=503 if error.status == 429 else 502)
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return FetchError(f"Reddit unreachable: {error!r}", status=503, fallback=True)
+    return FetchError(f"Unexpected error: {error!r}", fallback=True)
+
+
+class TokenBucket:
+    """
+    Async token bucket. The refill rate starts at the configured requests
+    per minute and is re-derived from Reddit's X-Ratelimit-* headers after
+    every response, so the remaining budget is spread over the rest of the
+    rate-limit window instead of being burnt at the start of it.
+    """
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update_from_headers(self, headers):
+        try:
+            remaining = float(headers['X-Ratelimit-Remaining'])
+            reset = float(headers['X-Ratelimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        self._refill()
+        if remaining < 1:
+            self._paused_until = time.monotonic() + reset
+            self.tokens = 0
+            return
+        self.rate = max(remaining / max(reset, 1.0), 0.01)
+        self.tokens = min(self.tokens, remaining)
+
+
+def _details_from_about(username, about):
+    """Same shape as utils.reddit_api.get_reddit_user_details"""
+    return {
+        "screen_name": username,
+        "name": about["name"],
+        "verified": about.get("verified", False),
+        "listed_count": about["comment_karma"] + about["link_karma"],
+        "post_karma": about["link_karma"],
+        "comment_karma": about["comment_karma"],
+        "cake_day": about["created_utc"],
+        "achievements": ["Popular Post", "Buzz-Worthy Post"],
+        "trophy_case": ["Four-Year Club", "Verified Email"],
+        "profile_image": about.get("icon_img")
+    }
+
+
+class AsyncRedditFetcher:
+    """
+    Fetches many redditors concurrently over one shared aiohttp session
+    using application-only OAuth. Use as an async context manager:
+
+        async with AsyncRedditFetcher() as fetcher:
+            results = await fetcher.fetch_users(usernames)
+    """
+
+    def __init__(self, client_id=REDDIT_CLIENT_ID, client_secret=REDDIT_CLIENT_SECRET,
+                 user_agent=REDDIT_USER_AGENT, auth_url=REDDIT_AUTH_URL,
+                 api_base=REDDIT_API_BASE, concurrency=REDDIT_ASYNC_CONCURRENCY,
+                 requests_per_minute=REDDIT_REQUESTS_PER_MINUTE,
+                 timeout=REDDIT_REQUEST_TIMEOUT):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.user_agent = user_agent or 'surakshit-bot-detector'
+        self.auth_url = auth_url
+        self.api_base = api_base.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_minute / 60.0,
+                                  capacity=max(1, concurrency))
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'User-Agent': self.user_agent}
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+
+    async def _get_token(self, force=False):
+        async with self._token_lock:
+            if not force and self._token and time.monotonic() < self._token_expires:
+                return self._token
+            async with self._session.post(
+                    self.auth_url,
+                    data={'grant_type': 'client_credentials'},
+                    auth=aiohttp.BasicAuth(self.client_id or '', self.client_secret or '')) as resp:
+                if resp.status >= 400:
+                    raise FetchError(f"Reddit OAuth returned {resp.status}",
+                                     fallback=True)
+                payload = await resp.json()
+            self._token = payload['access_token']
+            # Refresh a minute early so in-flight requests don't race expiry
+            self._token_expires = time.monotonic() + \
+                max(payload.get('expires_in', 3600) - 60, 60)
+            return self._token
+
+    async def _get_json(self, path):
+        refreshed = False
+        for attempt in range(MAX_RETRIES + 1):
+            token = await self._get_token()
+            await self.bucket.acquire()
+            async with self._semaphore:
+                async with self._session.get(
+                        f"{self.api_base}{path}",
+                        params={'raw_json': 1},
+                        headers={'Authorization': f"bearer {token}"}) as resp:
+                    self.requests += 1
+                    self.bucket.update_from_headers(resp.headers)
+                    if resp.status == 404:
+                        raise UserNotFound(path)
+                    if resp.status == 401 and not refreshed:
+                        refreshed = True
+                        await self._get_token(force=True)
+                        continue
+                    if resp.status == 429 or resp.status >= 500:
+                        if attempt == MAX_RETRIES:
+                            resp.raise_for_status()
+                        self.retries += 1
+                        retry_after = float(resp.headers.get(
+                            'X-Ratelimit-Reset', 2 ** attempt))
+                        await asyncio.sleep(min(retry_after, 60))
+                        continue
+                    resp.raise_for_status()
+                    return await resp.json()
+        raise RuntimeError(f"Giving up on {path} after {MAX_RETRIES} retries")
+
+    async def get_user_details(self, username):
+        if not USERNAME_PATTERN.match(username):
+            raise UserNotFound(username)
+        payload = await self._get_json(f"/user/{quote(username, safe='')}/about")
+        about = payload.get('data') or {}
+        if about.get('is_suspended') or 'link_karma' not in about:
+            raise UserNotFound(username)
+        return _details_from_about(username, about)
+
+    async def fetch_users(self, usernames):
+        """
+        Returns {username: user_data | UserNotFound | FetchError}. A failed
+        lookup never cancels the others
+        """
+        results = await asyncio.gather(
+            *(self.get_user_details(username) for username in usernames),
+            return_exceptions=True
+        )
+        return {username: result if isinstance(result, dict) else _as_fetch_error(result)
+                for username, result in zip(usernames, results)}
+
+
+class _BackgroundFetcher:
+    """
+    One AsyncRedditFetcher per process, on an event loop running in a
+    daemon thread, so its session (connection pool), OAuth token and rate
+    limit bucket are shared by every call. Started lazily and again after
+    a fork, like models.bulk_writer
+    """
+
+    def __init__(self, **fetcher_kwargs):
+        self.fetcher_kwargs = fetcher_kwargs
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._fetcher = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='reddit-async',
+                             daemon=True).start()
+            self._fetcher = asyncio.run_coroutine_threadsafe(
+                AsyncRedditFetcher(**self.fetcher_kwargs).__aenter__(), loop).result()
+            self._loop = loop
+            self._pid = os.getpid()
+
+    def fetch_users(self, usernames):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(
+            self._fetcher.fetch_users(usernames), self._loop).result()
+
+    def iter_users(self, usernames):
+        """(username, user_data | UserNotFound | FetchError) as each lookup completes"""
+        self._ensure_started()
+        futures = {asyncio.run_coroutine_threadsafe(self._fetcher.get_user_details(username),
+                                                    self._loop): username
+                   for username in usernames}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = _as_fetch_error(e)
+            yield futures[future], result
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._fetcher.__aexit__(None, None, None), self._loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Could not close Reddit session: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_background = _BackgroundFetcher()
+atexit.register(_background.close)
+
+
+def fetch_users(usernames):
+    """
+    Synchronous entry point for Flask handlers and scripts; runs on this
+    process's shared fetcher. Returns {username: user_data | UserNotFound
+    | FetchError}
+    """
+    return _background.fetch_users(usernames)
+
+
+def iter_users(usernames):
+    """
+    Like fetch_users, but yields (username, result) pairs in the order the
+    lookups complete
+    """
+    return _background.iter_users(usernames)
@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from utils.singleflight import SingleFlight
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+COALESCED = 'coalesced'
+
+
+class StaleWhileRevalidateCache:
+    """
+    Thread-safe result cache bounded by entry count and approximate bytes
+    (size of the JSON encoding; least recently used entries are evicted
+    first). An entry is fresh for fresh_ttl seconds and then stale until
+    stale_ttl: a stale hit is returned at once and a background refresh is
+    started. Concurrent misses (and refreshes) for the same key share one
+    computation. None results are not cached
+    """
+
+    def __init__(self, maxsize, max_bytes, fresh_ttl, stale_ttl, refresh_workers=2):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = max(stale_ttl, fresh_ttl)
+        self._data = OrderedDict()
+        self._flight = SingleFlight('result_cache')
+        self._refreshing = set()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers,
+                                             thread_name_prefix='cache-refresh')
+        self.counters = {'fresh_hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0,
+                         'refreshes': 0, 'refresh_errors': 0, 'evictions': 0,
+                         'expirations': 0, 'oversized': 0}
+
+    def _store(self, key, value):
+        if value is None:
+            return
+        size = len(json.dumps(value, default=str))
+        now = time.monotonic()
+        with self._lock:
+            if size > self.max_bytes:
+                self.counters['oversized'] += 1
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size, now + self.fresh_ttl, now + self.stale_ttl)
+            self._bytes += size
+            while len(self._data) > self.maxsize or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    def _compute(self, key, compute):
+        value = compute()
+        self._store(key, value)
+        return value
+
+    def _refresh(self, key, compute):
+        try:
+            self._flight.do(key, lambda: self._compute(key, compute))
+        except Exception as e:
+            with self._lock:
+                self.counters['refresh_errors'] += 1
+            logger.warning(f"Background refresh of {key} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_compute(self, key, compute):
+        """
+        (value, status) for key, where status is FRESH, STALE, MISS (this
+        call computed the value) or COALESCED (waited on another caller's
+        computation). Exceptions from compute propagate to every caller
+        waiting on it
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[3] <= now:
+                del self._data[key]
+                self._bytes -= entry[1]
+                self.counters['expirations'] += 1
+                entry = None
+
+            if entry is not None:
+                self._data.move_to_end(key)
+                value, _, fresh_until, _ = entry
+                if fresh_until > now:
+                    self.counters['fresh_hits'] += 1
+                    return value, FRESH
+                self.counters['stale_hits'] += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self.counters['refreshes'] += 1
+                    self._refresher.submit(self._refresh, key, compute)
+                return value, STALE
+
+        value, shared = self._flight.do(key, lambda: self._compute(key, compute))
+        with self._lock:
+            self.counters['coalesced' if shared else 'misses'] += 1
+        return value, COALESCED if shared else MISS
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+            return entry is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            size, used = len(self._data), self._bytes
+            refreshing = len(self._refreshing)
+        in_flight = self._flight.stats()['in_flight']
+        lookups = counters['fresh_hits'] + counters['stale_hits'] + \
+            counters['misses'] + counters['coalesced']
+        hits = counters['fresh_hits'] + counters['stale_hits']
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'bytes': used,
+            'max_bytes': self.max_bytes,
+            'fresh_ttl': self.fresh_ttl,
+            'stale_ttl': self.stale_ttl,
+            'in_flight': in_flight,
+            'refreshing': refreshing,
+            **counters,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            # Requests that did not run the pipeline themselves
+            'saved_rate': round((hits + counters['coalesced']) / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from config import (SINGLEFLIGHT_DISTRIBUTED, SINGLEFLIGHT_LEASE, SINGLEFLIGHT_RESULT_TTL,
+                    SINGLEFLIGHT_POLL_INTERVAL)
+from models import repository
+from models.db import is_available
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """One in-progress call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs fn, the others wait and get its result (or its exception). Nothing
+    is kept once the call returns, so this is not a cache. Results are
+    shared objects; callers that modify them must copy first
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'shared': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _execute(self, key, fn):
+        return fn(), False
+
+    def do(self, key, fn):
+        """(fn() or the result of the identical call in flight, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counters['calls'] += 1
+            else:
+                self.counters['shared'] += 1
+
+        if leader:
+            try:
+                call.value, shared = self._execute(key, fn)
+                if shared:
+                    self._count('shared')
+            except Exception as e:
+                call.error = e
+                self._count('errors')
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+        else:
+            call.done.wait()
+            shared = True
+        if call.error is not None:
+            raise call.error
+        return call.value, shared
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'distributed': False, **self.counters}
+
+
+class MongoSingleFlight(SingleFlight):
+    """
+    SingleFlight across processes. Within a process calls are collapsed as
+    above; the one call per process then takes a lease on a document in
+    the singleflight_locks collection. The lease holder runs fn and writes
+    its result (which must be BSON-encodable) into the document, where the
+    other workers poll for it and keep it for result_ttl seconds. A lease
+    left by a crashed worker is taken over once it expires. Without
+    MongoDB, or if the result cannot be stored, every worker runs fn itself
+    """
+
+    def __init__(self, name, lease=SINGLEFLIGHT_LEASE, result_ttl=SINGLEFLIGHT_RESULT_TTL,
+                 poll_interval=SINGLEFLIGHT_POLL_INTERVAL):
+        super().__init__(name)
+        self.lease = lease
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.counters.update({'remote_shared': 0, 'takeovers': 0, 'wait_timeouts': 0,
+                              'mongo_errors': 0})
+
+    def _acquire(self, collection, doc_id):
+        now = datetime.utcnow()
+        lease = {'owner': self.owner, 'state': 'running',
+                 'expires_at': now + timedelta(seconds=self.lease)}
+        try:
+            collection.insert_one({'_id': doc_id, **lease})
+            return True
+        except DuplicateKeyError:
+            # The holder died or its result expired (the TTL monitor only
+            # removes documents once a minute)
+            taken = collection.find_one_and_update(
+                {'_id': doc_id, 'expires_at': {'$lt': now}},
+                {'$set': lease, '$unset': {'result': ''}})
+            if taken is not None:
+                self._count('takeovers')
+            return taken is not None
+
+    def _publish(self, collection, doc_id, value):
+        try:
+            collection.update_one(
+                {'_id': doc_id, 'owner': self.owner},
+                {'$set': {'state': 'done', 'result': value,
+                          'expires_at': datetime.utcnow() + timedelta(seconds=self.result_ttl)}})
+        except Exception as e:
+            logger.warning(f"Could not share {self.name} result for {doc_id}: {str(e)}")
+            collection.delete_one({'_id': doc_id, 'owner': self.owner})
+
+    def _execute(self, key, fn):
+        if not is_available():
+            return fn(), False
+        collection = repository.collection(repository.SINGLEFLIGHT_LOCKS)
+        doc_id = f"{self.name}:{key}"
+        deadline = time.monotonic() + self.lease
+        try:
+            while True:
+                if self._acquire(collection, doc_id):
+                    break
+                doc = collection.find_one({'_id': doc_id}, {'state': 1, 'result': 1})
+                if doc is not None and doc.get('state') == 'done':
+                    self._count('remote_shared')
+                    return doc.get('result'), True
+                if time.monotonic() >= deadline:
+                    self._count('wait_timeouts')
+                    return fn(), False
+                time.sleep(self.poll_interval)
+        except PyMongoError as e:
+            self._count('mongo_errors')
+            logger.warning(f"Lock collection unavailable, running {self.name} locally: {str(e)}")
+            return fn(), False
+
+        try:
+            value = fn()
+        except Exception:
+            # Let a waiting worker take over instead of sharing the error
+            try:
+                collection.delete_one({'_id': doc_id, 'owner': self.owner})
+            except PyMongoError:
+                self._count('mongo_errors')
+            raise
+        try:
+            self._publish(collection, doc_id, value)
+        except PyMongoError:
+            self._count('mongo_errors')
+        return value, False
+
+    def stats(self):
+        stats = super().stats()
+        stats['distributed'] = True
+        return stats
+
+
+_flights = {}
+
+
+def create_flight(name, distributed=SINGLEFLIGHT_DISTRIBUTED):
+    """
+    A named SingleFlight, MongoDB-backed when distributed; its counters are
+    reported by get_singleflight_stats()
+    """
+    flight = MongoSingleFlight(name) if distributed else SingleFlight(name)
+    _flights[name] = flight
+    return flight
+
+
+def get_singleflight_stats():
+    return {name: flight.stats() for name, flight in _flights.items()}
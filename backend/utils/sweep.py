@@ -0,0 +1,581 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from config import (SWEEP_BATCH_SIZE, SWEEP_QUEUE_SIZE, SWEEP_MAX_RUNNING, SWEEP_CHECKPOINT_DIR,
+                    SWEEP_LEASE, SWEEP_STATUS_TTL, SWEEP_MAX_FINISHED, BATCH_FETCH_WORKERS)
+from models import repository
+from models.db import is_available
+from utils.reddit_api import iter_subreddit_items
+from utils.pipeline import iter_batch_predictions, build_features
+from utils.features import features_as_dict
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KINDS = ('submission', 'comment')
+SUBREDDIT_NAME = re.compile(r'^[A-Za-z0-9_]{2,21}$')
+_SKIPPED_AUTHORS = {None, '[deleted]'}
+_DONE = object()
+
+
+class TooManySweeps(Exception):
+    pass
+
+
+class SeenSet:
+    """
+    Case-insensitive set of usernames kept as 8-byte hashes: a sorted
+    uint64 array plus a small set of recent additions merged into it every
+    merge_every names, so a million authors take about 8 MB
+    """
+
+    def __init__(self, hashes=None, merge_every=4096):
+        self._sorted = np.unique(np.asarray(hashes if hashes is not None else [],
+                                            dtype=np.uint64))
+        self._recent = set()
+        self.merge_every = merge_every
+
+    @staticmethod
+    def _hash(name):
+        digest = hashlib.blake2b(name.lower().encode('utf-8'), digest_size=8).digest()
+        return np.uint64(int.from_bytes(digest, 'little'))
+
+    def _has(self, h):
+        if h in self._recent:
+            return True
+        i = int(np.searchsorted(self._sorted, h))
+        return i < len(self._sorted) and self._sorted[i] == h
+
+    def __contains__(self, name):
+        return self._has(self._hash(name))
+
+    def add(self, name):
+        """Add name; returns False if it was already in the set"""
+        h = self._hash(name)
+        if self._has(h):
+            return False
+        self._recent.add(h)
+        if len(self._recent) >= self.merge_every:
+            self._merge()
+        return True
+
+    def _merge(self):
+        if self._recent:
+            recent = np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent))
+            self._sorted = np.union1d(self._sorted, recent)
+            self._recent.clear()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    @property
+    def nbytes(self):
+        return self._sorted.nbytes + len(self._recent) * 8
+
+    def to_array(self):
+        self._merge()
+        return self._sorted
+
+
+def checkpoint_path(directory, subreddit, start, end):
+    """Checkpoint file of a sweep, named after its subreddit and window"""
+    return os.path.join(directory, f"{subreddit.lower()}_{int(start)}_{int(end)}.json")
+
+
+def load_checkpoint(path):
+    """(state dict, SeenSet of scored authors) from save_checkpoint, or None"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    seen_path = f"{path}.seen.npy"
+    seen = SeenSet(np.load(seen_path) if os.path.exists(seen_path) else None)
+    return state, seen
+
+
+def save_checkpoint(path, state, seen):
+    # The seen array goes first: if the process dies in between, the extra
+    # authors it holds were scored already and are rightly skipped
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, seen.to_array())
+    os.replace(tmp, f"{path}.seen.npy")
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+class Sweep:
+    """
+    Scores every author active in a subreddit between start and end (epoch
+    seconds). A producer thread streams submissions, then comments, newest
+    first, and queues each new author (deduplicated by a SeenSet) on a
+    bounded queue, so reading Reddit never runs far ahead of scoring. The
+    caller's thread takes batch_size authors at a time through the batch
+    fetch and one vectorized predict, and stores the predictions in bulk.
+
+    After every stored batch the checkpoint records the position reached
+    in the stream and the scored authors; a Sweep over the same subreddit
+    and window with the same checkpoint_path continues from there
+    """
+
+    def __init__(self, registry, subreddit, start, end, batch_size=SWEEP_BATCH_SIZE,
+                 queue_size=SWEEP_QUEUE_SIZE, checkpoint_path=None, features=False):
+        if not SUBREDDIT_NAME.match(subreddit or ''):
+            raise ValueError(f"Invalid subreddit name: {subreddit}")
+        if start >= end:
+            raise ValueError("start must be before end")
+        self.id = uuid.uuid4().hex
+        self.registry = registry
+        self.subreddit = subreddit
+        self.start = float(start)
+        self.end = float(end)
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.features = features
+        self.state = 'pending'
+        self.error = None
+        self.resumed = False
+        self.cursor = None
+        self.done_kinds = []
+        self.counters = {'items_read': 0, 'authors_queued': 0, 'authors_scored': 0,
+                         'bots': 0, 'not_found': 0, 'errors': 0, 'batches': 0}
+        # Counters restored from a checkpoint, left out of the rates
+        self._baseline = dict(self.counters)
+        self.max_queue_depth = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._seen = SeenSet()
+        self._scored = SeenSet()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._finished_at = None
+
+    def cancel(self):
+        self._stop.set()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _resume(self):
+        loaded = load_checkpoint(self.checkpoint_path)
+        if loaded is None:
+            return
+        state, scored = loaded
+        if (state['subreddit'].lower(), state['start'], state['end']) != \
+                (self.subreddit.lower(), self.start, self.end):
+            raise ValueError(f"Checkpoint {self.checkpoint_path} is for another sweep")
+        self.cursor = state['cursor']
+        self.done_kinds = state['done_kinds']
+        self.counters.update(state['counters'])
+        # Authors queued but not scored before the restart are queued again
+        self.counters['authors_queued'] = self.counters['authors_scored']
+        self._baseline = dict(self.counters)
+        self._scored = scored
+        self._seen = SeenSet(scored.to_array())
+        self.resumed = True
+        logger.info(f"Resuming sweep of r/{self.subreddit} at {self.cursor} "
+                    f"({len(scored)} authors already scored)")
+
+    def _checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            state = {
+                'subreddit': self.subreddit,
+                'start': self.start,
+                'end': self.end,
+                'cursor': self.cursor,
+                'done_kinds': list(self.done_kinds),
+                'counters': dict(self.counters),
+                'updated_at': datetime.utcnow().isoformat()
+            }
+        save_checkpoint(self.checkpoint_path, state, self._scored)
+
+    def _put(self, entry):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=0.5)
+                depth = self._queue.qsize()
+                if depth > self.max_queue_depth:
+                    self.max_queue_depth = depth
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for kind in KINDS:
+                if kind in self.done_kinds:
+                    continue
+                # Everything newer than the cursor was scored before the restart
+                end = self.cursor[1] if self.cursor and self.cursor[0] == kind else self.end
+                for item in iter_subreddit_items(self.subreddit, self.start, end, kind):
+                    if self._stop.is_set():
+                        return
+                    self._count('items_read')
+                    author = item['author']
+                    if author in _SKIPPED_AUTHORS or not self._seen.add(author):
+                        continue
+                    self._count('authors_queued')
+                    if not self._put((author, kind, item['created_utc'])):
+                        return
+                # Marks the end of this kind's stream for the checkpoint
+                if not self._put((None, kind, None)):
+                    return
+        except Exception as e:
+            logger.error(f"Sweep of r/{self.subreddit} stopped reading: {str(e)}")
+            self.error = str(e)
+        finally:
+            self._put(_DONE)
+
+    def _extended_features(self, results):
+        found = [result for result in results if "error" not in result]
+        workers = max(1, min(BATCH_FETCH_WORKERS, len(found)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            vectors = executor.map(lambda result: build_features(result)[0], found)
+            for result, vector in zip(found, vectors):
+                result["features"] = features_as_dict(vector)
+
+    def _score_batch(self, batch):
+        results = list(iter_batch_predictions(self.registry, [entry[0] for entry in batch]))
+        if self.features:
+            self._extended_features(results)
+
+        predictions = []
+        for result in results:
+            if "error" in result:
+                self._count('not_found' if result.get("status") == 404 else 'errors')
+                continue
+            predictions.append({
+                "username": result["screen_name"],
+                "prediction": result["is_bot"],
+                "bot_probability": result.get("bot_probability"),
+                "model_version": result["model_version"],
+                "features": result.pop("features", None),
+                "subreddit": self.subreddit,
+                "timestamp": datetime.utcnow(),
+                "user_data": {k: v for k, v in result.items()
+                              if k not in ("is_bot", "bot_probability", "model_version")}
+            })
+            self._count('bots', int(result["is_bot"]))
+        repository.save_predictions(predictions)
+
+        for username, _, _ in batch:
+            self._scored.add(username)
+        with self._lock:
+            self.counters['authors_scored'] += len(batch)
+            self.counters['batches'] += 1
+            self.cursor = [batch[-1][1], batch[-1][2]]
+        self._checkpoint()
+
+    def run(self):
+        """Run the sweep to the end (or until cancel()); returns stats()"""
+        self._started_at = time.monotonic()
+        self.state = 'running'
+        try:
+            self._resume()
+            producer = threading.Thread(target=self._produce, daemon=True,
+                                        name=f"sweep-{self.id[:8]}")
+            producer.start()
+            batch = []
+            while not self._stop.is_set():
+                try:
+                    entry = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    # Reddit is slower than scoring: store what we have
+                    if batch:
+                        self._score_batch(batch)
+                        batch = []
+                    continue
+                if entry is _DONE:
+                    break
+                if entry[0] is None:
+                    if batch:
+                        self._score_batch(batch)
+                        batch = []
+                    self.done_kinds.append(entry[1])
+                    self._checkpoint()
+                    continue
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    self._score_batch(batch)
+                    batch = []
+            if batch and not self._stop.is_set():
+                self._score_batch(batch)
+
+            if self._stop.is_set():
+                self.state = 'cancelled'
+            else:
+                self.state = 'failed' if self.error else 'done'
+        except Exception as e:
+            logger.error(f"Sweep of r/{self.subreddit} failed: {str(e)}")
+            self.error = str(e)
+            self.state = 'failed'
+        finally:
+            # Unblocks the producer if scoring failed
+            self._stop.set()
+            self._finished_at = time.monotonic()
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            cursor = self.cursor
+        if self._started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished_at or time.monotonic()) - self._started_at
+        return {
+            'id': self.id,
+            'subreddit': self.subreddit,
+            'start': self.start,
+            'end': self.end,
+            'state': self.state,
+            'error': self.error,
+            'resumed': self.resumed,
+            'cursor': cursor,
+            'done_kinds': list(self.done_kinds),
+            **counters,
+            'elapsed_s': round(elapsed, 1),
+            'items_per_s': round((counters['items_read'] - self._baseline['items_read'])
+                                 / elapsed, 1) if elapsed else None,
+            'authors_per_s': round((counters['authors_scored'] - self._baseline['authors_scored'])
+                                   / elapsed, 1) if elapsed else None,
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'seen_bytes': self._seen.nbytes
+        }
+
+
+class SweepManager:
+    """
+    Runs sweeps started through the API on background threads, at most
+    max_running at a time. Checkpoints are named after the subreddit and
+    window, so starting the same sweep again resumes it.
+
+    With MongoDB the limits hold across workers: a sweep takes a lease on
+    its window and on one of max_running slots in sweep_leases, which the
+    worker running it renews every lease / 3 seconds while publishing its
+    stats to the sweeps collection. Any worker answers get() and list()
+    from there, and cancel() on another worker sets a flag the running
+    worker acts on at its next renewal. Leases of a worker that died
+    expire after lease seconds. Without MongoDB every worker only knows
+    (and limits) its own sweeps.
+
+    Finished sweeps stay in memory for finished_ttl seconds, at most
+    max_finished of them (the most recent)
+    """
+
+    def __init__(self, max_running, checkpoint_dir, lease=SWEEP_LEASE,
+                 finished_ttl=SWEEP_STATUS_TTL, max_finished=SWEEP_MAX_FINISHED):
+        self.max_running = max_running
+        self.checkpoint_dir = checkpoint_dir
+        self.lease = lease
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self._sweeps = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self, registry, subreddit, start, end, **options):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        sweep = Sweep(registry, subreddit, start, end,
+                      checkpoint_path=checkpoint_path(self.checkpoint_dir, subreddit or '',
+                                                      start, end), **options)
+        with self._lock:
+            self._prune()
+            running = [s for s in self._sweeps.values() if s.state in ('pending', 'running')]
+            if len(running) >= self.max_running:
+                raise TooManySweeps(f"Too many running sweeps (max {self.max_running})")
+            if any(s.checkpoint_path == sweep.checkpoint_path for s in running):
+                raise TooManySweeps(f"A sweep of r/{subreddit} over this window is running")
+            if is_available():
+                self._leases[sweep.id] = self._acquire_leases(sweep)
+            self._sweeps[sweep.id] = sweep
+        self._publish(sweep)
+        self._ensure_heartbeat()
+        threading.Thread(target=self._run, args=(sweep,), daemon=True,
+                         name=f"sweep-{sweep.id[:8]}").start()
+        return sweep
+
+    def _prune(self):
+        """Forget finished sweeps past finished_ttl or beyond max_finished; holds _lock"""
+        finished = sorted((s for s in self._sweeps.values() if s._finished_at is not None),
+                          key=lambda s: s._finished_at, reverse=True)
+        cutoff = time.monotonic() - self.finished_ttl
+        for i, sweep in enumerate(finished):
+            if i >= self.max_finished or sweep._finished_at < cutoff:
+                del self._sweeps[sweep.id]
+
+    def _run(self, sweep):
+        try:
+            sweep.run()
+        finally:
+            self._publish(sweep)
+            self._release(sweep)
+
+    def _acquire(self, collection, lease_id, owner):
+        now = datetime.utcnow()
+        lease = {'owner': owner, 'expires_at': now + timedelta(seconds=self.lease)}
+        try:
+            collection.insert_one({'_id': lease_id, **lease})
+            return True
+        except DuplicateKeyError:
+            # Left by a worker that died (the TTL monitor runs once a minute)
+            return collection.find_one_and_update(
+                {'_id': lease_id, 'expires_at': {'$lt': now}}, {'$set': lease}) is not None
+
+    def _acquire_leases(self, sweep):
+        """Lease ids taken for sweep; raises TooManySweeps"""
+        collection = repository.collection(repository.SWEEP_LEASES)
+        window = f"window:{os.path.basename(sweep.checkpoint_path)}"
+        try:
+            if not self._acquire(collection, window, sweep.id):
+                raise TooManySweeps(f"A sweep of r/{sweep.subreddit} over this window is running")
+            for slot in range(self.max_running):
+                if self._acquire(collection, f"slot:{slot}", sweep.id):
+                    return [window, f"slot:{slot}"]
+            collection.delete_one({'_id': window, 'owner': sweep.id})
+        except PyMongoError as e:
+            logger.warning(f"Sweep leases unavailable, limiting this worker only: {str(e)}")
+            return []
+        raise TooManySweeps(f"Too many running sweeps (max {self.max_running})")
+
+    def _release(self, sweep):
+        with self._lock:
+            leases = self._leases.pop(sweep.id, [])
+        if not leases:
+            return
+        try:
+            repository.collection(repository.SWEEP_LEASES).delete_many(
+                {'_id': {'$in': leases}, 'owner': sweep.id})
+        except PyMongoError as e:
+            logger.warning(f"Could not release leases of sweep {sweep.id}: {str(e)}")
+
+    def _publish(self, sweep):
+        """Write sweep's stats to the sweeps collection; True if a cancel was requested"""
+        if not is_available():
+            return False
+        try:
+            doc = repository.collection(repository.SWEEPS).find_one_and_update(
+                {'_id': sweep.id},
+                {'$set': {**sweep.stats(), 'pid': os.getpid(), 'updated_at': datetime.utcnow()},
+                 '$setOnInsert': {'cancel_requested': False}},
+                upsert=True, projection={'cancel_requested': 1})
+        except PyMongoError as e:
+            logger.warning(f"Could not publish sweep {sweep.id}: {str(e)}")
+            return False
+        return bool(doc and doc.get('cancel_requested'))
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                active = [(sweep, self._leases.get(sweep.id, []))
+                          for sweep in self._sweeps.values()
+                          if sweep.state in ('pending', 'running')]
+            for sweep, leases in active:
+                if self._publish(sweep):
+                    logger.info(f"Cancelling sweep {sweep.id} as requested")
+                    sweep.cancel()
+                if not leases:
+                    continue
+                try:
+                    renewed = repository.collection(repository.SWEEP_LEASES).update_many(
+                        {'_id': {'$in': leases}, 'owner': sweep.id},
+                        {'$set': {'expires_at': datetime.utcnow() + timedelta(seconds=self.lease)}})
+                    if renewed.matched_count < len(leases) and sweep.state == 'running':
+                        logger.warning(f"Sweep {sweep.id} lost its lease")
+                except PyMongoError as e:
+                    logger.warning(f"Could not renew leases of sweep {sweep.id}: {str(e)}")
+
+    def _ensure_heartbeat(self):
+        # One renewal thread per process, started again after a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._heartbeat, daemon=True, name='sweep-heartbeat').start()
+            self._pid = os.getpid()
+
+    def _shared_stats(self, doc):
+        doc = dict(doc)
+        doc.pop('_id', None)
+        doc.pop('cancel_requested', None)
+        updated_at = doc.pop('updated_at', None)
+        # Nobody has renewed it: its worker died
+        if doc.get('state') in ('pending', 'running') and updated_at is not None and \
+                updated_at < datetime.utcnow() - timedelta(seconds=self.lease):
+            doc['state'] = 'lost'
+        return doc
+
+    def _find_shared(self, sweep_id):
+        if not is_available():
+            return None
+        try:
+            doc = repository.collection(repository.SWEEPS).find_one({'_id': sweep_id})
+        except PyMongoError as e:
+            logger.warning(f"Could not read sweep {sweep_id}: {str(e)}")
+            return None
+        return self._shared_stats(doc) if doc else None
+
+    def get(self, sweep_id):
+        """stats() of a sweep started on any worker, or None"""
+        with self._lock:
+            sweep = self._sweeps.get(sweep_id)
+        if sweep is not None:
+            return sweep.stats()
+        return self._find_shared(sweep_id)
+
+    def cancel(self, sweep_id):
+        """
+        Stop a sweep; one running on another worker stops at that worker's
+        next lease renewal. Returns its stats, or None if unknown
+        """
+        with self._lock:
+            sweep = self._sweeps.get(sweep_id)
+        if sweep is not None:
+            sweep.cancel()
+            return sweep.stats()
+        if not is_available():
+            return None
+        try:
+            repository.collection(repository.SWEEPS).update_one(
+                {'_id': sweep_id}, {'$set': {'cancel_requested': True}})
+        except PyMongoError as e:
+            logger.warning(f"Could not cancel sweep {sweep_id}: {str(e)}")
+            return None
+        return self._find_shared(sweep_id)
+
+    def list(self):
+        with self._lock:
+            self._prune()
+            local = {sweep.id: sweep.stats() for sweep in self._sweeps.values()}
+        shared = []
+        if is_available():
+            try:
+                shared = [self._shared_stats(doc) for doc in repository.collection(
+                    repository.SWEEPS).find({'_id': {'$nin': list(local)}})]
+            except PyMongoError as e:
+                logger.warning(f"Could not list sweeps: {str(e)}")
+        return list(local.values()) + shared
+
+
+sweeps = SweepManager(SWEEP_MAX_RUNNING, SWEEP_CHECKPOINT_DIR)
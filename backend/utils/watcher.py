@@ -0,0 +1,299 @@
+from collections import OrderedDict, Counter
+from datetime import datetime
+from config import (WATCH_MAX_AUTHORS, WATCH_WINDOW_SIZE, WATCH_RATE_WINDOW,
+                    WATCH_RATE_THRESHOLD, WATCH_REPEAT_THRESHOLD, WATCH_IDLE_TTL,
+                    WATCH_SCORE_COOLDOWN, WATCH_SCORE_BATCH_SIZE, WATCH_SCORE_INTERVAL)
+from models import repository
+from utils.pipeline import iter_batch_predictions
+import json
+import logging
+import numpy as np
+import re
+import time
+import zlib
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RATE = 'rate'
+REPETITION = 'repetition'
+_SKIPPED_AUTHORS = {None, '[deleted]'}
+# Bodies of removed comments repeat without saying anything about the author
+_SKIPPED_BODIES = {'', '[removed]', '[deleted]'}
+_SPACE = re.compile(r'\s+')
+
+
+def text_hash(body):
+    """crc32 of the lower-cased, whitespace-collapsed body; 0 for no text"""
+    text = _SPACE.sub(' ', (body or '').lower()).strip()
+    if text in _SKIPPED_BODIES:
+        return 0
+    return zlib.crc32(text.encode('utf-8')) or 1
+
+
+class AuthorWindows:
+    """
+    The last window_size comments of up to max_authors authors, in
+    preallocated arrays: one row per author holding a ring buffer of
+    comment times (uint32 epoch seconds) and text hashes (uint32). Memory is
+    fixed at about max_authors * window_size * 8 bytes whatever the traffic.
+    Rows are assigned in least recently active order: authors idle for
+    idle_ttl seconds are dropped as time advances, and when every row is in
+    use the least recently active author gives up its row
+    """
+
+    def __init__(self, max_authors, window_size, idle_ttl):
+        self.max_authors = max_authors
+        self.window_size = window_size
+        self.idle_ttl = idle_ttl
+        self.times = np.zeros((max_authors, window_size), dtype=np.uint32)
+        self.hashes = np.zeros((max_authors, window_size), dtype=np.uint32)
+        self.heads = np.zeros(max_authors, dtype=np.uint16)
+        self.counts = np.zeros(max_authors, dtype=np.uint16)
+        self.last_seen = np.zeros(max_authors, dtype=np.uint32)
+        self.last_scored = np.zeros(max_authors, dtype=np.uint32)
+        # author -> row, least recently active first
+        self._rows = OrderedDict()
+        self._free = list(range(max_authors - 1, -1, -1))
+        self.evicted_idle = 0
+        self.evicted_full = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.times, self.hashes, self.heads, self.counts,
+                                      self.last_seen, self.last_scored))
+
+    def _release(self, author):
+        self._free.append(self._rows.pop(author))
+
+    def expire(self, now):
+        """Drop authors idle for idle_ttl seconds before now"""
+        cutoff = now - self.idle_ttl
+        while self._rows:
+            author, row = next(iter(self._rows.items()))
+            if self.last_seen[row] >= cutoff:
+                break
+            self._release(author)
+            self.evicted_idle += 1
+
+    def row(self, author):
+        row = self._rows.get(author)
+        if row is not None:
+            self._rows.move_to_end(author)
+            return row
+        if not self._free:
+            self._release(next(iter(self._rows)))
+            self.evicted_full += 1
+        row = self._free.pop()
+        self.heads[row] = 0
+        self.counts[row] = 0
+        self.last_seen[row] = 0
+        self.last_scored[row] = 0
+        self._rows[author] = row
+        return row
+
+    def add(self, author, created, text_hash):
+        """Record a comment; returns the author's row"""
+        row = self.row(author)
+        head = self.heads[row]
+        self.times[row, head] = created
+        self.hashes[row, head] = text_hash
+        self.heads[row] = (head + 1) % self.window_size
+        self.counts[row] = min(self.counts[row] + 1, self.window_size)
+        self.last_seen[row] = max(self.last_seen[row], created)
+        return row
+
+    def recent(self, row, since):
+        """Comments in the row's window at or after since"""
+        count = self.counts[row]
+        return int((self.times[row, :count] >= since).sum())
+
+    def repeats(self, row, text_hash, since):
+        """Comments in the row's window at or after since with this text"""
+        if not text_hash:
+            return 0
+        count = self.counts[row]
+        return int(((self.hashes[row, :count] == text_hash) &
+                    (self.times[row, :count] >= since)).sum())
+
+
+class CommentWatcher:
+    """
+    Follows a stream of comments (live or replayed, see read_event_file)
+    and keeps per-author sliding windows in AuthorWindows. An author with
+    rate_threshold comments within rate_window seconds, or repeat_threshold
+    copies of the same text in that window, is queued for scoring; scoring
+    runs in batches of score_batch_size (or every score_interval seconds)
+    through the batch prediction pipeline and is stored like any other
+    prediction. An author is scored again only after cooldown seconds. With
+    score=False triggers are only counted (dry run, no Reddit calls)
+    """
+
+    def __init__(self, registry, subreddit=None, score=True, max_authors=WATCH_MAX_AUTHORS,
+                 window_size=WATCH_WINDOW_SIZE, rate_window=WATCH_RATE_WINDOW,
+                 rate_threshold=WATCH_RATE_THRESHOLD, repeat_threshold=WATCH_REPEAT_THRESHOLD,
+                 idle_ttl=WATCH_IDLE_TTL, cooldown=WATCH_SCORE_COOLDOWN,
+                 score_batch_size=WATCH_SCORE_BATCH_SIZE, score_interval=WATCH_SCORE_INTERVAL):
+        self.registry = registry
+        self.subreddit = subreddit
+        self.score = score
+        self.rate_window = rate_window
+        self.rate_threshold = rate_threshold
+        self.repeat_threshold = repeat_threshold
+        self.cooldown = cooldown
+        self.score_batch_size = score_batch_size
+        self.score_interval = score_interval
+        self.windows = AuthorWindows(max_authors, window_size, idle_ttl)
+        self._pending = OrderedDict()
+        self._last_flush = time.monotonic()
+        self._started_at = time.monotonic()
+        self.now = 0
+        self.counters = Counter(events=0, skipped=0, triggers=0, scored=0, bots=0,
+                                not_found=0, errors=0, batches=0)
+        self.triggers_by_reason = Counter()
+
+    def process(self, event):
+        """Account for one comment; returns the trigger reason or None"""
+        author = event.get('author')
+        if author in _SKIPPED_AUTHORS:
+            self.counters['skipped'] += 1
+            return None
+        self.counters['events'] += 1
+        if self.subreddit is None:
+            self.subreddit = event.get('subreddit')
+        created = int(event['created_utc'])
+        if created > self.now:
+            self.now = created
+            self.windows.expire(created)
+
+        h = text_hash(event.get('body'))
+        row = self.windows.add(author, created, h)
+        since = created - self.rate_window
+        reason = None
+        if self.windows.recent(row, since) >= self.rate_threshold:
+            reason = RATE
+        elif self.windows.repeats(row, h, since) >= self.repeat_threshold:
+            reason = REPETITION
+        if reason is None or author in self._pending:
+            return None
+        last = int(self.windows.last_scored[row])
+        if last and created - last < self.cooldown:
+            return None
+
+        self.windows.last_scored[row] = created
+        self.counters['triggers'] += 1
+        self.triggers_by_reason[reason] += 1
+        self._pending[author] = {
+            'reason': reason,
+            'recent': self.windows.recent(row, since),
+            'repeats': self.windows.repeats(row, h, since),
+            'at': created
+        }
+        if len(self._pending) >= self.score_batch_size:
+            self.flush()
+        return reason
+
+    def flush(self):
+        """Score the queued authors; returns their results"""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return []
+        pending, self._pending = self._pending, OrderedDict()
+        if not self.score:
+            return []
+
+        self.counters['batches'] += 1
+        results = list(iter_batch_predictions(self.registry, list(pending)))
+        predictions = []
+        for result in results:
+            if "error" in result:
+                self.counters['not_found' if result.get("status") == 404 else 'errors'] += 1
+                continue
+            trigger = pending.get(result["screen_name"])
+            self.counters['scored'] += 1
+            if result["is_bot"]:
+                self.counters['bots'] += 1
+                logger.warning(f"Likely bot u/{result['screen_name']} "
+                               f"(p={result.get('bot_probability')}, trigger {trigger})")
+            predictions.append({
+                "username": result["screen_name"],
+                "prediction": result["is_bot"],
+                "bot_probability": result.get("bot_probability"),
+                "model_version": result["model_version"],
+                "subreddit": self.subreddit,
+                "trigger": trigger,
+                "timestamp": datetime.utcnow(),
+                "user_data": {k: v for k, v in result.items()
+                              if k not in ("is_bot", "bot_probability", "model_version")}
+            })
+        repository.save_predictions(predictions)
+        return results
+
+    def run(self, events, stop=None, on_event=None):
+        """
+        Process events until they run out or stop() returns True. Queued
+        authors are scored every score_interval seconds even when the
+        stream is quiet (sources may yield None as a heartbeat)
+        """
+        for event in events:
+            if event is not None:
+                self.process(event)
+                if on_event is not None:
+                    on_event(event)
+            if self._pending and time.monotonic() - self._last_flush >= self.score_interval:
+                self.flush()
+            if stop is not None and stop():
+                break
+        self.flush()
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started_at
+        return {
+            'subreddit': self.subreddit,
+            **self.counters,
+            'triggers_by_reason': dict(self.triggers_by_reason),
+            'pending': len(self._pending),
+            'events_per_s': round(self.counters['events'] / elapsed, 1) if elapsed else None,
+            'authors_tracked': len(self.windows),
+            'max_authors': self.windows.max_authors,
+            'evicted_idle': self.windows.evicted_idle,
+            'evicted_full': self.windows.evicted_full,
+            'window_bytes': self.windows.nbytes,
+            'stream_time': self.now
+        }
+
+
+def read_event_file(path, speed=0):
+    """
+    Replay comments from a JSON-lines file (one stream_subreddit_comments
+    dict per line). speed=0 replays as fast as possible; otherwise the
+    gaps between created_utc values are reproduced, divided by speed
+    """
+    previous = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if speed and previous is not None:
+                time.sleep(max(event['created_utc'] - previous, 0) / speed)
+            previous = event['created_utc']
+            yield event
+
+
+class EventRecorder:
+    """Appends events to a JSON-lines file that read_event_file can replay"""
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+
+    def __call__(self, event):
+        self._file.write(json.dumps(event) + '\n')
+
+    def close(self):
+        self._file.close()
@@ -1,14 +1,12 @@
-from pymongo import MongoClient
 from dotenv import load_dotenv
-import os
+from models.db import get_db
 from datetime import datetime
 
 # Load environment variables
 load_dotenv()
 
 # Connect to MongoDB
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client.bot_detector
+db = get_db()
 
 def print_collection(collection_name):
     print(f"\n=== {collection_name.upper()} ===")
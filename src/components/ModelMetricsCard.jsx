@@ -2,10 +2,12 @@ import React, { useState, useEffect } from 'react';
 import { BarChart, Bar, XAxis, YAxis, ResponsiveContainer, Cell } from 'recharts';
 import { Activity, AlertTriangle, CheckCircle, Zap } from 'lucide-react';
 
+// accuracy, precision and recall are percentages, or null when the model
+// has no held-out data to measure them on
 export const ModelMetricsCard = ({
-    accuracy = 92,
-    precision = 94,
-    recall = 91,
+    accuracy = null,
+    precision = null,
+    recall = null,
     activityScore = 6.2
 }) => {
     const [values, setValues] = useState({
@@ -23,11 +25,12 @@ export const ModelMetricsCard = ({
         const animate = () => {
             frame++;
             const progress = frame / totalFrames;
+            const scale = (score) => (score == null ? null : Math.floor(score * progress));
 
             setValues({
-                accuracy: Math.floor(accuracy * progress),
-                precision: Math.floor(precision * progress),
-                recall: Math.floor(recall * progress),
+                accuracy: scale(accuracy),
+                precision: scale(precision),
+                recall: scale(recall),
                 activityScore: parseFloat((activityScore * progress).toFixed(1))
             });
 
@@ -44,6 +47,7 @@ export const ModelMetricsCard = ({
     }, [accuracy, precision, recall, activityScore]);
 
     const getScoreColor = (score) => {
+        if (score == null) return '#6B7280';
         if (score >= 90) return '#22c55e';
         if (score >= 70) return '#eab308';
         return '#ef4444';
@@ -56,6 +60,7 @@ export const ModelMetricsCard = ({
     };
 
     const getScoreIcon = (score) => {
+        if (score == null) return null;
         if (score >= 90) return <CheckCircle className="h-4 w-4 text-green-500" />;
         if (score >= 70) return <AlertTriangle className="h-4 w-4 text-yellow-500" />;
         return <AlertTriangle className="h-4 w-4 text-red-500" />;
@@ -69,11 +74,13 @@ export const ModelMetricsCard = ({
 
     // Format data for bar chart
     const chartData = [
-        { name: 'Accuracy', value: values.accuracy, color: getScoreColor(values.accuracy) },
-        { name: 'Precision', value: values.precision, color: getScoreColor(values.precision) },
-        { name: 'Recall', value: values.recall, color: getScoreColor(values.recall) }
+        { name: 'Accuracy', value: values.accuracy ?? 0, color: getScoreColor(values.accuracy) },
+        { name: 'Precision', value: values.precision ?? 0, color: getScoreColor(values.precision) },
+        { name: 'Recall', value: values.recall ?? 0, color: getScoreColor(values.recall) }
     ];
 
+    const formatScore = (score) => (score == null ? 'n/a' : `${score}%`);
+
     return (
         <div className="card p-4 h-100">
             <div className="flex items-center mb-2">
@@ -112,7 +119,7 @@ export const ModelMetricsCard = ({
                         <p className="text-xs text-gray-500 font-mono">ACCURACY</p>
                         <div className="flex items-center">
                             <p className="font-mono text-lg" style={{ color: getScoreColor(values.accuracy) }}>
-                                {values.accuracy}%
+                                {formatScore(values.accuracy)}
                             </p>
                             <div className="ml-2">{getScoreIcon(values.accuracy)}</div>
                         </div>
@@ -125,7 +132,7 @@ export const ModelMetricsCard = ({
                         <p className="text-xs text-gray-500 font-mono">PRECISION</p>
                         <div className="flex items-center">
                             <p className="font-mono text-lg" style={{ color: getScoreColor(values.precision) }}>
-                                {values.precision}%
+                                {formatScore(values.precision)}
                             </p>
                             <div className="ml-2">{getScoreIcon(values.precision)}</div>
                         </div>
@@ -138,7 +145,7 @@ export const ModelMetricsCard = ({
                         <p className="text-xs text-gray-500 font-mono">RECALL</p>
                         <div className="flex items-center">
                             <p className="font-mono text-lg" style={{ color: getScoreColor(values.recall) }}>
-                                {values.recall}%
+                                {formatScore(values.recall)}
                             </p>
                             <div className="ml-2">{getScoreIcon(values.recall)}</div>
                         </div>
@@ -77,7 +77,10 @@ export const HomePage = () => {
             setTimeout(() => addConsoleText("GENERATING BEHAVIOR ANALYSIS..."), 2000);
 
             // Step 2: Generate report
-            const reportResponse = await api.generateReport(userData);
+            const reportResponse = await api.generateReport(userData, (analysis) => {
+                setReport(analysis);
+                addConsoleText("LOCAL ANALYSIS READY // AWAITING AI REPORT...");
+            });
             setReport(reportResponse.report);
 
             setTimeout(() => addConsoleText("ANALYSIS COMPLETE"), 2500);
@@ -215,9 +218,9 @@ export const HomePage = () => {
 
                             {/* Third Row */}
                             <ModelMetricsCard
-                                accuracy={report?.modelMetrics?.accuracy || 92}
-                                precision={report?.modelMetrics?.precision || 94}
-                                recall={report?.modelMetrics?.recall || 91}
+                                accuracy={report?.accuracy ?? null}
+                                precision={report?.precision ?? null}
+                                recall={report?.recall ?? null}
                                 activityScore={report?.activityScore || 6.2}
                             />
                             <AccountMetrics
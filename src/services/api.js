@@ -1,6 +1,8 @@
 import axios from 'axios';
 
 const API_URL = 'https://surakshit-bot-detection-and-reporting.onrender.com/api';
+const REPORT_POLL_INTERVAL_MS = 1000;
+const REPORT_POLL_ATTEMPTS = 60;
 
 export const api = {
   predict: async (screenName) => {
@@ -13,10 +15,46 @@ export const api = {
     }
   },
 
-  generateReport: async (userData) => {
+  // onAnalysis receives the local analysis as soon as the server has it; the
+  // returned report replaces it, or is that analysis when the AI report
+  // fails or takes too long
+  generateReport: async (userData, onAnalysis = () => {}) => {
     try {
       const response = await axios.post(`${API_URL}/generate-report`, { userData });
-      return response.data;
+      if (response.data.report) {
+        return response.data;
+      }
+
+      const { analysis } = response.data;
+      if (analysis) {
+        onAnalysis(analysis);
+      }
+      const fallback = (reason) => {
+        if (!analysis) {
+          throw new Error(reason);
+        }
+        console.warn(`${reason}, keeping the local analysis`);
+        return { message: 'Local analysis', report: analysis, fallback: true };
+      };
+
+      // Report is generated in the background: poll the job until it finishes
+      const jobId = response.data.job_id;
+      for (let attempt = 0; attempt < REPORT_POLL_ATTEMPTS; attempt++) {
+        await new Promise((resolve) => setTimeout(resolve, REPORT_POLL_INTERVAL_MS));
+        let job;
+        try {
+          job = await axios.get(`${API_URL}/reports/${jobId}`);
+        } catch (pollError) {
+          return fallback(`Polling report failed: ${pollError.message}`);
+        }
+        if (job.data.status === 'done') {
+          return { message: 'Report generated successfully', report: job.data.report };
+        }
+        if (job.data.status === 'failed') {
+          return fallback(job.data.error || 'Report generation failed');
+        }
+      }
+      return fallback('Timed out waiting for report');
     } catch (error) {
       console.error('Error generating report:', error);
       throw error;